@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+# End-to-end stick-to-serial latency benchmark
+# Licensed under GPL-3.0
+# ---
+# Drives every controller profile (gamepad_*.py) against the VISCA camera simulator
+# with synthetic joystick events, and measures how long it takes from an event
+# being posted to the first byte of the resulting packet arriving on the serial line.
+#
+# Usage:
+#   python benchmarks/bench_latency.py [--profiles taffgo xbox360] [--output results.json]
+#
+# The results are printed (or written) as JSON, so that two versions can be compared.
+
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ptz_gamepad import log
+from ptz_gamepad.inputs import listening
+from ptz_gamepad.simulator import UdpViscaSimulator
+from ptz_gamepad.simulator import ViscaSimulator
+from threading import Thread
+import argparse
+import contextlib
+import importlib
+import json
+import math
+import pygame
+import random
+import time
+
+PROFILES = ('taffgo', 'xbox360', 'ps4', 'microntek')
+
+# Rate at which the scenarios post stick events, like a gamepad polled at 100 Hz
+EVENT_RATE = 100
+# Quiet time after each scenario, so that the last commands can go out
+SETTLE_TIME = 0.5
+# How long a script may take to open its port and listen for the gamepad (in second)
+STARTUP_TIMEOUT = 10.0
+
+class FakeJoystick(object):
+    ''' Stands in for pygame.joystick.Joystick: an idle gamepad with its triggers released. '''
+    
+    def __init__(self, instance_id=0):
+        self.instance_id = instance_id
+    
+    def get_instance_id(self):
+        return self.instance_id
+    
+    def get_name(self):
+        return 'Xbox 360 Controller'
+    
+    def get_guid(self):
+        return '030000005e0400008e02000014010000'
+    
+    def get_numaxes(self):
+        return 6
+    
+    def get_numbuttons(self):
+        return 16
+    
+    def get_numhats(self):
+        return 1
+    
+    def get_axis(self, i):
+        # The analog triggers rest at -1.
+        return -1.0 if i in (4, 5) else 0.0
+    
+    def get_button(self, i):
+        return 0
+    
+    def get_hat(self, i):
+        return (0, 0)
+
+# ---
+# Scenarios: each one yields (offset in seconds, event type, event attributes)
+
+def _axis(axis, value):
+    return (pygame.JOYAXISMOTION, {'instance_id': 0, 'axis': axis, 'value': value})
+
+def _button(button, pressed):
+    event_type = pygame.JOYBUTTONDOWN if pressed else pygame.JOYBUTTONUP
+    return (event_type, {'instance_id': 0, 'button': button})
+
+def sweep(duration=2.0):
+    ''' Left stick from full left to full right and back. '''
+    count = int(duration * EVENT_RATE)
+    for i in range(count + 1):
+        phase = i / count
+        value = -1.0 + 4.0 * phase if phase <= 0.5 else 3.0 - 4.0 * phase
+        yield (i / EVENT_RATE,) + _axis(0, value)
+    yield ((count + 1) / EVENT_RATE,) + _axis(0, 0.0)
+
+def hold(duration=2.0):
+    ''' Left stick held at 60 %, with the jitter of a real potentiometer. '''
+    rng = random.Random(8)
+    count = int(duration * EVENT_RATE)
+    for i in range(count):
+        yield (i / EVENT_RATE,) + _axis(0, 0.6 + rng.uniform(-0.002, 0.002))
+    yield (count / EVENT_RATE,) + _axis(0, 0.0)
+
+def presets(duration=2.0, rate=10):
+    ''' Button 0 (a preset recall in every profile) tapped "rate" times per second. '''
+    for i in range(int(duration * rate)):
+        yield (i / rate,) + _button(0, True)
+        yield ((i + 0.5) / rate,) + _button(0, False)
+
+def circles(duration=2.0, turns=2):
+    ''' Left stick going round its edge, so that pan and tilt keep changing together. '''
+    count = int(duration * EVENT_RATE)
+    for i in range(count):
+        angle = 2 * math.pi * turns * i / count
+        offset = i / EVENT_RATE
+        yield (offset,) + _axis(0, math.cos(angle))
+        yield (offset,) + _axis(1, math.sin(angle))
+    yield (count / EVENT_RATE,) + _axis(0, 0.0)
+    yield (count / EVENT_RATE,) + _axis(1, 0.0)
+
+SCENARIOS = {
+    'sweep': sweep,
+    'hold': hold,
+    'presets': presets,
+    'circles': circles,
+}
+
+# ---
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def summarize(events, packets, duration):
+    '''
+    Match every posted event with the first packet starting on the wire after it.
+    An event followed by the next event before any packet shows up has been coalesced
+    (it did not change what the camera should be doing, or was superseded).
+    '''
+    latencies = []
+    coalesced = 0
+    j = 0
+    for i, posted in enumerate(events):
+        while j < len(packets) and packets[j][0] < posted:
+            j += 1
+        next_posted = events[i + 1] if i + 1 < len(events) else float('inf')
+        if j < len(packets) and packets[j][0] < next_posted:
+            latencies.append((packets[j][0] - posted) * 1000)
+        else:
+            coalesced += 1
+
+    size = sum(len(packet) for _, packet in packets)
+    return {
+        'events': len(events),
+        'packets': len(packets),
+        'coalesced_events': coalesced,
+        'latency_ms': {
+            'p50': _percentile(latencies, 50),
+            'p90': _percentile(latencies, 90),
+            'p99': _percentile(latencies, 99),
+            'max': max(latencies) if latencies else None,
+        },
+        'bytes_per_second': size / duration,
+        'commands_per_second': len(packets) / duration,
+    }
+
+def run_scenario(sim, scenario):
+    ''' Post the events of a scenario on time, and collect the packets they have caused. '''
+    with sim.lock:
+        first = len(sim.received)
+    
+    events = []
+    start = time.monotonic()
+    for offset, event_type, attrs in scenario():
+        delay = start + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        events.append(time.monotonic())
+        pygame.event.post(pygame.event.Event(event_type, attrs))
+    
+    end = time.monotonic()
+    time.sleep(SETTLE_TIME)
+    with sim.lock:
+        # The background status inquiries (8x 09 ...) are not caused by the events.
+        packets = [p for p in sim.received[first:] if p[0] >= start and p[1][1] != 0x09]
+    return summarize(events, packets, max(end - start, 1e-9))
+
+def run_profile(name, scenarios, baudrate, rate=None, transport='serial'):
+    ''' Run one controller script against a fresh simulator (a serial or a VISCA over IP camera). '''
+    sim = UdpViscaSimulator() if transport == 'udp' else ViscaSimulator(baudrate=baudrate)
+    sim.start()
+    
+    module = importlib.import_module(f'gamepad_{name}')
+    worker = Thread(target=module.main, args=(sim.port,), kwargs={'rate': rate}, daemon=True)
+    listening.clear()
+    worker.start()
+    
+    # Wait for the script to subscribe to the joystick events, which flushes the queue.
+    if not listening.wait(STARTUP_TIMEOUT):
+        raise RuntimeError(f'The {name} script did not listen for the gamepad within {STARTUP_TIMEOUT:.0f} s')
+    pygame.event.post(pygame.event.Event(pygame.JOYDEVICEADDED, device_index=-1, joystick=FakeJoystick()))
+    time.sleep(SETTLE_TIME)
+    
+    results = {}
+    for scenario in scenarios:
+        results[scenario] = run_scenario(sim, SCENARIOS[scenario])
+    
+    pygame.event.post(pygame.event.Event(pygame.QUIT))
+    worker.join(5.0)
+    sim.stop()
+    sim.join(1.0)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the stick-to-serial latency of the controller profiles.')
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--baud', type=int, default=9600, help='Simulated serial line speed')
+    parser.add_argument('--rate', type=float, help='Run the control loops at this fixed rate (in Hz)')
+    parser.add_argument('--transport', choices=('serial', 'udp'), default='serial', help='Simulate a serial camera, or a VISCA over IP one')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+    
+    pygame.display.init()
+    pygame.joystick.init()
+    
+    # Keep the console output of the scripts out of the JSON results.
+    with contextlib.redirect_stdout(sys.stderr):
+        report = {
+            'baudrate': args.baud,
+            'rate': args.rate,
+            'transport': args.transport,
+            'event_rate': EVENT_RATE,
+            'profiles': {name: run_profile(name, args.scenarios, args.baud, args.rate, args.transport) for name in args.profiles},
+        }
+        # The event log is written in the background: write what is left before stdout is restored.
+        log.events.flush()
+    
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
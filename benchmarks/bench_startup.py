@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Startup time benchmark
+# Licensed under GPL-3.0
+# ---
+# Launches every controller script headless, as a fresh process, against the VISCA
+# camera simulator, plugs a virtual gamepad in as soon as the script listens for
+# joystick events, and measures the time from the process launch to the first byte
+# of the first VISCA command arriving on the serial line ("time to first command").
+#
+# Usage:
+#   python benchmarks/bench_startup.py [--scripts gamepad gamepad_taffgo] [--runs 5] [--output results.json]
+#
+# The results are printed (or written) as JSON, so that two versions can be compared.
+
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import sys
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from threading import Thread
+import argparse
+import json
+import subprocess
+import tempfile
+import time
+
+SCRIPTS = ('gamepad', 'gamepad_taffgo', 'gamepad_xbox360', 'gamepad_ps4', 'gamepad_microntek')
+
+# Give up on a script that has not sent anything after this long (in second)
+TIMEOUT = 30.0
+
+def plug_gamepad():
+    ''' (In the script's process) Post a virtual gamepad once the script's InputEngine is listening. '''
+    from bench_latency import FakeJoystick
+    import pygame
+
+    # InputEngine blocks every event type in turn (QUIT first, the mouse ones later),
+    # then allows the joystick ones again (QUIT last).
+    while not (
+        pygame.display.get_init()
+        and pygame.event.get_blocked(pygame.MOUSEMOTION)
+        and not pygame.event.get_blocked(pygame.QUIT)
+    ):
+        time.sleep(0.0005)
+    pygame.event.post(pygame.event.Event(pygame.JOYDEVICEADDED, device_index=-1, joystick=FakeJoystick()))
+
+def run_child(script, port):
+    ''' Run a script as __main__ in this process, headless, with a virtual gamepad. '''
+    import runpy
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    Thread(target=plug_gamepad, daemon=True).start()
+
+    path = os.path.join(ROOT, f'{script}.py')
+    sys.argv = [path, '--headless', '--port', port]
+    runpy.run_path(path, run_name='__main__')
+
+def measure(script, scratch):
+    ''' Launch a script once. Returns the time to its first command in millisecond, or None on timeout. '''
+    from ptz_gamepad.simulator import ViscaSimulator
+
+    sim = ViscaSimulator()
+    sim.start()
+
+    # Keep the user's config file, gamepad cache and preset bank out of the measurement.
+    env = dict(os.environ)
+    env['PTZ_GAMEPAD_CONFIG'] = os.path.join(scratch, 'config.json')
+    env['PTZ_GAMEPAD_CACHE'] = os.path.join(scratch, 'controllers.json')
+    env['PTZ_GAMEPAD_PRESETS'] = os.path.join(scratch, 'presets.json')
+
+    start = time.monotonic()
+    child = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--child', script, sim.port],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env,
+    )
+    try:
+        while time.monotonic() - start < TIMEOUT and child.poll() is None:
+            with sim.lock:
+                # The inquiries (8x 09 ..) are the status poller's, not commands of the gamepad.
+                commands = [stamp for stamp, packet in sim.received if packet[1] != 0x09]
+                if commands:
+                    return (commands[0] - start) * 1000
+            time.sleep(0.001)
+        return None
+    finally:
+        child.kill()
+        child.wait()
+        sim.stop()
+        sim.join(1.0)
+
+def summarize(times):
+    done = sorted(t for t in times if t is not None)
+    return {
+        'runs': len(times),
+        'timeouts': len(times) - len(done),
+        'time_to_first_command_ms': {
+            'min': done[0] if done else None,
+            'p50': done[len(done) // 2] if done else None,
+            'max': done[-1] if done else None,
+        },
+    }
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        return run_child(sys.argv[2], sys.argv[3])
+
+    parser = argparse.ArgumentParser(description='Measure the time from launching each controller script to its first VISCA command.')
+    parser.add_argument('--scripts', nargs='+', choices=SCRIPTS, default=list(SCRIPTS))
+    parser.add_argument('--runs', type=int, default=5, help='Launches per script')
+    parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        report = {script: summarize([measure(script, scratch) for _ in range(args.runs)]) for script in args.scripts}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
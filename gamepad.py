@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Control the VISCA PTZ camera using any supported gamepad
+# Licensed under GPL-3.0
+#
+# Single entry point for every gamepad model of this repository.
+# The model of each connected gamepad is detected from its SDL GUID and name when it
+# gets plugged in, and its button layout is picked from the "bindings" directory
+# (see ptz_gamepad/profiles.py). Gamepads may be swapped while the program runs.
+
+# SOURCE: https://www.pygame.org/docs/ref/joystick.html
+
+from ptz_gamepad import log
+from ptz_gamepad.cameras import CameraRig
+from ptz_gamepad.conditioning import SETTLE_INTERVAL
+from ptz_gamepad.inputs import InputEngine
+from ptz_gamepad.inputs import init_joysticks
+from ptz_gamepad.launch import parse_options
+from ptz_gamepad.profiles import ProfileResolver
+from ptz_gamepad.scheduler import FixedRateScheduler
+import pygame as pg
+
+def main(port='COM7', profile=None, rate=None, listen=None, pads=None):
+    '''
+    Control the cameras on "port" with whatever gamepads get connected.
+    If "profile" is given (e.g. "taffgo"), every gamepad uses that layout instead of the detected one.
+    If "rate" is given (in Hz), the control loop runs at that fixed rate instead of once per gamepad event.
+    If "pads" is given (e.g. "0=1 1=2-3"), each of those gamepads drives its own cameras (see CameraRig).
+    '''
+    # Keeps the cached state of every connected joystick, updated by gamepad events only.
+    engine = InputEngine()
+
+    # Establish and initialize the VISCA cameras
+    # e.g. "COM7", or "COM7@1-3 COM8" for cameras 1 to 3 on the COM7 daisy chain and camera 1 on COM8.
+    rig = CameraRig(port, listen=listen, pads=pads).start()
+
+    # Every layout is compiled now; each gamepad gets its own when it is first seen.
+    resolver = ProfileResolver(rig.actions, profile)
+
+    # With a fixed rate, the events are applied together on a grid of deadlines (see ptz_gamepad/scheduler.py).
+    scheduler = FixedRateScheduler(rate) if rate else None
+
+    while not engine.done:
+        # Sleep until the gamepad reports a change (and the next deadline), so that an idle controller costs no CPU,
+        # or until the filters of the sticks held still run again (see ptz_gamepad/conditioning.py).
+        still = [jid for jid, driver in resolver.pads.items() if driver.settling]
+        timeout = SETTLE_INTERVAL if still else None
+        changed = engine.wait(timeout) if scheduler is None else engine.tick(scheduler, timeout)
+        changed += [engine.pads[jid] for jid in still if jid in engine.pads and engine.pads[jid] not in changed]
+
+        # Button presses and releases: a single lookup each in the layout of their gamepad.
+        # Each gamepad drives the camera selected by its own operator.
+        for pad, control, pressed in engine.controls:
+            operator = rig.operator_for(pad.instance_id)
+            resolver.get(pad).handle(pad, control, pressed, operator.state, operator.actions)
+
+        # Stick movements of each joystick that has changed
+        for pad in changed:
+            resolver.get(pad).drive(pad, rig.operator_for(pad.instance_id).state)
+
+        # The camera of an unplugged gamepad stops, whatever its sticks were doing.
+        for jid in engine.removed:
+            rig.operator_for(jid).state.stop_motion()
+
+        resolver.forget(engine.pads)
+
+    if scheduler is not None:
+        log.info("Control loop: %s", scheduler)
+    rig.close()
+
+if __name__ == "__main__":
+    # The serial port and the settings come from the command line or the config file,
+    # else the port is prompted for (see ptz_gamepad/launch.py).
+    options = parse_options('Control the VISCA PTZ camera using any supported gamepad.')
+    init_joysticks()
+    main(options.port, options.layout, options.rate, options.listen, options.pads)
+
+    # If you forget this line, the program will 'hang'
+    # on exit if running from IDLE.
+    pg.quit()
@@ -12,271 +12,193 @@
 # -> SOURCE: https://gist.github.com/effedebe/6cae2a5849923fb373ab749594b9ed50
 
 # SOURCE: https://www.pygame.org/docs/ref/joystick.html
-import pygame
-pygame.init()
 
-from pyvisca import visca
+from collections import deque
+from ptz_gamepad import log
+from ptz_gamepad.bindings import load_bindings
+from ptz_gamepad.cameras import CameraRig
+from ptz_gamepad.conditioning import SETTLE_INTERVAL
+from ptz_gamepad.conditioning import settling
+from ptz_gamepad.inputs import InputEngine
+from ptz_gamepad.inputs import init_joysticks
+from ptz_gamepad.launch import parse_options
+from ptz_gamepad.launch import show_error
+from ptz_gamepad.scheduler import FixedRateScheduler
+from ptz_gamepad.speed import PAN_SPEED_MAX
+from ptz_gamepad.speed import SpeedQuantizer
+from ptz_gamepad.speed import TILT_SPEED_MAX
+from ptz_gamepad.speed import ZOOM_SPEED_MAX
+from ptz_gamepad.state import drive
+from threading import Event
 from threading import Thread
-from tkinter import messagebox
-from tkinter.simpledialog import askstring
-import numpy
 import sys
-import time
 
 class GPad(Thread):
     ''' This class listens to the gamepad event without blocking the main code (using multithreading). '''
     
-    def __init__(self):
+    def __init__(self, layout):
         Thread.__init__(self)
-        self.ABS_HAT0 = (0, 0)
-        self.ABS_JOY_R_Y = 128
-        self.ABS_JOY_L_X = 128
-        self.ABS_JOY_L_Y = 128
-        self.ABS_JOY_R_X = 128
-        self.BTN_JOY_L = 0
-        self.BTN_JOY_R = 0
-        self.CIRCLE = 0
-        self.CROSS = 0
-        self.L1 = 0
-        self.L2 = 0
-        self.MENU = 0
-        self.R1 = 0
-        self.R2 = 0
-        self.SQUARE = 0
-        self.START = 0
-        self.TRIANGLE = 0
+        # The "sticks" section of the layout, which sets up the conditioning of the sticks
+        self.layout = layout
+        # The conditioners of the (movement, zoom) sticks of every joystick: instance ID -> tuple
+        self.conditioners = {}
+        # Set whenever any control changes, so the main loop can sleep in between
+        self.changed = Event()
+        # Set once the gamepad event loop has ended (e.g. the window got closed)
+        self.done = False
+        # Button presses and releases (pad, control, pressed) not handled by the main loop yet
+        self.controls = deque()
+        # Stick positions and max speeds of every joystick: instance ID -> (pan, tilt, zoom, speed limits)
+        self.sticks = {}
+        # Instance IDs of the disconnected joysticks, dropped by the main loop once their sticks are let go
+        self.removed = deque()
     
     def run(self):
 
-        # This dict can be left as-is, since pygame will generate a
-        # pygame.JOYDEVICEADDED event for every joystick connected
-        # at the start of the program.
-        joysticks = {}
+        # Keeps the cached state of every connected joystick, updated by gamepad events only.
+        engine = InputEngine()
     
         try:
-            while True:
+            while not engine.done:
                 # Event processing step.
-                # Possible joystick events: JOYAXISMOTION, JOYBALLMOTION, JOYBUTTONDOWN,
-                # JOYBUTTONUP, JOYHATMOTION, JOYDEVICEADDED, JOYDEVICEREMOVED
-                for event in pygame.event.get():
-                    # Handle hotplugging
-                    if event.type == pygame.JOYDEVICEADDED:
-                        # This event will be generated when the program starts for every
-                        # joystick, filling up the list without needing to create them manually.
-                        joy = pygame.joystick.Joystick(event.device_index)
-                        joysticks[joy.get_instance_id()] = joy
-                        print(f"Joystick {joy.get_instance_id()} connencted")
-                
-                for joystick in joysticks.values():
-                    # Category of binary respond values
-                    self.L1 = joystick.get_button(4)
-                    self.L2 = joystick.get_button(6)
-                    self.R1 = joystick.get_button(5)
-                    self.R2 = joystick.get_button(7)
-                    self.MENU = joystick.get_button(8)
-                    self.START = joystick.get_button(9)
-                    self.BTN_JOY_L = joystick.get_button(10)
-                    self.BTN_JOY_R = joystick.get_button(11)
-                    self.CIRCLE = joystick.get_button(1)
-                    self.CROSS = joystick.get_button(2)
-                    self.SQUARE = joystick.get_button(3)
-                    self.TRIANGLE = joystick.get_button(0)
+                # Sleep until the gamepad reports a change, then only read the cached values,
+                # or until the filters of the sticks held still run again (see ptz_gamepad/conditioning.py).
+                still = [jid for jid, sticks in self.conditioners.items() if settling(sticks)]
+                pads = engine.wait(SETTLE_INTERVAL if still else None)
+                pads += [engine.pads[jid] for jid in still if jid in engine.pads and engine.pads[jid] not in pads]
+                changed = False
+                for joystick in pads:
+                    jid = joystick.get_instance_id()
                     
                     # Category of analog values
-                    self.ABS_HAT0 = joystick.get_hat(0)
-                    self.ABS_JOY_L_X = float( str(f"{ ('%.3f' % joystick.get_axis(0)) }") )
-                    self.ABS_JOY_L_Y = float( str(f"{ ('%.3f' % joystick.get_axis(1)) }") )
-                    self.ABS_JOY_R_X = float( str(f"{ ('%.3f' % joystick.get_axis(2)) }") )
-                    self.ABS_JOY_R_Y = float( str(f"{ ('%.3f' % joystick.get_axis(3)) }") )
+                    # (conditioned: deadzone, response curve, filter, see the "sticks" section of the layout)
+                    if jid not in self.conditioners:
+                        self.conditioners[jid] = (self.layout.conditioner(2), self.layout.conditioner(1))
+                    movement, zooming = self.conditioners[jid]
+                    axes = self.layout.axes
+                    movement.update(joystick.get_axis(axes['pan']), joystick.get_axis(axes['tilt']))
+                    zooming.update(joystick.get_axis(axes['zoom']))
+                    # ... and the max speeds of the speed tiers held (R1 medium, R2 max)
+                    sticks = movement.values + zooming.values + (self.layout.limits(joystick),)
+                    
+                    # Only a change that survives the conditioning is passed on (not the jitter within the deadzone).
+                    if sticks != self.sticks.get(jid):
+                        self.sticks[jid] = sticks
+                        changed = True
+                
+                # The sticks of a disconnected joystick are let go, which stops its camera.
+                for jid in engine.removed:
+                    self.conditioners.pop(jid, None)
+                    if jid in self.sticks:
+                        self.sticks[jid] = (0.0, 0.0, 0.0, {})
+                        self.removed.append(jid)
+                        changed = True
+                
+                # The buttons are looked up in the layout by the main loop
+                self.controls.extend(engine.controls)
+                
+                # Wake the main loop up, if there is anything to apply
+                if changed or engine.controls:
+                    self.changed.set()
+            
+            self.done = True
+            self.changed.set()
         except Exception as e:
-            messagebox.showerror('Unknown gamepad error', f'Unknown error is detected. Please check your gamepad console connection: {e}')
+            show_error('Unknown gamepad error', f'Unknown error is detected. Please check your gamepad console connection: {e}')
             sys.exit()
 
-def get_speed(val, max_speed):
-    '''
-    Calculate the absolute speed according to the analog joystick's input voltage.
-    If val == 0.004, then the joystick is at rest.
-    The range of value (val) is within -1 and 1.
-    '''
-    i = numpy.abs( val )
-    return float( max_speed * float(i) )
-
-def main(port='/dev/ttyUSB0'):
+def main(port='/dev/ttyUSB0', layout='microntek', rate=None, listen=None, pads=None):
     ''' Actually controls the VISCA PTZ camera using joystick/gamepad. '''
     
     try:
-        # Establish the non-blocking multithreading for analog input
-        game_pad = GPad()
-        game_pad.start()
-        
-        # Establish and initialize the VISCA object
+        # Establish and initialize the VISCA cameras
         # (Change the port value according to your system's availability.)
-        cam = visca.PTZ(port)
+        # e.g. "/dev/ttyUSB0", or "/dev/ttyUSB0@1-3 /dev/ttyUSB1" for cameras 1 to 3 on the ttyUSB0 daisy chain and camera 1 on ttyUSB1.
+        # All serial writes happen on each port's dispatcher thread, never in this loop.
+        # The rig remembers the last command of every control of every camera, so that only changes are sent.
+        rig = CameraRig(port, listen=listen, pads=pads).start()
+        
+        # The buttons of the presets, the camera selection, etc. are mapped
+        # in bindings/microntek.json (or in the layout file given instead).
+        table = load_bindings(layout, rig.actions)
         
-        # Set the max speed (pixel per 100 ms) of the X-Y joystick movement
-        MAX_MOVEMENT_SPEED = 7
-        MAX_ZOOM_SPEED = 7
+        # So are the axes of the sticks and the speed tiers, in its "sticks" section.
+        table.sticks.require('pan', 'tilt', 'zoom')
         
-        # Set the delay time for movement speed
-        MOVEMENT_REDUNDANT_DELAY = 0.01
+        # Establish the non-blocking multithreading for analog input
+        game_pad = GPad(table.sticks)
+        game_pad.start()
+        
+        # Quantize the stick deflection onto the camera's speed steps,
+        # so that a new speed is only sent when the stick clearly moves to another step.
+        # Every joystick has its own quantizers, since they remember the current speed step.
+        quantizers = {}
         
-        # Set the delay time after each movement, before stopping any continuous command
-        MOVEMENT_STOP_DELAY = 0.0005
-        MOVEMENT_STOP_DELAY_LONG = 0.5
+        # The conditioned sticks read exactly 0.0 at rest, whatever their drift within the deadzone.
+        JOYSTICK_REST_VAL = 0.0
         
-        # If val == 0.004, then the joystick is at rest.
-        JOYSTICK_REST_VAL = 0.004
-        JOYSTICK_MIN_VAL = -1
-        JOYSTICK_MAX_VAL = 1
+        # With a fixed rate (in Hz), the changes are applied together on a grid of deadlines (see ptz_gamepad/scheduler.py).
+        scheduler = FixedRateScheduler(rate) if rate else None
         
         # Fail-safe error catching with infinite loop
-        while True:
+        while not game_pad.done:
             
-            # Recalling presets: left hand
-            if game_pad.ABS_HAT0 == (0, 1) and game_pad.MENU == 0:
-                cam.preset_recall(4)
-                game_pad.ABS_HAT0 = (0, 0)  # --- blocking
-            if game_pad.ABS_HAT0 == (1, 0) and game_pad.MENU == 0:
-                cam.preset_recall(5)
-                game_pad.ABS_HAT0 = (0, 0)  # --- blocking
-            if game_pad.ABS_HAT0 == (0, -1) and game_pad.MENU == 0:
-                cam.preset_recall(6)
-                game_pad.ABS_HAT0 = (0, 0)  # --- blocking
-            if game_pad.ABS_HAT0 == (-1, 0) and game_pad.MENU == 0:
-                cam.preset_recall(7)
-                game_pad.ABS_HAT0 = (0, 0)  # --- blocking
+            # Sleep until the gamepad reports a change (and the next deadline)
+            if scheduler is None:
+                game_pad.changed.wait()
+                game_pad.changed.clear()
+            else:
+                scheduler.wait_for(game_pad.changed)
             
-            # Recalling presets: right hand
-            if game_pad.TRIANGLE == 1 and game_pad.MENU == 0:
-                cam.preset_recall(0)
-                game_pad.TRIANGLE = 0  # --- blocking
-            if game_pad.CIRCLE == 1 and game_pad.MENU == 0:
-                cam.preset_recall(1)
-                game_pad.CIRCLE = 0  # --- blocking
-            if game_pad.CROSS == 1 and game_pad.MENU == 0:
-                cam.preset_recall(2)
-                game_pad.CROSS = 0  # --- blocking
-            if game_pad.SQUARE == 1 and game_pad.MENU == 0:
-                cam.preset_recall(3)
-                game_pad.SQUARE = 0  # --- blocking
+            # Button presses and releases: a single lookup each in the layout.
+            # Each joystick drives the camera selected by its own operator (see CameraRig.operator_for()).
+            while game_pad.controls:
+                pad, control, pressed = game_pad.controls.popleft()
+                operator = rig.operator_for(pad.instance_id)
+                table.handle(pad, control, pressed, operator.state, operator.actions)
             
-            # Setting/assigning presets: left hand
-            if game_pad.ABS_HAT0 == (0, 1) and game_pad.MENU == 1:
-                cam.preset_set(4)
-                game_pad.ABS_HAT0 = (0, 0)  # --- blocking
-            if game_pad.ABS_HAT0 == (1, 0) and game_pad.MENU == 1:
-                cam.preset_set(5)
-                game_pad.ABS_HAT0 = (0, 0)  # --- blocking
-            if game_pad.ABS_HAT0 == (0, -1) and game_pad.MENU == 1:
-                cam.preset_set(6)
-                game_pad.ABS_HAT0 = (0, 0)  # --- blocking
-            if game_pad.ABS_HAT0 == (-1, 0) and game_pad.MENU == 1:
-                cam.preset_set(7)
-                game_pad.ABS_HAT0 = (0, 0)  # --- blocking
-            
-            # Setting/assigning presets: right hand
-            if game_pad.TRIANGLE == 1 and game_pad.MENU == 1:
-                cam.preset_set(0)
-                game_pad.TRIANGLE = 0  # --- blocking
-            if game_pad.CIRCLE == 1 and game_pad.MENU == 1:
-                cam.preset_set(1)
-                game_pad.CIRCLE = 0  # --- blocking
-            if game_pad.CROSS == 1 and game_pad.MENU == 1:
-                cam.preset_set(2)
-                game_pad.CROSS = 0  # --- blocking
-            if game_pad.SQUARE == 1 and game_pad.MENU == 1:
-                cam.preset_set(3)
-                game_pad.SQUARE = 0  # --- blocking
-            
-            # Adjusting speed
-            # ---
-            # Low speed
-            if game_pad.R1 == 0 and game_pad.R2 == 0:
-                MOVEMENT_STOP_DELAY = 0.0001
-                MOVEMENT_STOP_DELAY_LONG = 0.05
-                MAX_ZOOM_SPEED = 1
-                MAX_MOVEMENT_SPEED = 1
-            # Medium speed
-            if game_pad.R1 == 1:
-                MOVEMENT_STOP_DELAY = 0.05
-                MOVEMENT_STOP_DELAY_LONG = 0.1
-                MAX_ZOOM_SPEED = 4
-                MAX_MOVEMENT_SPEED = 3
-            # Max speed
-            if game_pad.R2 == 1:
-                MOVEMENT_STOP_DELAY = 0.3
-                MOVEMENT_STOP_DELAY_LONG = 0.5
-                MAX_ZOOM_SPEED = 7
-                MAX_MOVEMENT_SPEED = 14
-        
-            # Movement actions (left-right panning)
-            if game_pad.ABS_JOY_L_X != JOYSTICK_REST_VAL:
-                val = game_pad.ABS_JOY_L_X
-                i = get_speed(val, MAX_MOVEMENT_SPEED)
-                # Do the movement
-                if val >= JOYSTICK_MIN_VAL and val < JOYSTICK_REST_VAL:
-                    cam.left(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY)
-                    cam.stop()
-                elif val > JOYSTICK_REST_VAL and val <= JOYSTICK_MAX_VAL:
-                    cam.right(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY)
-                    cam.stop()
+            # The joysticks disconnected so far: their sticks have been let go before they were listed.
+            removed = [game_pad.removed.popleft() for _ in range(len(game_pad.removed))]
             
-            # Movement actions (up-down tilting)
-            if game_pad.ABS_JOY_L_Y != 128:
-                val = game_pad.ABS_JOY_L_Y
-                i = get_speed(val, MAX_MOVEMENT_SPEED)
-                # Do the movement
-                if val >= JOYSTICK_MIN_VAL and val < JOYSTICK_REST_VAL:
-                    cam.up(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY)
-                    cam.stop()
-                elif val > JOYSTICK_REST_VAL and val <= JOYSTICK_MAX_VAL:
-                    cam.down(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY)
-                    cam.stop()
-            
-            # Movement actions (zoom)
-            if game_pad.ABS_JOY_R_Y != 128:
-                val = game_pad.ABS_JOY_R_Y
-                i = get_speed(val, MAX_ZOOM_SPEED)
-                # Do the movement
-                if val >= JOYSTICK_MIN_VAL and val < JOYSTICK_REST_VAL:
-                    cam.zoom_in(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY_LONG)
-                    cam.zoom_stop()
-                elif val > JOYSTICK_REST_VAL and val <= JOYSTICK_MAX_VAL:
-                    cam.zoom_out(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY_LONG)
-                    cam.zoom_stop()
-            
-            # Analog center button press actions
-            # ---
-            # Move camera to home/default position
-            if game_pad.BTN_JOY_L == 1:
-                cam.home()
-                game_pad.BTN_JOY_L = 0  # --- blocking
-            # Perform autofocus
-            if game_pad.BTN_JOY_R == 1:
-                cam.autofocus_sens_low()
-                game_pad.BTN_JOY_R = 0  # --- blocking
+            # The camera state only sends what has changed, so every joystick is applied on every pass.
+            for jid, (pan_val, tilt_val, zoom_val, limits) in list(game_pad.sticks.items()):
+                state = rig.operator_for(jid).state
+                pan_speed, tilt_speed, zoom_speed = quantizers.setdefault(
+                    jid, (SpeedQuantizer(PAN_SPEED_MAX), SpeedQuantizer(TILT_SPEED_MAX), SpeedQuantizer(ZOOM_SPEED_MAX))
+                )
+                
+                # Adjusting speed: the max speeds of the speed tiers held (see the "sticks" section of the layout)
+                MAX_MOVEMENT_SPEED = limits.get('movement')
+                MAX_ZOOM_SPEED = limits.get('zoom')
+                
+                # Movement actions (left-right panning, up-down tilting)
+                pan = drive(pan_val, 'left', 'right', pan_speed(pan_val, MAX_MOVEMENT_SPEED), JOYSTICK_REST_VAL)
+                tilt = drive(tilt_val, 'up', 'down', tilt_speed(tilt_val, MAX_MOVEMENT_SPEED), JOYSTICK_REST_VAL)
+                state.pan_tilt(pan, tilt)
+                
+                # Movement actions (zoom)
+                zoom = drive(zoom_val, 'zoom_in', 'zoom_out', zoom_speed(zoom_val, MAX_ZOOM_SPEED), JOYSTICK_REST_VAL)
+                state.update('zoom', zoom or ('zoom_stop',))
             
-            # Prevent too fast a movement
-            time.sleep(MOVEMENT_REDUNDANT_DELAY)
+            # Once their stop has been applied, the disconnected joysticks are forgotten.
+            for jid in removed:
+                game_pad.sticks.pop(jid, None)
+                quantizers.pop(jid, None)
         
         # Wait until the end of the game_pad thread
-        game_pad.joint()
+        game_pad.join()
+        if scheduler is not None:
+            log.info("Control loop: %s", scheduler)
+        rig.close()
     
     except:
-        messagebox.showerror('Unknown error', 'Unknown error is detected. Please check your PTZ connection')
+        show_error('Unknown error', 'Unknown error is detected. Please check your PTZ connection')
         sys.exit()
     
 if __name__ == "__main__":
-    # Prompt for the PTZ's USB serial port
-    port = askstring(
-        'Serial USB Input',
-        'Please enter the VISCA PTZ\'s registered serial port\ne.g. Windows: "COM1", "COM2", etc.\ne.g. Linux: "/dev/ttyUSB0", "/dev/ttyUSB1", etc.'
-    )
+    # The serial port and the settings come from the command line or the config file,
+    # else the port is prompted for (see ptz_gamepad/launch.py).
+    options = parse_options('Control the VISCA PTZ camera using a Microntek USB gamepad.')
+    init_joysticks()
     
-    main(port)
+    main(options.port, options.layout or 'microntek', options.rate, options.listen, options.pads)
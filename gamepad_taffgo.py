@@ -34,679 +34,172 @@ print('''
 
 ''')
 
-from colorama import Back
-from colorama import Fore
-from colorama import Style
-from pyvisca import visca
-from serial.serialutil import SerialException
-from tkinter.simpledialog import askstring
-import colorama as cr
-import numpy
+from ptz_gamepad import log
+from ptz_gamepad.bindings import load_bindings
+from ptz_gamepad.cameras import CameraRig
+from ptz_gamepad.conditioning import SETTLE_INTERVAL
+from ptz_gamepad.conditioning import settling
+from ptz_gamepad.inputs import InputEngine
+from ptz_gamepad.inputs import init_joysticks
+from ptz_gamepad.launch import parse_options
+from ptz_gamepad.scheduler import FixedRateScheduler
+from ptz_gamepad.speed import PAN_SPEED_MAX
+from ptz_gamepad.speed import SpeedQuantizer
+from ptz_gamepad.speed import TILT_SPEED_MAX
+from ptz_gamepad.speed import ZOOM_SPEED_MAX
+from ptz_gamepad.state import drive
 import pygame as pg
 import time
 
-cr.init()
-pg.init()
-
 def get_speed(val, max_speed):
     '''
     Calculate the absolute speed according to the analog joystick's input voltage.
     If val == 0.004, then the joystick is at rest.
     The range of value (val) is within -1 and 1.
     '''
-    i = numpy.abs( val )
+    i = abs( val )
     return float( max_speed * float(i) )
 
-def main(port='COM7'):
-    # This dict can be left as-is, since pygame will generate a
-    # pg.JOYDEVICEADDED event for every joystick connected
-    # at the start of the program.
-    joysticks = {}
+def main(port='COM7', layout='taffgo', rate=None, listen=None, pads=None):
+    # Keeps the cached state of every connected joystick, updated by gamepad events only.
+    engine = InputEngine()
 
-    # Establish and initialize the VISCA object
+    # Establish and initialize the VISCA cameras
     # (Change the port value according to your system's availability.)
-    cam = visca.PTZ(port)
-
-    # Set the max speed (pixel per 100 ms) of the X-Y joystick movement
-    MAX_MOVEMENT_SPEED = 7
-    MAX_ZOOM_SPEED = 7
-
-    # If val == 0.004, then the joystick is at rest.
-    JOYSTICK_REST_VAL = 0.000
-    JOYSTICK_MIN_VAL = -1
-    JOYSTICK_MAX_VAL = 1
+    # e.g. "COM7", or "COM7@1-3 COM8" for cameras 1 to 3 on the COM7 daisy chain and camera 1 on COM8.
+    # All serial writes happen on each port's dispatcher thread, never in this loop.
+    rig = CameraRig(port, listen=listen, pads=pads).start()
+
+    # The buttons of the presets, the camera selection and the power chords are mapped
+    # in bindings/taffgo.json (or in the layout file given instead).
+    table = load_bindings(layout, rig.actions)
+
+    # So are the axes of the sticks and the speed tiers (L1/L2 for the movement, R1/R2 for the zoom),
+    # in its "sticks" section.
+    table.sticks.require('pan', 'tilt', 'zoom')
+    axes = table.sticks.axes
+
+    # Stick mode of the pan-tilt movement.
+    # If True, the stick deflection sets the speed, quantized onto the camera's
+    # pan and tilt speed steps (up to the L1/L2 speed tier) with hysteresis between the steps.
+    # If False, the stick only sets the direction and L1/L2 select the speed.
+    PROPORTIONAL_SPEED = True
+    # Every joystick has its own quantizers, since they remember the current speed step.
+    quantizers = {}
+    # ... and its own stick conditioners, since their filters remember the past positions.
+    conditioners = {}
+
+    # The conditioned sticks read exactly 0.0 at rest, whatever their drift within the deadzone.
+    JOYSTICK_REST_VAL = 0.0
     
-    # Set the delay duration (in second) when attempting to turn on the PTZ.
-    # During this time, we should not write nor read any buffer as this would interfere with
-    # the port serial.
-    PTZ_POWER_ON_DELAY = 29.5
+    # The rig remembers the last command of every control of every camera, so that we won't overflow the serial.
+    # A command is only dispatched when the desired state of its control changes.
 
-    # PTZ blocking -- so that we won't overflow the serial.
-    block_up = False
-    block_down = False
-    block_left = False
-    block_right = False
-    block_rest = False
-    block_zoom_in = False
-    block_zoom_out = False
-    block_zoom_rest = False
-    
-    # Preset recalling blocking -- so that we won't overflow the serial.
-    block_0 = False
-    block_1 = False
-    block_2 = False
-    block_3 = False
-    block_4 = False
-    block_5 = False
-    block_6 = False
-    block_7 = False
-    
-    # Hidden functionality.
-    block_8 = False
-    block_9 = False
-    block_10 = False
-    block_11 = False
-    block_12 = False
-    block_13 = False
-    block_14 = False
-    block_15 = False
-    
-    # Preset setting/configuration blocking -- so that we won't overflow the serial.
-    block_set_0 = False
-    block_set_1 = False
-    block_set_2 = False
-    block_set_3 = False
-    block_set_4 = False
-    block_set_5 = False
-    block_set_6 = False
-    block_set_7 = False
-    
-    # Hidden preset setting/configuration blocking.
-    block_set_8 = False
-    block_set_9 = False
-    block_set_10 = False
-    block_set_11 = False
-    block_set_12 = False
-    block_set_13 = False
-    block_set_14 = False
-    block_set_15 = False
-    
-    # Blocking for turning on/off the PTZ camera.
-    block_power_on = False
-    block_power_off = False
+    # With a fixed rate (in Hz), the events are applied together on a grid of deadlines (see ptz_gamepad/scheduler.py).
+    scheduler = FixedRateScheduler(rate) if rate else None
 
-    done = False
     init_state = True
-    while not done:
-        # Event processing step.
-        # Possible joystick events: JOYAXISMOTION, JOYBALLMOTION, JOYBUTTONDOWN,
-        # JOYBUTTONUP, JOYHATMOTION, JOYDEVICEADDED, JOYDEVICEREMOVED
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                print("Quitting.")
-                done = True  # Flag that we are done so we exit this loop.
-
-            if event.type == pg.JOYBUTTONDOWN:
-                # print("Joystick button pressed.")
-                pass
-
-            if event.type == pg.JOYBUTTONUP:
-                # print("Joystick button released.")
-                pass
-
-            # Handle hotplugging
-            if event.type == pg.JOYDEVICEADDED:
-                # This event will be generated when the program starts for every
-                # joystick, filling up the list without needing to create them manually.
-                joy = pg.joystick.Joystick(event.device_index)
-                joysticks[joy.get_instance_id()] = joy
-                print(f"Joystick {joy.get_instance_id()} connected")
-
-            if event.type == pg.JOYDEVICEREMOVED:
-                del joysticks[event.instance_id]
-                print(f"Joystick {event.instance_id} disconnected")
-
-        # Get count of joysticks.
-        # joystick_count = pg.joystick.get_count()
-        # print(f"Number of joysticks: {joystick_count}")
-
-        # For each joystick:
-        for joystick in joysticks.values():
-            jid = joystick.get_instance_id()
-
-            # Printing the joystick name
-            name = joystick.get_name()
-            if init_state:
-                print()
-                print(Back.YELLOW, Fore.BLACK, f"Joystick name: {name}")
-                print(Style.RESET_ALL, Fore.GREEN)
-                print("IF THE JOYSTICK NAME IS ANYTHING OTHER THAN 'Xbox 360 Controller'")
-                print("UNPLUG THE GAMEPAD'S WIRELESS USB (DONGLE) AND PLUG IT IN AGAIN UNTIL IT IS DETECTED AS AN XBOX 360 GAMEPAD")
-                print(Style.RESET_ALL)
-                init_state = False
-
-            # Category of binary respond values
-            _L1 = joystick.get_button(4)
-            _L2 = 1 if int(joystick.get_axis(4)) == 0 else 0
-            _R1 = joystick.get_button(5)
-            _R2 = 1 if int(joystick.get_axis(5)) == 0 else 0
-            _MENU = joystick.get_button(6)
-            _START = joystick.get_button(7)
-            _BTN_JOY_L = joystick.get_button(8)
-            _BTN_JOY_R = joystick.get_button(9)
-            _BTN_A = joystick.get_button(pg.CONTROLLER_BUTTON_A)
-            _BTN_B = joystick.get_button(pg.CONTROLLER_BUTTON_B)
-            _BTN_X = joystick.get_button(pg.CONTROLLER_BUTTON_X)
-            _BTN_Y = joystick.get_button(pg.CONTROLLER_BUTTON_Y)
-
-            # Category of analog values
-            _ABS_HAT0 = joystick.get_hat(0)
-            _ABS_JOY_L_X = float( str(f"{ ('%.3f' % joystick.get_axis(0)) }") )
-            _ABS_JOY_L_Y = float( str(f"{ ('%.3f' % joystick.get_axis(1)) }") )
-            _ABS_JOY_R_X = float( str(f"{ ('%.3f' % joystick.get_axis(2)) }") )
-            _ABS_JOY_R_Y = float( str(f"{ ('%.3f' % joystick.get_axis(3)) }") )
-
-            # DEBUG:
-            # (Please comment out this section after use.)
-            # print(_L1, _L2, _R1, _R2, _MENU, _START, _BTN_JOY_L, _BTN_JOY_R, _BTN_A, _BTN_B, _BTN_X, _BTN_Y, _ABS_HAT0, _ABS_JOY_L_X, _ABS_JOY_L_Y, _ABS_JOY_R_X, _ABS_JOY_R_Y)
-
-            # Recalling presets: right hand (presets 0-3)
-            if _MENU == 0 and _START == 0:
-                
-                if _BTN_Y == 1:
-                    if not block_0:
-                        print("Dispatched command: RECALLING PRESET 0")
-                        cam.preset_recall(0)
-                        block_0 = True
-                elif _BTN_Y == 0:
-                    if block_0:
-                        print("Dispatched command: RECALLING PRESET 0 UNBLOCKING")
-                        block_0 = False
-                
-                if _BTN_B == 1:
-                    if not block_1:
-                        print("Dispatched command: RECALLING PRESET 1")
-                        cam.preset_recall(1)
-                        block_1 = True
-                elif _BTN_B == 0:
-                    if block_1:
-                        print("Dispatched command: RECALLING PRESET 1 UNBLOCKING")
-                        block_1 = False
-                
-                if _BTN_A == 1:
-                    if not block_2:
-                        print("Dispatched command: RECALLING PRESET 2")
-                        cam.preset_recall(2)
-                        block_2 = True
-                elif _BTN_A == 0:
-                    if block_2:
-                        print("Dispatched command: RECALLING PRESET 2 UNBLOCKING")
-                        block_2 = False
-                
-                if _BTN_X == 1:
-                    if not block_3:
-                        print("Dispatched command: RECALLING PRESET 3")
-                        cam.preset_recall(3)
-                        block_3 = True
-                elif _BTN_X == 0:
-                    if block_3:
-                        print("Dispatched command: RECALLING PRESET 3 UNBLOCKING")
-                        block_3 = False
-
-            # Recalling presets: left hand (presets 4-7)
-            if _MENU == 0 and _START == 0:
-                
-                if _ABS_HAT0 == (0, 1):
-                    if not block_4:
-                        print("Dispatched command: RECALLING PRESET 4")
-                        cam.preset_recall(4)
-                        block_4 = True
-                
-                if _ABS_HAT0 == (1, 0):
-                    if not block_5:
-                        print("Dispatched command: RECALLING PRESET 5")
-                        cam.preset_recall(5)
-                        block_5 = True
-                        
-                if _ABS_HAT0 == (0, -1):
-                    if not block_6:
-                        print("Dispatched command: RECALLING PRESET 6")
-                        cam.preset_recall(6)
-                        block_6 = True
-                        
-                if _ABS_HAT0 == (-1, 0):
-                    if not block_7:
-                        print("Dispatched command: RECALLING PRESET 7")
-                        cam.preset_recall(7)
-                        block_7 = True
-                
-                # Reset/ground state.
-                if _ABS_HAT0 == (0, 0):
-                    if block_4:
-                        print("Dispatched command: RECALLING PRESET 4 UNBLOCKING")
-                        block_4 = False
-                    if block_5:
-                        print("Dispatched command: RECALLING PRESET 5 UNBLOCKING")
-                        block_5 = False
-                    if block_6:
-                        print("Dispatched command: RECALLING PRESET 6 UNBLOCKING")
-                        block_6 = False
-                    if block_7:
-                        print("Dispatched command: RECALLING PRESET 7 UNBLOCKING")
-                        block_7 = False
-            
-            # Recalling presets: hidden (presets 8-...)
-            if _MENU == 0 and _START == 1:
-                
-                if _BTN_Y == 1:
-                    if not block_8:
-                        print("Dispatched command: RECALLING PRESET 8")
-                        cam.preset_recall(8)
-                        block_8 = True
-                elif _BTN_Y == 0:
-                    if block_8:
-                        print("Dispatched command: RECALLING PRESET 8 UNBLOCKING")
-                        block_8 = False
-                
-                if _BTN_B == 1:
-                    if not block_9:
-                        print("Dispatched command: RECALLING PRESET 9")
-                        cam.preset_recall(9)
-                        block_9 = True
-                elif _BTN_B == 0:
-                    if block_9:
-                        print("Dispatched command: RECALLING PRESET 9 UNBLOCKING")
-                        block_9 = False
-                
-                if _BTN_A == 1:
-                    if not block_10:
-                        print("Dispatched command: RECALLING PRESET 10")
-                        cam.preset_recall(10)
-                        block_10 = True
-                elif _BTN_A == 0:
-                    if block_10:
-                        print("Dispatched command: RECALLING PRESET 10 UNBLOCKING")
-                        block_10 = False
-                
-                if _BTN_X == 1:
-                    if not block_11:
-                        print("Dispatched command: RECALLING PRESET 11")
-                        cam.preset_recall(11)
-                        block_11 = True
-                elif _BTN_X == 0:
-                    if block_11:
-                        print("Dispatched command: RECALLING PRESET 11 UNBLOCKING")
-                        block_11 = False
-            
-            if _MENU == 0 and _START == 1:
-                if _ABS_HAT0 == (0, 1):
-                    if not block_12:
-                        print("Dispatched command: RECALLING PRESET 12")
-                        cam.preset_recall(12)
-                        block_12 = True
-                
-                if _ABS_HAT0 == (1, 0):
-                    if not block_13:
-                        print("Dispatched command: RECALLING PRESET 13")
-                        cam.preset_recall(13)
-                        block_13 = True
-                        
-                if _ABS_HAT0 == (0, -1):
-                    if not block_14:
-                        print("Dispatched command: RECALLING PRESET 14")
-                        cam.preset_recall(14)
-                        block_14 = True
-                        
-                if _ABS_HAT0 == (-1, 0):
-                    if not block_15:
-                        print("Dispatched command: RECALLING PRESET 15")
-                        cam.preset_recall(15)
-                        block_15 = True
-                
-                # Reset/ground state.
-                if _ABS_HAT0 == (0, 0):
-                    if block_12:
-                        print("Dispatched command: RECALLING PRESET 12 UNBLOCKING")
-                        block_12 = False
-                    if block_13:
-                        print("Dispatched command: RECALLING PRESET 13 UNBLOCKING")
-                        block_13 = False
-                    if block_14:
-                        print("Dispatched command: RECALLING PRESET 14 UNBLOCKING")
-                        block_14 = False
-                    if block_15:
-                        print("Dispatched command: RECALLING PRESET 15 UNBLOCKING")
-                        block_15 = False
-
-            # Setting/assigning presets: right hand (presets 0-3)
-            if _MENU == 1:
-                
-                if _BTN_Y == 1:
-                    if not block_set_0:
-                        print("Dispatched command: OVERWRITING PRESET 0")
-                        cam.preset_set(0)
-                        block_set_0 = True
-                elif _BTN_Y == 0:
-                    if block_set_0:
-                        print("Dispatched command: OVERWRITING PRESET 0 UNBLOCKING")
-                        block_set_0 = False
-                
-                if _BTN_B == 1:
-                    if not block_set_1:
-                        print("Dispatched command: OVERWRITING PRESET 1")
-                        cam.preset_set(1)
-                        block_set_1 = True
-                elif _BTN_B == 0:
-                    if block_set_1:
-                        print("Dispatched command: OVERWRITING PRESET 1 UNBLOCKING")
-                        block_set_1 = False
-                
-                if _BTN_A == 1:
-                    if not block_set_2:
-                        print("Dispatched command: OVERWRITING PRESET 2")
-                        cam.preset_set(2)
-                        block_set_2 = True
-                elif _BTN_A == 0:
-                    if block_set_2:
-                        print("Dispatched command: OVERWRITING PRESET 2 UNBLOCKING")
-                        block_set_2 = False
-                
-                if _BTN_X == 1:
-                    if not block_set_3:
-                        print("Dispatched command: OVERWRITING PRESET 3")
-                        cam.preset_set(3)
-                        block_set_3 = True
-                elif _BTN_X == 0:
-                    if block_set_3:
-                        print("Dispatched command: OVERWRITING PRESET 3 UNBLOCKING")
-                        block_set_3 = False
-
-            # Setting/assigning presets: left hand (presets 4-7)
-            if _MENU == 1:
-                if _ABS_HAT0 == (0, 1):
-                    if not block_set_4:
-                        print("Dispatched command: OVERWRITING PRESET 4")
-                        cam.preset_set(4)
-                        block_set_4 = True
-                
-                if _ABS_HAT0 == (1, 0):
-                    if not block_set_5:
-                        print("Dispatched command: OVERWRITING PRESET 5")
-                        cam.preset_set(5)
-                        block_set_5 = True
-                
-                if _ABS_HAT0 == (0, -1):
-                    if not block_set_6:
-                        print("Dispatched command: OVERWRITING PRESET 6")
-                        cam.preset_set(6)
-                        block_set_6 = True
-                    
-                if _ABS_HAT0 == (-1, 0):
-                    if not block_set_7:
-                        print("Dispatched command: OVERWRITING PRESET 7")
-                        cam.preset_set(7)
-                        block_set_7 = True
-                
-                # Reset/ground state.
-                if _ABS_HAT0 == (0, 0):
-                    if block_set_4:
-                        print("Dispatched command: OVERWRITING PRESET 4 UNBLOCKING")
-                        block_set_4 = False
-                    if block_set_5:
-                        print("Dispatched command: OVERWRITING PRESET 5 UNBLOCKING")
-                        block_set_5 = False
-                    if block_set_6:
-                        print("Dispatched command: OVERWRITING PRESET 6 UNBLOCKING")
-                        block_set_6 = False
-                    if block_set_7:
-                        print("Dispatched command: OVERWRITING PRESET 7 UNBLOCKING")
-                        block_set_7 = False
-            
-            # Setting/assigning presets: hidden (presets 8-...)
-            if _MENU == 1 and _START == 1:
-                
-                if _BTN_Y == 1:
-                    if not block_set_8:
-                        print("Dispatched command: OVERWRITING PRESET 8")
-                        cam.preset_set(8)
-                        block_set_8 = True
-                elif _BTN_Y == 0:
-                    if block_set_8:
-                        print("Dispatched command: OVERWRITING PRESET 8 UNBLOCKING")
-                        block_set_8 = False
-                
-                if _BTN_B == 1:
-                    if not block_set_9:
-                        print("Dispatched command: OVERWRITING PRESET 9")
-                        cam.preset_set(9)
-                        block_set_9 = True
-                elif _BTN_B == 0:
-                    if block_set_9:
-                        print("Dispatched command: OVERWRITING PRESET 9 UNBLOCKING")
-                        block_set_9 = False
-                
-                if _BTN_A == 1:
-                    if not block_set_10:
-                        print("Dispatched command: OVERWRITING PRESET 10")
-                        cam.preset_set(10)
-                        block_set_10 = True
-                elif _BTN_A == 0:
-                    if block_set_10:
-                        print("Dispatched command: OVERWRITING PRESET 10 UNBLOCKING")
-                        block_set_10 = False
-                
-                if _BTN_X == 1:
-                    if not block_set_11:
-                        print("Dispatched command: OVERWRITING PRESET 11")
-                        cam.preset_set(11)
-                        block_set_11 = True
-                elif _BTN_X == 0:
-                    if block_set_11:
-                        print("Dispatched command: OVERWRITING PRESET 11 UNBLOCKING")
-                        block_set_11 = False
-            
-            if _MENU == 1 and _START == 1:    
-                if _ABS_HAT0 == (0, 1):
-                    if not block_set_12:
-                        print("Dispatched command: OVERWRITING PRESET 12")
-                        cam.preset_set(12)
-                        block_set_12 = True
-                
-                if _ABS_HAT0 == (1, 0):
-                    if not block_set_13:
-                        print("Dispatched command: OVERWRITING PRESET 13")
-                        cam.preset_set(13)
-                        block_set_13 = True
-                
-                if _ABS_HAT0 == (0, -1):
-                    if not block_set_14:
-                        print("Dispatched command: OVERWRITING PRESET 14")
-                        cam.preset_set(14)
-                        block_set_14 = True
-                    
-                if _ABS_HAT0 == (-1, 0):
-                    if not block_set_15:
-                        print("Dispatched command: OVERWRITING PRESET 15")
-                        cam.preset_set(15)
-                        block_set_15 = True
-                
-                # Reset/ground state.
-                if _ABS_HAT0 == (0, 0):
-                    if block_set_12:
-                        print("Dispatched command: OVERWRITING PRESET 12 UNBLOCKING")
-                        block_set_12 = False
-                    if block_set_13:
-                        print("Dispatched command: OVERWRITING PRESET 13 UNBLOCKING")
-                        block_set_13 = False
-                    if block_set_14:
-                        print("Dispatched command: OVERWRITING PRESET 14 UNBLOCKING")
-                        block_set_14 = False
-                    if block_set_15:
-                        print("Dispatched command: OVERWRITING PRESET 15 UNBLOCKING")
-                        block_set_15 = False
-            
-            # Turning off the camera.
-            if _BTN_JOY_L == 1 and _BTN_JOY_R == 1 and _START == 1:
-                #print("Why?")
-                #print(cam.get_power())
-                #print("Halp")
-                if not block_power_off:# and cam.get_power() == 1:
-                    print("Dispatched command: POWER OFF")
-                    cam.power(0)
-                    block_power_off = True
-            elif _BTN_JOY_L == 0 and _BTN_JOY_R == 0 or _START == 0:
-                if block_power_off:
-                    print("Dispatched command: POWER OFF UNBLOCKING")
-                    block_power_off = False
-            
-            # Turning on the camera.
-            if _MENU == 0 and _START == 2:
-                if not block_power_on and cam.get_power() == 0:
-                    print("Dispatched command: POWER ON")
-                    
-                    # Power on the camera.
-                    cam.power(1)
-                    
-                    # Do not send nor read any buffer until the PTZ is ready.
-                    print("[DEBUG] Starting the PTZ camera ...")
-                    time.sleep(PTZ_POWER_ON_DELAY)
-                    print("[DEBUG] PTZ Initialization complete!")
-                    
-                    # Attempt to close and re-initiate the PTZ object and regain port access.
-                    cam.reset_port()
-                    
-                    block_power_on = True
-            elif _MENU == 0 and _START == 0:
-                if block_power_on:
-                    print("Dispatched command: POWER ON UNBLOCKING")
-                    block_power_on = False
-
-            # Adjusting speed: pan-tilt movement
-            # ---
-            # Low speed
-            if _L1 == 0 and _L2 == 0:
-                MAX_MOVEMENT_SPEED = 1
-            # Medium speed
-            if _L1 == 1:
-                MAX_MOVEMENT_SPEED = 7
-            # Max speed
-            if _L2 == 1:
-                MAX_MOVEMENT_SPEED = 14
-            
-            # Adjusting speed: zoom movement
-            # ---
-            # Low speed
-            if _R1 == 0 and _R2 == 0:
-                MAX_ZOOM_SPEED = 1
-            # Medium speed
-            if _R1 == 1:
-                MAX_ZOOM_SPEED = 3
-            # Max speed
-            if _R2 == 1:
-                MAX_ZOOM_SPEED = 7
-
-            # Movement actions (left-right panning)
-            if _ABS_JOY_L_X != JOYSTICK_REST_VAL:
-                val = _ABS_JOY_L_X
-                # Do the movement
-                if val >= JOYSTICK_MIN_VAL and val < JOYSTICK_REST_VAL:
-                    if not block_left:
-                        print("Dispatched command: LEFT", f"-- Movement speed: {MAX_MOVEMENT_SPEED}")
-                        i = get_speed(1.0, MAX_MOVEMENT_SPEED)
-                        cam.left(round(i))
-                        block_left = True
-                elif val > JOYSTICK_REST_VAL and val <= JOYSTICK_MAX_VAL:
-                    if not block_right:
-                        print("Dispatched command: RIGHT", f"-- Movement speed: {MAX_MOVEMENT_SPEED}")
-                        i = get_speed(1.0, MAX_MOVEMENT_SPEED)
-                        cam.right(round(i))
-                        block_right = True
-
-            # Movement actions (up-down tilting)
-            if _ABS_JOY_L_Y != 128:
-                val = _ABS_JOY_L_Y
-                # Do the movement
-                if val >= JOYSTICK_MIN_VAL and val < JOYSTICK_REST_VAL:
-                    if not block_up:
-                        print("Dispatched command: UP", f"-- Movement speed: {MAX_MOVEMENT_SPEED}")
-                        i = get_speed(1.0, MAX_MOVEMENT_SPEED)
-                        cam.up(round(i))
-                        block_up = True
-                elif val > JOYSTICK_REST_VAL and val <= JOYSTICK_MAX_VAL:
-                    if not block_down:
-                        print("Dispatched command: DOWN", f"-- Movement speed: {MAX_MOVEMENT_SPEED}")
-                        i = get_speed(1.0, MAX_MOVEMENT_SPEED)
-                        cam.down(round(i))
-                        block_down = True
-
-            # Center state (at-rest state of the pan and tilt)
-            val_x = _ABS_JOY_L_X
-            val_y = _ABS_JOY_L_Y
-            if val_x == val_y and val_x == JOYSTICK_REST_VAL:
-                if not block_rest:
-                    print("Dispatched command: PAN-TILT REST")
-                    cam.stop()
-                    #time.sleep(MOVEMENT_STOP_DELAY)
-                    block_rest = True
-                    
-                    # Reset the blocking states of other directions.
-                    block_up = False
-                    block_down = False
-                    block_left = False
-                    block_right = False
-            else:
-                if block_rest:
-                    print("Dispatched command: PAN-TILT UNREST")
-                    block_rest = False
-
-            # Movement actions (zoom)
-            if _ABS_JOY_R_Y != 128:
-                val = _ABS_JOY_R_Y
-                # Do the movement
-                if val >= JOYSTICK_MIN_VAL and val < JOYSTICK_REST_VAL:
-                    if not block_zoom_in:
-                        print("Dispatched command: ZOOM IN", f"-- Zoom speed: {MAX_ZOOM_SPEED}")
-                        i = get_speed(1.0, MAX_ZOOM_SPEED)
-                        cam.zoom_in(round(i))
-                        block_zoom_in = True
-                elif val > JOYSTICK_REST_VAL and val <= JOYSTICK_MAX_VAL:
-                    if not block_zoom_out:
-                        print("Dispatched command: ZOOM OUT", f"-- Zoom speed: {MAX_ZOOM_SPEED}")
-                        i = get_speed(1.0, MAX_ZOOM_SPEED)
-                        cam.zoom_out(round(i))
-                        block_zoom_out = True
-            
-            # Center state of the zoom. Used to stop the zoom command.
-            val_ry = _ABS_JOY_R_Y
-            if val_ry == JOYSTICK_REST_VAL:
-                if not block_zoom_rest:
-                    print("Dispatched command: ZOOM REST")
-                    cam.zoom_stop()
-                    block_zoom_rest = True
-                    
-                    # Reset the blocking states of the zoom.
-                    block_zoom_in = False
-                    block_zoom_out = False
-            else:
-                if block_zoom_rest:
-                    print("Dispatched command: ZOOM UNREST")
-                    block_zoom_rest = False
+    try:
+        while not engine.done:
+            # Event processing step.
+            # Sleep until the gamepad reports a change (and the next deadline), so that an idle controller costs no CPU,
+            # or until the filters of the sticks held still run again (see ptz_gamepad/conditioning.py).
+            still = [jid for jid, sticks in conditioners.items() if settling(sticks)]
+            timeout = SETTLE_INTERVAL if still else None
+            changed = engine.wait(timeout) if scheduler is None else engine.tick(scheduler, timeout)
+            changed += [engine.pads[jid] for jid in still if jid in engine.pads and engine.pads[jid] not in changed]
+
+            # Button presses and releases: a single lookup each in the layout.
+            # Each joystick drives the camera selected by its own operator (see CameraRig.operator_for()).
+            for pad, control, pressed in engine.controls:
+                operator = rig.operator_for(pad.instance_id)
+                table.handle(pad, control, pressed, operator.state, operator.actions)
+
+            # The camera of an unplugged gamepad stops, whatever its sticks were doing.
+            for jid in engine.removed:
+                rig.operator_for(jid).state.stop_motion()
+                quantizers.pop(jid, None)
+                conditioners.pop(jid, None)
+
+            # For each joystick that has changed:
+            for joystick in changed:
+                jid = joystick.get_instance_id()
+
+                # Printing the joystick name
+                name = joystick.get_name()
+                if init_state:
+                    log.info("Joystick name: %s", name)
+                    log.warning("IF THE JOYSTICK NAME IS ANYTHING OTHER THAN 'Xbox 360 Controller' "
+                                "UNPLUG THE GAMEPAD'S WIRELESS USB (DONGLE) AND PLUG IT IN AGAIN UNTIL IT IS DETECTED AS AN XBOX 360 GAMEPAD")
+                    init_state = False
+
+                # Category of analog values
+                # (conditioned: deadzone, response curve, filter, see the "sticks" section of the layout)
+                if jid not in conditioners:
+                    conditioners[jid] = (table.sticks.conditioner(2), table.sticks.conditioner(1))
+                movement, zooming = conditioners[jid]
+                movement.update(joystick.get_axis(axes['pan']), joystick.get_axis(axes['tilt']))
+                zooming.update(joystick.get_axis(axes['zoom']))
+                _ABS_JOY_L_X, _ABS_JOY_L_Y = movement.values
+                _ABS_JOY_R_Y, = zooming.values
+
+                # Adjusting speed: the max speeds of the speed tiers held (see the "sticks" section of the layout)
+                limits = table.sticks.limits(joystick)
+                MAX_MOVEMENT_SPEED = limits.get('movement')
+                MAX_ZOOM_SPEED = limits.get('zoom', ZOOM_SPEED_MAX)
+
+                # DEBUG:
+                # (Please comment out this section after use.)
+                # print(MAX_MOVEMENT_SPEED, MAX_ZOOM_SPEED, _ABS_JOY_L_X, _ABS_JOY_L_Y, _ABS_JOY_R_Y)
+
+                # Turning on the camera is bound in the layout (START + MENU, the "power_on" action):
+                # the camera boots in the background, and its controls are held until it reports being on.
+                state = rig.operator_for(jid).state
+                pan_speed, tilt_speed = quantizers.setdefault(jid, (SpeedQuantizer(PAN_SPEED_MAX), SpeedQuantizer(TILT_SPEED_MAX)))
+
+                # Movement actions (left-right panning, up-down tilting)
+                # The center state (at-rest state of the pan and tilt) stops the movement.
+                if PROPORTIONAL_SPEED:
+                    pan = drive(_ABS_JOY_L_X, 'left', 'right', pan_speed(_ABS_JOY_L_X, MAX_MOVEMENT_SPEED), JOYSTICK_REST_VAL)
+                    tilt = drive(_ABS_JOY_L_Y, 'up', 'down', tilt_speed(_ABS_JOY_L_Y, MAX_MOVEMENT_SPEED), JOYSTICK_REST_VAL)
+                else:
+                    # The full speed of the speed tier, whatever the deflection
+                    pan = drive(_ABS_JOY_L_X, 'left', 'right', pan_speed(1.0, MAX_MOVEMENT_SPEED), JOYSTICK_REST_VAL)
+                    tilt = drive(_ABS_JOY_L_Y, 'up', 'down', tilt_speed(1.0, MAX_MOVEMENT_SPEED), JOYSTICK_REST_VAL)
+                # Tracing only: an analog stick dispatches a command on nearly every event.
+                if state.pan_tilt(pan, tilt) and log.tracing:
+                    if pan is None and tilt is None:
+                        log.trace("Dispatched command: PAN-TILT REST")
+                    else:
+                        log.trace("Dispatched command: PAN-TILT -- Pan: %s, Tilt: %s", pan, tilt)
+
+                # Movement actions (zoom)
+                # The center state of the zoom is used to stop the zoom command.
+                zoom = drive(_ABS_JOY_R_Y, 'zoom_in', 'zoom_out', get_speed(1.0, MAX_ZOOM_SPEED), JOYSTICK_REST_VAL)
+                if state.update('zoom', zoom or ('zoom_stop',)) and log.tracing:
+                    if zoom is None:
+                        log.trace("Dispatched command: ZOOM REST")
+                    else:
+                        log.trace("Dispatched command: ZOOM -- Zoom: %s", zoom)
+    finally:
+        if scheduler is not None:
+            log.info("Control loop: %s", scheduler)
+        # Release the serial ports, so that the fail-safe loop can open them again.
+        rig.close()
 
 if __name__ == "__main__":
-    # Prompt for the PTZ's USB serial port
-    port = askstring(
-        'Serial USB Input',
-        'Please enter the VISCA PTZ\'s registered serial port\ne.g. Windows: "COM1", "COM2", etc.\ne.g. Linux: "/dev/ttyUSB0", "/dev/ttyUSB1", etc.',
-        initialvalue='COM9'
-    )
+    # The serial port and the settings come from the command line or the config file,
+    # else the port is prompted for (see ptz_gamepad/launch.py).
+    options = parse_options('Control the VISCA PTZ camera using a TaffGO XBOX 360 gamepad.', initialvalue='COM9')
+    init_joysticks()
 
     # Fail-safe mechanism
     # To exit the program, press Ctrl+C or Ctrl+D from your terminal.
     while(True):
         try:
-            main(port)
+            main(options.port, options.layout or 'taffgo', options.rate, options.listen, options.pads)
         except Exception as e:
-            print(f'[DEBUG] Error encountered: {e}')
+            log.error('Error encountered: %s', e)
             
             # Wait for one second before continuing
             time.sleep(1)
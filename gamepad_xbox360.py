@@ -16,246 +16,124 @@
 # Controller constants can be found in:
 # https://www.pygame.org/docs/ref/sdl2_controller.html#pygame._sdl2.controller.Controller.get_button
 
-from pyvisca import visca
-from tkinter.simpledialog import askstring
-import numpy
+from ptz_gamepad import log
+from ptz_gamepad.bindings import load_bindings
+from ptz_gamepad.cameras import CameraRig
+from ptz_gamepad.conditioning import SETTLE_INTERVAL
+from ptz_gamepad.conditioning import settling
+from ptz_gamepad.inputs import InputEngine
+from ptz_gamepad.inputs import init_joysticks
+from ptz_gamepad.launch import parse_options
+from ptz_gamepad.scheduler import FixedRateScheduler
+from ptz_gamepad.speed import PAN_SPEED_MAX
+from ptz_gamepad.speed import SpeedQuantizer
+from ptz_gamepad.speed import TILT_SPEED_MAX
+from ptz_gamepad.speed import ZOOM_SPEED_MAX
+from ptz_gamepad.state import drive
 import pygame as pg
-import time
 
-pg.init()
+def main(port='COM7', layout='xbox360', rate=None, listen=None, pads=None):
+    # Keeps the cached state of every connected joystick, updated by gamepad events only.
+    engine = InputEngine()
 
-def get_speed(val, max_speed):
-    '''
-    Calculate the absolute speed according to the analog joystick's input voltage.
-    If val == 0.004, then the joystick is at rest.
-    The range of value (val) is within -1 and 1.
-    '''
-    i = numpy.abs( val )
-    return float( max_speed * float(i) )
-
-def main(port='COM7'):
-    # This dict can be left as-is, since pygame will generate a
-    # pg.JOYDEVICEADDED event for every joystick connected
-    # at the start of the program.
-    joysticks = {}
-
-    # Establish and initialize the VISCA object
+    # Establish and initialize the VISCA cameras
     # (Change the port value according to your system's availability.)
-    cam = visca.PTZ(port)
+    # e.g. "COM7", or "COM7@1-3 COM8" for cameras 1 to 3 on the COM7 daisy chain and camera 1 on COM8.
+    # All serial writes happen on each port's dispatcher thread, never in this loop.
+    # The rig remembers the last command of every control of every camera, so that only changes are sent.
+    rig = CameraRig(port, listen=listen, pads=pads).start()
+    
+    # The buttons of the presets, the camera selection, etc. are mapped in bindings/xbox360.json
+    # (or in the layout file given instead).
+    table = load_bindings(layout, rig.actions)
     
-    # Set the max speed (pixel per 100 ms) of the X-Y joystick movement
-    MAX_MOVEMENT_SPEED = 7
-    MAX_ZOOM_SPEED = 7
+    # So are the axes of the sticks and the speed tiers (R1 medium, R2 max), in its "sticks" section.
+    table.sticks.require('pan', 'tilt', 'zoom')
+    axes = table.sticks.axes
     
-    # Set the delay time for movement speed
-    MOVEMENT_REDUNDANT_DELAY = 0.01
+    # Quantize the stick deflection onto the camera's speed steps,
+    # so that a new speed is only sent when the stick clearly moves to another step.
+    # Every joystick has its own quantizers, since they remember the current speed step.
+    quantizers = {}
+    # ... and its own stick conditioners, since their filters remember the past positions.
+    conditioners = {}
     
-    # Set the delay time after each movement, before stopping any continuous command
-    MOVEMENT_STOP_DELAY = 0.0005
-    MOVEMENT_STOP_DELAY_LONG = 0.5
+    # The conditioned sticks read exactly 0.0 at rest, whatever their drift within the deadzone.
+    JOYSTICK_REST_VAL = 0.0
     
-    # If val == 0.004, then the joystick is at rest.
-    JOYSTICK_REST_VAL = 0.000
-    JOYSTICK_MIN_VAL = -1
-    JOYSTICK_MAX_VAL = 1
+    # With a fixed rate (in Hz), the events are applied together on a grid of deadlines (see ptz_gamepad/scheduler.py).
+    scheduler = FixedRateScheduler(rate) if rate else None
 
-    done = False
-    while not done:
+    while not engine.done:
         # Event processing step.
-        # Possible joystick events: JOYAXISMOTION, JOYBALLMOTION, JOYBUTTONDOWN,
-        # JOYBUTTONUP, JOYHATMOTION, JOYDEVICEADDED, JOYDEVICEREMOVED
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                print("Quitting.")
-                done = True  # Flag that we are done so we exit this loop.
-
-            if event.type == pg.JOYBUTTONDOWN:
-                print("Joystick button pressed.")
-
-            if event.type == pg.JOYBUTTONUP:
-                print("Joystick button released.")
-
-            # Handle hotplugging
-            if event.type == pg.JOYDEVICEADDED:
-                # This event will be generated when the program starts for every
-                # joystick, filling up the list without needing to create them manually.
-                joy = pg.joystick.Joystick(event.device_index)
-                joysticks[joy.get_instance_id()] = joy
-                print(f"Joystick {joy.get_instance_id()} connencted")
-
-            if event.type == pg.JOYDEVICEREMOVED:
-                del joysticks[event.instance_id]
-                print(f"Joystick {event.instance_id} disconnected")
-
-        # For each joystick:
-        for joystick in joysticks.values():
+        # Sleep until the gamepad reports a change (and the next deadline), so that an idle controller costs no CPU,
+        # or until the filters of the sticks held still run again (see ptz_gamepad/conditioning.py).
+        still = [jid for jid, sticks in conditioners.items() if settling(sticks)]
+        timeout = SETTLE_INTERVAL if still else None
+        changed = engine.wait(timeout) if scheduler is None else engine.tick(scheduler, timeout)
+        changed += [engine.pads[jid] for jid in still if jid in engine.pads and engine.pads[jid] not in changed]
+        
+        # Button presses and releases: a single lookup each in the layout.
+        # Each joystick drives the camera selected by its own operator (see CameraRig.operator_for()).
+        for pad, control, pressed in engine.controls:
+            operator = rig.operator_for(pad.instance_id)
+            table.handle(pad, control, pressed, operator.state, operator.actions)
+        
+        # The camera of an unplugged gamepad stops, whatever its sticks were doing.
+        for jid in engine.removed:
+            rig.operator_for(jid).state.stop_motion()
+            quantizers.pop(jid, None)
+            conditioners.pop(jid, None)
+        
+        # For each joystick that has changed:
+        for joystick in changed:
             jid = joystick.get_instance_id()
-            
-            # Category of binary respond values
-            _L1 = joystick.get_button(4)
-            _L2 = 1 if int(joystick.get_axis(4)) == 0 else 0
-            _R1 = joystick.get_button(5)
-            _R2 = 1 if int(joystick.get_axis(5)) == 0 else 0
-            _MENU = joystick.get_button(6)
-            _START = joystick.get_button(7)
-            _BTN_JOY_L = joystick.get_button(8)
-            _BTN_JOY_R = joystick.get_button(9)
-            _BTN_A = joystick.get_button(pg.CONTROLLER_BUTTON_A)
-            _BTN_B = joystick.get_button(pg.CONTROLLER_BUTTON_B)
-            _BTN_X = joystick.get_button(pg.CONTROLLER_BUTTON_X)
-            _BTN_Y = joystick.get_button(pg.CONTROLLER_BUTTON_Y)
+            state = rig.operator_for(jid).state
+            pan_speed, tilt_speed, zoom_speed = quantizers.setdefault(
+                jid, (SpeedQuantizer(PAN_SPEED_MAX), SpeedQuantizer(TILT_SPEED_MAX), SpeedQuantizer(ZOOM_SPEED_MAX))
+            )
             
             # Category of analog values
-            _ABS_HAT0 = joystick.get_hat(0)
-            _ABS_JOY_L_X = float( str(f"{ ('%.3f' % joystick.get_axis(0)) }") )
-            _ABS_JOY_L_Y = float( str(f"{ ('%.3f' % joystick.get_axis(1)) }") )
-            _ABS_JOY_R_X = float( str(f"{ ('%.3f' % joystick.get_axis(2)) }") )
-            _ABS_JOY_R_Y = float( str(f"{ ('%.3f' % joystick.get_axis(3)) }") )
+            # (conditioned: deadzone, response curve, filter, see the "sticks" section of the layout)
+            if jid not in conditioners:
+                conditioners[jid] = (table.sticks.conditioner(2), table.sticks.conditioner(1))
+            movement, zooming = conditioners[jid]
+            movement.update(joystick.get_axis(axes['pan']), joystick.get_axis(axes['tilt']))
+            zooming.update(joystick.get_axis(axes['zoom']))
+            _ABS_JOY_L_X, _ABS_JOY_L_Y = movement.values
+            _ABS_JOY_R_Y, = zooming.values
+            
+            # Adjusting speed: the max speeds of the speed tiers held (see the "sticks" section of the layout)
+            limits = table.sticks.limits(joystick)
+            MAX_MOVEMENT_SPEED = limits.get('movement')
+            MAX_ZOOM_SPEED = limits.get('zoom')
             
             # DEBUG:
             # (Please comment out this section after use.)
-            # print(_L1, _L2, _R1, _R2, _MENU, _START, _BTN_JOY_L, _BTN_JOY_R, _BTN_A, _BTN_B, _BTN_X, _BTN_Y, _ABS_HAT0, _ABS_JOY_L_X, _ABS_JOY_L_Y, _ABS_JOY_R_X, _ABS_JOY_R_Y)
-
-            # Recalling presets: left hand
-            if _ABS_HAT0 == (0, 1) and _MENU == 0:
-                cam.preset_recall(4)
-                _ABS_HAT0 = (0, 0)  # --- blocking
-            if _ABS_HAT0 == (1, 0) and _MENU == 0:
-                cam.preset_recall(5)
-                _ABS_HAT0 = (0, 0)  # --- blocking
-            if _ABS_HAT0 == (0, -1) and _MENU == 0:
-                cam.preset_recall(6)
-                _ABS_HAT0 = (0, 0)  # --- blocking
-            if _ABS_HAT0 == (-1, 0) and _MENU == 0:
-                cam.preset_recall(7)
-                _ABS_HAT0 = (0, 0)  # --- blocking
-            
-            # Recalling presets: right hand
-            if _BTN_Y == 1 and _MENU == 0:
-                cam.preset_recall(0)
-                _BTN_Y = 0  # --- blocking
-            if _BTN_B == 1 and _MENU == 0:
-                cam.preset_recall(1)
-                _BTN_B = 0  # --- blocking
-            if _BTN_A == 1 and _MENU == 0:
-                cam.preset_recall(2)
-                _BTN_A = 0  # --- blocking
-            if _BTN_X == 1 and _MENU == 0:
-                cam.preset_recall(3)
-                _BTN_X = 0  # --- blocking
-            
-            # Setting/assigning presets: left hand
-            if _ABS_HAT0 == (0, 1) and _MENU == 1:
-                cam.preset_set(4)
-                _ABS_HAT0 = (0, 0)  # --- blocking
-            if _ABS_HAT0 == (1, 0) and _MENU == 1:
-                cam.preset_set(5)
-                _ABS_HAT0 = (0, 0)  # --- blocking
-            if _ABS_HAT0 == (0, -1) and _MENU == 1:
-                cam.preset_set(6)
-                _ABS_HAT0 = (0, 0)  # --- blocking
-            if _ABS_HAT0 == (-1, 0) and _MENU == 1:
-                cam.preset_set(7)
-                _ABS_HAT0 = (0, 0)  # --- blocking
-            
-            # Setting/assigning presets: right hand
-            if _BTN_Y == 1 and _MENU == 1:
-                cam.preset_set(0)
-                _BTN_Y = 0  # --- blocking
-            if _BTN_B == 1 and _MENU == 1:
-                cam.preset_set(1)
-                _BTN_B = 0  # --- blocking
-            if _BTN_A == 1 and _MENU == 1:
-                cam.preset_set(2)
-                _BTN_A = 0  # --- blocking
-            if _BTN_X == 1 and _MENU == 1:
-                cam.preset_set(3)
-                _BTN_X = 0  # --- blocking
-            
-            # Adjusting speed
-            # ---
-            # Low speed
-            if _R1 == 0 and _R2 == 0:
-                MOVEMENT_STOP_DELAY = 0.0001
-                MOVEMENT_STOP_DELAY_LONG = 0.05
-                MAX_ZOOM_SPEED = 1
-                MAX_MOVEMENT_SPEED = 1
-            # Medium speed
-            if _R1 == 1:
-                MOVEMENT_STOP_DELAY = 0.05
-                MOVEMENT_STOP_DELAY_LONG = 0.1
-                MAX_ZOOM_SPEED = 4
-                MAX_MOVEMENT_SPEED = 3
-            # Max speed
-            if _R2 == 1:
-                MOVEMENT_STOP_DELAY = 0.3
-                MOVEMENT_STOP_DELAY_LONG = 0.5
-                MAX_ZOOM_SPEED = 7
-                MAX_MOVEMENT_SPEED = 14
+            # print(MAX_MOVEMENT_SPEED, MAX_ZOOM_SPEED, _ABS_JOY_L_X, _ABS_JOY_L_Y, _ABS_JOY_R_Y)
             
-            # Movement actions (left-right panning)
-            if _ABS_JOY_L_X != JOYSTICK_REST_VAL:
-                val = _ABS_JOY_L_X
-                i = get_speed(val, MAX_MOVEMENT_SPEED)
-                # Do the movement
-                if val >= JOYSTICK_MIN_VAL and val < JOYSTICK_REST_VAL:
-                    cam.left(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY)
-                    cam.stop()
-                elif val > JOYSTICK_REST_VAL and val <= JOYSTICK_MAX_VAL:
-                    cam.right(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY)
-                    cam.stop()
-            
-            # Movement actions (up-down tilting)
-            if _ABS_JOY_L_Y != 128:
-                val = _ABS_JOY_L_Y
-                i = get_speed(val, MAX_MOVEMENT_SPEED)
-                # Do the movement
-                if val >= JOYSTICK_MIN_VAL and val < JOYSTICK_REST_VAL:
-                    cam.up(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY)
-                    cam.stop()
-                elif val > JOYSTICK_REST_VAL and val <= JOYSTICK_MAX_VAL:
-                    cam.down(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY)
-                    cam.stop()
+            # Movement actions (left-right panning, up-down tilting)
+            val = _ABS_JOY_L_X
+            pan = drive(val, 'left', 'right', pan_speed(val, MAX_MOVEMENT_SPEED), JOYSTICK_REST_VAL)
+            val = _ABS_JOY_L_Y
+            tilt = drive(val, 'up', 'down', tilt_speed(val, MAX_MOVEMENT_SPEED), JOYSTICK_REST_VAL)
+            state.pan_tilt(pan, tilt)
             
             # Movement actions (zoom)
-            if _ABS_JOY_R_Y != 128:
-                val = _ABS_JOY_R_Y
-                i = get_speed(val, MAX_ZOOM_SPEED)
-                # Do the movement
-                if val >= JOYSTICK_MIN_VAL and val < JOYSTICK_REST_VAL:
-                    cam.zoom_in(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY_LONG)
-                    cam.zoom_stop()
-                elif val > JOYSTICK_REST_VAL and val <= JOYSTICK_MAX_VAL:
-                    cam.zoom_out(round(i))
-                    time.sleep(MOVEMENT_STOP_DELAY_LONG)
-                    cam.zoom_stop()
-            
-            # Analog center button press actions
-            # ---
-            # Move camera to home/default position
-            if _BTN_JOY_L == 1:
-                cam.home()
-                _BTN_JOY_L = 0  # --- blocking
-            # Perform autofocus
-            if _BTN_JOY_R == 1:
-                cam.autofocus_sens_low()
-                _BTN_JOY_R = 0  # --- blocking
-            
-            # Prevent too fast a movement
-            time.sleep(MOVEMENT_REDUNDANT_DELAY)
+            val = _ABS_JOY_R_Y
+            zoom = drive(val, 'zoom_in', 'zoom_out', zoom_speed(val, MAX_ZOOM_SPEED), JOYSTICK_REST_VAL)
+            state.update('zoom', zoom or ('zoom_stop',))
+    
+    if scheduler is not None:
+        log.info("Control loop: %s", scheduler)
+    rig.close()
 
 if __name__ == "__main__":
-    # Prompt for the PTZ's USB serial port
-    port = askstring(
-        'Serial USB Input',
-        'Please enter the VISCA PTZ\'s registered serial port\ne.g. Windows: "COM1", "COM2", etc.\ne.g. Linux: "/dev/ttyUSB0", "/dev/ttyUSB1", etc.'
-    )
-    main(port)
+    # The serial port and the settings come from the command line or the config file,
+    # else the port is prompted for (see ptz_gamepad/launch.py).
+    options = parse_options('Control the VISCA PTZ camera using an XBOX 360 gamepad.')
+    init_joysticks()
+    main(options.port, options.layout or 'xbox360', options.rate, options.listen, options.pads)
     
     # If you forget this line, the program will 'hang'
     # on exit if running from IDLE.
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+#
+# Shared building blocks for the gamepad PTZ controller scripts
+# Licensed under GPL-3.0
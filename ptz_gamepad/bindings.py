@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# Declarative button mappings
+# Licensed under GPL-3.0
+# ---
+# The button layout of every gamepad lives in a JSON file of the "bindings" directory
+# instead of in long if-chains. At startup the file is compiled into a dict keyed by
+# (control, modifier layer), so that every button press or release costs a single lookup.
+#
+# File format:
+#   {
+#     "modifiers": {"MENU": "button:6", "START": "button:7"},
+#     "bindings": [
+#       {"control": "button:3", "command": ["preset_recall", 0]},
+#       {"control": "button:3", "layer": ["MENU"], "command": ["preset_set", 0], "message": "OVERWRITING PRESET 0"},
+#       {"control": "hat:0:up", "command": ["preset_recall", 4]},
+#       {"control": "axis:4:+", "layer": ["START"], "action": "broadcast"},
+#       {"control": "button:0", "layer": ["MENU", "START"], "action": ["recall_shot", "pulpit"]}
+#     ]
+#   }
+# Controls are "button:<n>", "hat:<n>:<up|down|left|right>" and "axis:<n>:<+|->" (an axis pushed
+# past half way, such as an analog trigger). A binding only fires when exactly the modifiers of
+# its layer are held ("layer": "*" binds it in every layer that does not bind that control otherwise).
+# A "command" is a visca.PTZ method with its arguments, sent once per press;
+# an "action" is one of the controller's own functions (e.g. "next_camera"), or a list of
+# the function and its arguments (e.g. ["recall_shot", "pulpit"], see ptz_gamepad/presets.py).
+#
+# The optional "sticks" section names the axes of the continuous movements, and the speed tiers:
+#   "sticks": {
+#     "pan": 0, "tilt": 1, "zoom": 3, "focus": 2, "rest": 0.004,
+#     "deadzone": 0.1, "curve": 2.0, "filter": {"type": "one_euro", "min_cutoff": 1.0, "beta": 0.5},
+#     "speeds": [
+#       {"movement": 1, "zoom": 1},
+#       {"control": "button:5", "movement": 3, "zoom": 4}
+#     ]
+#   }
+# The max speeds ("movement" for pan-tilt, "zoom" and "focus") of every tier whose control is held
+# (or that has no control) apply in order, so the last one held wins. A speed left unset spans the
+# whole speed range of the camera.
+# "rest" is the value the axes read at rest, and the other settings condition the stick positions
+# (deadzone, saturation, radial, curve, filter, resolution: see ptz_gamepad/conditioning.py).
+
+from ptz_gamepad import log
+from ptz_gamepad.conditioning import StickConditioner
+from ptz_gamepad.conditioning import parse_conditioning
+from ptz_gamepad.inputs import axis_side
+import json
+import os
+
+# Directory of the layout files shipped with the scripts
+BINDINGS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bindings')
+
+HAT_DIRECTIONS = {'up': (0, 1), 'right': (1, 0), 'down': (0, -1), 'left': (-1, 0)}
+
+# Stick axes of the "sticks" section, and the max speeds a speed tier may set
+STICK_AXES = ('pan', 'tilt', 'zoom', 'focus')
+SPEED_LIMITS = ('movement', 'zoom', 'focus')
+
+def parse_control(text):
+    '''
+    Turn a control name ("button:3", "hat:0:up", "axis:4:+") into the control key
+    used by InputEngine.controls (('button', 3), ('hat', 0, (0, 1)), ('axis', 4, 1)).
+    '''
+    parts = text.strip().split(':')
+    try:
+        if parts[0] == 'button' and len(parts) == 2:
+            return ('button', int(parts[1]))
+        if parts[0] == 'hat' and len(parts) == 3:
+            return ('hat', int(parts[1]), HAT_DIRECTIONS[parts[2]])
+        if parts[0] == 'axis' and len(parts) == 3:
+            return ('axis', int(parts[1]), {'+': 1, '-': -1}[parts[2]])
+    except (KeyError, ValueError):
+        pass
+    raise ValueError(f'Invalid control "{text}"')
+
+def _held(pad, control):
+    ''' Whether a control is held down on the pad right now. '''
+    if control[0] == 'button':
+        return pad.get_button(control[1]) == 1
+    if control[0] == 'hat':
+        return tuple(pad.get_hat(control[1])) == control[2]
+    return axis_side(pad.get_axis(control[1])) == control[2]
+
+class Binding(object):
+    __slots__ = ('command', 'action', 'args', 'message', 'slot')
+
+    def __init__(self, command=None, action=None, message=None):
+        self.command = tuple(command) if command is not None else None
+        # An action is a function name, or a list of the name and its arguments.
+        if isinstance(action, (list, tuple)):
+            self.action, self.args = action[0], tuple(action[1:])
+        else:
+            self.action, self.args = action, ()
+        self.message = message
+        # The CameraState slot of the command; a command bound to several controls shares its slot.
+        self.slot = self.command
+
+class Sticks(object):
+    '''
+    Compiled "sticks" section of a layout.
+    "axes" maps the movements ('pan', 'tilt', 'zoom', 'focus') to an axis index,
+    "tiers" is a list of (control, max speeds), the control being None for the default speeds,
+    and "conditioning" the settings of the StickConditioner of every stick.
+    '''
+    __slots__ = ('axes', 'rest', 'tiers', 'conditioning')
+
+    def __init__(self, axes=None, rest=0.0, tiers=(), conditioning=None):
+        self.axes = axes or {}
+        self.rest = rest
+        self.tiers = list(tiers)
+        self.conditioning = conditioning or {}
+
+    def require(self, *names):
+        ''' Check that the layout names the axes of the movements "names" (e.g. 'pan', 'tilt', 'zoom'). '''
+        missing = [name for name in names if name not in self.axes]
+        if missing:
+            raise ValueError(f'The "sticks" section of the layout should name the axes of {", ".join(missing)}')
+
+    def conditioner(self, axes=2):
+        ''' A new StickConditioner for a stick of "axes" axes (1 or 2) of this layout. '''
+        return StickConditioner(axes, self.rest, **self.conditioning)
+
+    def limits(self, pad):
+        ''' Max speed of each movement ('movement', 'zoom', 'focus') set by the speed tiers held on the pad. '''
+        limits = {}
+        for control, tier in self.tiers:
+            if control is None or _held(pad, control):
+                limits.update(tier)
+        return limits
+
+class BindingTable(object):
+    '''
+    Compiled button layout.
+    "modifiers" is a list of (bit, control) tuples, "table" maps (control, modifier bits) to a Binding,
+    and "sticks" describes the continuous movements.
+    '''
+
+    def __init__(self, modifiers, table, sticks=None):
+        self.modifiers = modifiers
+        self.table = table
+        self.sticks = sticks or Sticks()
+        # A modifier pressed on its own is looked up without its own bit.
+        self.own = {control: bit for bit, control in modifiers}
+        # (pad instance id, control) -> (Binding, CameraState) of the controls held down,
+        # so that a release reaches the camera that got the press.
+        self.active = {}
+
+    def layer(self, pad):
+        ''' Bits of the modifiers held on the pad. '''
+        mask = 0
+        for bit, control in self.modifiers:
+            if _held(pad, control):
+                mask |= bit
+        return mask
+
+    def handle(self, pad, control, pressed, state, actions=None):
+        '''
+        Apply the press or release of a control to the camera state "state".
+        "actions" maps the action names to the functions to call on press.
+        Returns the Binding that has been applied, or None.
+        '''
+        key = (pad.instance_id, control)
+        if not pressed:
+            active = self.active.pop(key, None)
+            if active is not None and active[0].command is not None:
+                active[1].update(active[0].slot, None)
+            return active[0] if active is not None else None
+
+        binding = self.table.get((control, self.layer(pad) & ~self.own.get(control, 0)))
+        if binding is None:
+            return None
+
+        self.active[key] = (binding, state)
+        if binding.action is not None:
+            if actions is not None and binding.action in actions:
+                actions[binding.action](*binding.args)
+        elif state.update(binding.slot, binding.command) and binding.message:
+            log.info("Dispatched command: %s", binding.message)
+        return binding
+
+def compile_bindings(layout, actions=()):
+    '''
+    Compile a layout (the parsed JSON object) into a BindingTable.
+    If "actions" is given, every action name must be one of them.
+    Raises ValueError on invalid controls, unknown modifiers or conflicting bindings.
+    '''
+    modifiers = []
+    bits = {}
+    for i, (name, control) in enumerate(sorted(layout.get('modifiers', {}).items())):
+        bits[name] = 1 << i
+        modifiers.append((1 << i, parse_control(control)))
+
+    table = {}
+    wildcards = []
+    for item in layout.get('bindings', []):
+        control = parse_control(item['control'])
+        if ('command' in item) == ('action' in item):
+            raise ValueError(f'The binding of {item["control"]} needs either a "command" or an "action"')
+        binding = Binding(item.get('command'), item.get('action'), item.get('message'))
+        if binding.action is not None and actions and binding.action not in actions:
+            raise ValueError(f'Unknown action "{binding.action}" in the binding of {item["control"]}')
+
+        if item.get('layer') == '*':
+            wildcards.append((control, binding))
+            continue
+
+        mask = 0
+        for name in item.get('layer', []):
+            if name not in bits:
+                raise ValueError(f'Unknown modifier "{name}" in the binding of {item["control"]}')
+            mask |= bits[name]
+        if (control, mask) in table:
+            raise ValueError(f'{item["control"]} is bound twice in the layer {item.get("layer", [])}')
+        table[(control, mask)] = binding
+
+    # Fill the layers the wildcard bindings are not overridden in.
+    for control, binding in wildcards:
+        for mask in range(1 << len(modifiers)):
+            table.setdefault((control, mask), binding)
+
+    section = layout.get('sticks', {})
+    axes = {name: int(section[name]) for name in STICK_AXES if name in section}
+    tiers = []
+    for item in section.get('speeds', []):
+        control = parse_control(item['control']) if 'control' in item else None
+        tiers.append((control, {name: int(item[name]) for name in SPEED_LIMITS if name in item}))
+    sticks = Sticks(axes, float(section.get('rest', 0.0)), tiers, parse_conditioning(section))
+
+    return BindingTable(modifiers, table, sticks)
+
+def load_bindings(name, actions=()):
+    '''
+    Load and compile a layout file.
+    "name" is either the path of a JSON file, or the name of a layout of BINDINGS_DIR (e.g. "xbox360").
+    '''
+    path = name if name.endswith('.json') else os.path.join(BINDINGS_DIR, f'{name}.json')
+    with open(path, encoding='utf-8') as f:
+        return compile_bindings(json.load(f), actions)
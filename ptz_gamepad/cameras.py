@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+#
+# Several cameras, on one or more serial ports
+# Licensed under GPL-3.0
+# ---
+# Up to seven VISCA cameras can share one RS-232/RS-422 daisy chain, told apart by
+# the address in the first byte of every packet (8x, x = 1-7; 88 is the broadcast).
+# pyvisca always writes to camera 1, so AddressedPTZ rewrites that byte on the fly.
+# Every serial port gets its own ViscaDispatcher (and so its own worker thread),
+# so a slow or stuck camera on one port never delays the cameras on the others.
+# A StatusPoller per port keeps the StatusCache of its cameras up to date (see ptz_gamepad/status.py).
+# A "udp://host[:port]" port is a VISCA over IP camera instead (see ptz_gamepad/viscaip.py).
+# The rig may also serve its cameras to other tools over TCP (see ptz_gamepad/server.py).
+# Several gamepads may be bound to different cameras (or groups of cameras), each with an
+# Operator of its own: its own selection, broadcast mode and shot actions.
+
+from ptz_gamepad import log
+from ptz_gamepad import metrics
+from ptz_gamepad.dispatcher import BROADCAST
+from ptz_gamepad.dispatcher import INQUIRY_TIMEOUT
+from ptz_gamepad.dispatcher import ViscaDispatcher
+from ptz_gamepad.power import PowerSequencer
+from ptz_gamepad.presets import PresetBank
+from ptz_gamepad.presets import capture
+from ptz_gamepad.state import CameraState
+from ptz_gamepad.status import StatusCache
+from ptz_gamepad.status import StatusPoller
+from ptz_gamepad.viscaip import ViscaIPPort
+from ptz_gamepad.viscaip import is_ip_port
+from pyvisca import visca
+from threading import Thread
+import binascii
+import re
+import serial
+
+# Address Set (88 30 01 FF): number the cameras of a chain 1, 2, 3, ... in wiring order
+ADDRESS_SET = '883001FF'
+
+BYTES_WRITTEN = metrics.counter('ptz_serial_bytes_written_total', 'Bytes written to the serial ports', ('port',))
+
+# Older cached positions are not shown anymore (in second)
+POSITION_MAX_AGE = 2.0
+
+def open_port(name):
+    ''' Open a serial port, or the UDP socket of a "udp://host[:port]" VISCA over IP camera. '''
+    if is_ip_port(name):
+        return ViscaIPPort(name)
+    # Setting "write_timeout" to zero prevents "write timeout exception".
+    return serial.Serial(name, writeTimeout=0, write_timeout=0)
+
+class AddressedPTZ(visca.PTZ):
+    '''
+    visca.PTZ that sends its commands to the camera at "address" instead of always camera 1.
+    The ViscaDispatcher of the port points it at the right camera before every command.
+    '''
+
+    def __init__(self, output='COM1', address=1):
+        # visca.PTZ.__init__ cannot be subclassed (it calls super() on self.__class__),
+        # and visca.Camera.__init__ only opens serial ports.
+        self.serial_port = output
+        self._output = open_port(output)
+        self.address = address
+
+    def comm(self, com):
+        if self.address != 1 and com[:2] == '81':
+            com = f'8{self.address:X}' + com[2:]
+        # Unlike pyvisca's command(), let the serial errors through, so that the dispatcher can reconnect.
+        data = binascii.unhexlify(com)
+        self._output.write(data)
+        BYTES_WRITTEN.inc(self.serial_port, amount=len(data))
+
+    def reopen(self):
+        ''' Replace the serial port with a freshly opened one, even if closing the failed one does not work. '''
+        try:
+            self._output.close()
+        except Exception:
+            pass
+        self._output = open_port(self.serial_port)
+
+class CameraHandle(object):
+    '''
+    One camera of a daisy chain, with the same interface as its port's ViscaDispatcher
+    (send, pulse, call, inquire, and any visca.PTZ method), so it can be given to a CameraState.
+    '''
+
+    def __init__(self, dispatcher, address, port=''):
+        self.dispatcher = dispatcher
+        self.address = address
+        self.port = port
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def queued(*args):
+            self.send(None, name, *args)
+        return queued
+
+    def __str__(self):
+        if self.address == BROADCAST:
+            return f'all cameras on {self.port}'
+        return f'camera {self.address} on {self.port}'
+
+    def _key(self, key):
+        # The slots of different cameras on the same port must not coalesce with each other.
+        return None if key is None else (self.address, key)
+
+    def send(self, key, name, *args):
+        self.dispatcher.send(self._key(key), name, *args, address=self.address)
+
+    def pulse(self, key, start, stop, duration):
+        self.dispatcher.pulse(self._key(key), start, stop, duration, address=self.address)
+
+    def call(self, name, *args, timeout=None):
+        return self.dispatcher.call(name, *args, timeout=timeout)
+
+    def inquire(self, packet, timeout=None, reply_timeout=INQUIRY_TIMEOUT):
+        if self.address == BROADCAST:
+            raise RuntimeError('Inquiries cannot be broadcast')
+        return self.dispatcher.inquire(packet, timeout, address=self.address, reply_timeout=reply_timeout)
+
+class BroadcastHandle(object):
+    ''' Sends every command to the broadcast address of each port. '''
+
+    def __init__(self, handles):
+        self.handles = handles
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def queued(*args):
+            self.send(None, name, *args)
+        return queued
+
+    def __str__(self):
+        return 'all cameras'
+
+    def send(self, key, name, *args):
+        for handle in self.handles:
+            handle.send(key, name, *args)
+
+    def pulse(self, key, start, stop, duration):
+        for handle in self.handles:
+            handle.pulse(key, start, stop, duration)
+
+    def call(self, name, *args, timeout=None):
+        return [handle.call(name, *args, timeout=timeout) for handle in self.handles]
+
+    def inquire(self, packet, timeout=None, reply_timeout=INQUIRY_TIMEOUT):
+        raise RuntimeError('Inquiries cannot be broadcast')
+
+def _numbers(text, what):
+    ''' Parse single numbers and ranges separated by "," (e.g. "1-3,5") into a sorted list. '''
+    numbers = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        try:
+            numbers += range(int(first), int(last or first) + 1)
+        except ValueError:
+            raise ValueError(f'Invalid {what} "{part}"')
+    return sorted(set(numbers))
+
+def parse_cameras(spec):
+    '''
+    Parse a camera list such as "COM7", "/dev/ttyUSB0@1-3 /dev/ttyUSB1@1,2" or "udp://192.168.0.100 COM7".
+    Ports are separated by spaces or ";"; the addresses of the cameras on a port follow an "@"
+    (single addresses and ranges, separated by ","). A port without addresses has camera 1 only.
+    Returns a list of (port, [address, ...]) tuples.
+    '''
+    ports = []
+    for item in re.split(r'[;\s]+', spec.strip()):
+        if not item:
+            continue
+        port, _, addresses = item.partition('@')
+        numbers = _numbers(addresses or '1', f'camera address for port {port}')
+        for address in numbers:
+            if not 1 <= address <= 7:
+                raise ValueError(f'Camera address {address} of port {port} is not within 1 and 7')
+        ports.append((port, numbers))
+
+    if not ports:
+        raise ValueError('No serial port given')
+    return ports
+
+def parse_pads(spec, count):
+    '''
+    Parse the cameras of the gamepads, such as "0=1 1=2-3": joystick 0 drives camera 1,
+    joystick 1 cameras 2 and 3. The joysticks are given by their instance ID, and the cameras
+    are numbered from 1 in the order of the camera list ("count" cameras in all).
+    Returns a dict of {instance ID: [camera index, ...]} (the indexes counting from 0).
+    '''
+    pads = {}
+    for item in re.split(r'[;\s]+', spec.strip()):
+        if not item:
+            continue
+        pad, _, cameras = item.partition('=')
+        try:
+            pad = int(pad)
+        except ValueError:
+            raise ValueError(f'Invalid joystick "{pad}" in "{item}"')
+        numbers = _numbers(cameras, f'camera of joystick {pad}')
+        for number in numbers:
+            if not 1 <= number <= count:
+                raise ValueError(f'Joystick {pad} is bound to camera {number}, but there are {count} camera(s)')
+        pads[pad] = [number - 1 for number in numbers]
+    return pads
+
+class Operator(object):
+    '''
+    What one operator drives: a camera of its group (by default every camera of the rig),
+    or the whole group at once (broadcast mode).
+    "cam" and "state" are the CameraHandle and CameraState of the selected camera (or of the
+    group, in broadcast mode), "status" the StatusCache of the selected camera.
+    The operators driving the same camera share its CameraState, so their commands coalesce.
+    '''
+
+    def __init__(self, rig, indexes, broadcast_target, broadcast_state, name=None):
+        self.rig = rig
+        self.indexes = list(indexes)
+        self.broadcast_target = broadcast_target
+        self.broadcast_state = broadcast_state
+        self.name = name
+        # Position of the selected camera in the group
+        self.selected = 0
+        self.broadcast = False
+
+    @property
+    def cam(self):
+        return self.broadcast_target if self.broadcast else self.rig.targets[self.indexes[self.selected]]
+
+    @property
+    def state(self):
+        return self.broadcast_state if self.broadcast else self.rig.states[self.indexes[self.selected]]
+
+    @property
+    def status(self):
+        return self.rig.statuses[self.indexes[self.selected]]
+
+    def select(self, index, broadcast=False):
+        ''' Drive another camera of the group (or all of them), after stopping whatever the current one is doing. '''
+        index %= len(self.indexes)
+        if index == self.selected and broadcast == self.broadcast:
+            return False
+
+        self.state.stop_motion()
+        self.selected = index
+        self.broadcast = broadcast
+        if self.name is None:
+            log.info("Selected %s%s", self.cam, self._describe())
+        else:
+            log.info("%s: selected %s%s", self.name, self.cam, self._describe())
+        return True
+
+    def _describe(self):
+        ''' The recent status of the selected camera, from the cache, e.g. " (pan 120, tilt -40, zoom 4000)". '''
+        if self.broadcast:
+            return ''
+        status = self.status
+        position = status.get('pan_tilt', POSITION_MAX_AGE)
+        zoom = status.get('zoom', POSITION_MAX_AGE)
+        parts = []
+        if status.get('power', POSITION_MAX_AGE) == 0:
+            parts.append('standby')
+        if position is not None:
+            parts.append(f'pan {position[0]}, tilt {position[1]}')
+        if zoom is not None:
+            parts.append(f'zoom {zoom}')
+        return f' ({", ".join(parts)})' if parts else ''
+
+    def previous(self):
+        return self.select(self.selected - 1)
+
+    def next(self):
+        return self.select(self.selected + 1)
+
+    def toggle_broadcast(self):
+        return self.select(self.selected, not self.broadcast)
+
+    def power_on(self):
+        '''
+        Power the selected camera on (or each camera of the group, in broadcast mode) in the background.
+        The controls of a camera are held until it reports being on (see ptz_gamepad.power).
+        '''
+        indexes = self.indexes if self.broadcast else [self.indexes[self.selected]]
+        return any([self.rig.power_on(i) for i in indexes])
+
+    def recall_shot(self, name, speed=None):
+        ''' Send the selected camera (or all of the group) to a shot of the preset bank. '''
+        preset = self.rig.presets.recall(name, self.state, speed)
+        if preset is None:
+            log.warning("No shot named \"%s\"", name)
+            return False
+        log.info("Dispatched command: SHOT %s", name)
+        return True
+
+    def store_shot(self, name, speed=None):
+        '''
+        Store the current position of the selected camera as a shot of the preset bank.
+        The positions are inquired in the background, after the commands already queued.
+        '''
+        if self.broadcast:
+            log.warning("Select a single camera to store a shot")
+            return False
+        cam = self.cam
+        presets = self.rig.presets
+
+        def run():
+            try:
+                log.info("Stored %s", presets.store(name, *capture(cam, INQUIRY_TIMEOUT * 2), speed=speed))
+            except (TimeoutError, RuntimeError, OSError) as e:
+                log.error("Could not store the shot \"%s\": %s", name, e)
+
+        Thread(target=run, name='StoreShot', daemon=True).start()
+        return True
+
+    @property
+    def actions(self):
+        ''' The camera selection (and other) functions, by their action name in the button layouts (see ptz_gamepad.bindings). '''
+        return {
+            'previous_camera': self.previous,
+            'next_camera': self.next,
+            'broadcast': self.toggle_broadcast,
+            'power_on': self.power_on,
+            'recall_shot': self.recall_shot,
+            'store_shot': self.store_shot,
+            'toggle_tracing': log.toggle_tracing,
+        }
+
+class CameraRig(object):
+    '''
+    All the cameras the controller drives, and which one of them it is driving right now.
+    "cam", "state", "status" and "actions" are those of the rig's default Operator (see Operator),
+    which drives every camera. "pads" binds gamepads to cameras ("0=1 1=2-3", see parse_pads()):
+    each bound gamepad has its own Operator (see operator_for()); the others share the default one.
+    If poll is False, the status of the cameras is not inquired in the background.
+    "presets" is the PresetBank of the named shots (by default the one of the user's preset file).
+    If "listen" is a TCP port, the cameras are served there to the network clients while the rig is started.
+    '''
+
+    def __init__(self, spec, poll=True, presets=None, listen=None, pads=None):
+        self.dispatchers = []
+        self.targets = []
+        self.pollers = []
+        broadcasts = []
+        for port, addresses in parse_cameras(spec):
+            dispatcher = ViscaDispatcher(AddressedPTZ(port))
+            dispatcher.chain = len(addresses)
+            dispatcher.on_reconnect.append(lambda dispatcher=dispatcher: self._restore(dispatcher))
+            self.dispatchers.append(dispatcher)
+            self.targets += [CameraHandle(dispatcher, address, port) for address in addresses]
+            broadcasts.append(CameraHandle(dispatcher, BROADCAST, port))
+
+        self.states = [CameraState(target) for target in self.targets]
+        self.statuses = [StatusCache() for target in self.targets]
+        if poll:
+            for dispatcher in self.dispatchers:
+                caches = {target.address: status for target, status in zip(self.targets, self.statuses) if target.dispatcher is dispatcher}
+                self.pollers.append(StatusPoller(dispatcher, caches))
+        self.broadcast_target = broadcasts[0] if len(broadcasts) == 1 else BroadcastHandle(broadcasts)
+        self.broadcast_state = CameraState(self.broadcast_target)
+        self.operator = Operator(self, range(len(self.targets)), self.broadcast_target, self.broadcast_state)
+        self.operators = [self.operator]
+        self.pads = {}
+        for pad, indexes in parse_pads(pads or '', len(self.targets)).items():
+            # A group broadcasts to each of its cameras, since the broadcast address would reach the others.
+            target = BroadcastHandle([self.targets[i] for i in indexes])
+            operator = self.pads[pad] = Operator(self, indexes, target, CameraState(target), f'Joystick {pad}')
+            self.operators.append(operator)
+        self.presets = presets if presets is not None else PresetBank()
+        # The PowerSequencer of every camera being powered on, by camera index
+        self.sequencers = {}
+        self.listen = listen
+        self.server = None
+
+    def start(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.start()
+            if dispatcher.chain > 1:
+                # Let the cameras of the chain number themselves.
+                dispatcher.call('comm', ADDRESS_SET)
+        for poller in self.pollers:
+            poller.start()
+        if self.listen:
+            from ptz_gamepad.server import ControlServer
+            self.server = ControlServer(self, self.listen).start()
+        return self
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        for poller in self.pollers:
+            poller.stop()
+        for dispatcher in self.dispatchers:
+            dispatcher.close()
+
+    def power_on(self, index):
+        ''' Power the camera of index "index" on in the background, unless it is already being powered on. '''
+        sequencer = self.sequencers.get(index)
+        if sequencer is not None and sequencer.busy:
+            return False
+        log.info("Dispatched command: POWER ON (%s)", self.targets[index])
+        sequencer = self.sequencers[index] = PowerSequencer(self.targets[index], self.states[index], status=self.statuses[index])
+        sequencer.start()
+        return True
+
+    def operator_for(self, instance_id):
+        ''' The Operator of a joystick: its own if it is bound to cameras, else the default one. '''
+        return self.pads.get(instance_id, self.operator)
+
+    @property
+    def cam(self):
+        return self.operator.cam
+
+    @property
+    def state(self):
+        return self.operator.state
+
+    @property
+    def status(self):
+        return self.operator.status
+
+    @property
+    def selected(self):
+        return self.operator.selected
+
+    @property
+    def broadcast(self):
+        return self.operator.broadcast
+
+    @property
+    def actions(self):
+        return self.operator.actions
+
+    def select(self, index, broadcast=False):
+        return self.operator.select(index, broadcast)
+
+    def _restore(self, dispatcher):
+        ''' Send the desired motion of the cameras of a port again, once it has been reopened. '''
+        if dispatcher.chain > 1:
+            # Queued without waiting: this runs on the dispatcher's own thread.
+            dispatcher.send(None, 'comm', ADDRESS_SET)
+        for target, state in zip(self.targets, self.states):
+            if target.dispatcher is dispatcher:
+                state.resend()
+        for operator in self.operators:
+            if operator.broadcast:
+                operator.broadcast_state.resend()
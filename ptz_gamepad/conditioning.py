@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#
+# Stick conditioning: deadzones, response curves and filtering
+# Licensed under GPL-3.0
+# ---
+# A stick used to count as at rest only when it read exactly its rest value (0.000 or 0.004,
+# once rounded to 3 decimals), so a worn or drifting stick kept the camera crawling, and every
+# flicker of the last digit dispatched a movement and then a stop. Instead, every stick goes
+# through a conditioning stage, once per input change:
+#   1. the rest value of the layout (the center of the stick) is subtracted;
+#   2. deadzone: radial for a two-axis stick (on the length of the (x, y) vector, so that the
+#      diagonals are not cut off), or axial (per axis). Within it the stick is at rest and reads
+#      exactly 0.0; beyond it the deflection is rescaled to start from 0 at its edge, and it
+#      counts as full from the "saturation" deflection on. Along a radial stick, an axis within
+#      the deadzone reads 0.0 too, so that pushing the stick sideways does not also tilt;
+#   3. filter (optional): a low-pass filter, or a 1€ filter, which smooths the jitter of a slow
+#      stick while following a fast one with little lag;
+#   4. response curve: an exponent (|v| ** exponent, finer control around the center) or a
+#      custom curve (points [input, output] joined by straight lines);
+#   5. quantization onto steps of "resolution" (0.001, like the former rounding).
+# A StickConditioner tells whether its conditioned position has moved, so an input change that
+# conditions to the same position (jitter within the deadzone or below the resolution) stops there.
+# A stick held still generates no events, yet its filtered value still lags behind it: while a
+# filter has not caught up ("settling"), the control loop wakes up every SETTLE_INTERVAL to run the
+# conditioning again on the same raw values, and a filter within "resolution" of the stick snaps onto it.
+# A stick coming back within the deadzone is at rest at once, whatever the filter.
+# -> SOURCE: Casiez, Roussel, Vogel, "1€ Filter: A Simple Speed-based Low-pass Filter for Noisy Input in Interactive Systems" (CHI 2012)
+
+from bisect import bisect_right
+import math
+import time
+
+# Defaults of the "sticks" section of the layouts (see ptz_gamepad/bindings.py)
+DEADZONE = 0.1
+SATURATION = 1.0
+RESOLUTION = 0.001
+
+# How often (in second) the filters of a stick held still are run again, until they catch up with it
+SETTLE_INTERVAL = 0.02
+
+def axial_deadzone(value, deadzone, saturation=SATURATION):
+    ''' The deflection of a single axis, 0.0 within the deadzone and rescaled beyond it (within -1 and 1). '''
+    magnitude = abs(value)
+    if magnitude <= deadzone:
+        return 0.0
+    return math.copysign(min(1.0, (magnitude - deadzone) / (saturation - deadzone)), value)
+
+def radial_deadzone(x, y, deadzone, saturation=SATURATION):
+    ''' The deflection of a two-axis stick, (0.0, 0.0) within the deadzone and rescaled beyond it, keeping its direction. '''
+    magnitude = math.hypot(x, y)
+    if magnitude <= deadzone:
+        return (0.0, 0.0)
+    scale = min(1.0, (magnitude - deadzone) / (saturation - deadzone)) / magnitude
+    return (max(-1.0, min(1.0, x * scale)), max(-1.0, min(1.0, y * scale)))
+
+class Curve(object):
+    '''
+    Response curve of the deflection, applied to its absolute value (0 to 1).
+    "spec" is an exponent (1.0 is linear, 2.0 gives a finer control around the center),
+    or a list of [input, output] points joined by straight lines, from (0, 0) to (1, 1) unless given.
+    '''
+
+    def __init__(self, spec=1.0):
+        if isinstance(spec, (int, float)):
+            if spec <= 0:
+                raise ValueError(f'The exponent of a curve should be positive, not {spec}')
+            self.exponent = float(spec)
+            self.inputs = self.outputs = None
+            return
+        try:
+            points = sorted((float(a), float(b)) for a, b in spec)
+        except (TypeError, ValueError):
+            raise ValueError(f'Invalid curve {spec!r}: expected an exponent or a list of [input, output] points')
+        if not points or points[0][0] < 0 or points[-1][0] > 1:
+            raise ValueError(f'Invalid curve {spec!r}: the inputs of the points should be within 0 and 1')
+        if points[0][0] > 0:
+            points.insert(0, (0.0, 0.0))
+        if points[-1][0] < 1:
+            points.append((1.0, 1.0))
+        self.exponent = None
+        self.inputs = [a for a, b in points]
+        self.outputs = [b for a, b in points]
+
+    def __call__(self, value):
+        magnitude = abs(value)
+        if self.exponent is not None:
+            return math.copysign(magnitude ** self.exponent, value)
+        inputs = self.inputs
+        i = min(max(1, bisect_right(inputs, magnitude)), len(inputs) - 1)
+        span = inputs[i] - inputs[i - 1]
+        ratio = (magnitude - inputs[i - 1]) / span if span else 1.0
+        return math.copysign(self.outputs[i - 1] + ratio * (self.outputs[i] - self.outputs[i - 1]), value)
+
+def _alpha(cutoff, elapsed):
+    ''' Smoothing factor of an exponential low-pass filter of cutoff frequency "cutoff" (in Hz), after "elapsed" seconds. '''
+    if elapsed <= 0:
+        return 1.0
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / elapsed)
+
+class LowPassFilter(object):
+    ''' Exponential low-pass filter of one axis, of cutoff frequency "cutoff" (in Hz). '''
+
+    def __init__(self, cutoff=5.0):
+        if cutoff <= 0:
+            raise ValueError(f'The cutoff frequency should be positive, not {cutoff}')
+        self.cutoff = cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.stamp = None
+
+    def __call__(self, value, now):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += _alpha(self.cutoff, now - self.stamp) * (value - self.value)
+        self.stamp = now
+        return self.value
+
+class OneEuroFilter(object):
+    '''
+    1€ filter of one axis: a low-pass filter whose cutoff frequency rises with the speed of the stick.
+    "min_cutoff" (in Hz) sets the smoothing of a slow stick, "beta" how fast the lag drops as the stick speeds up,
+    and "d_cutoff" (in Hz) the smoothing of the speed estimate itself.
+    '''
+
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        if min_cutoff <= 0 or d_cutoff <= 0 or beta < 0:
+            raise ValueError('The cutoff frequencies of a 1€ filter should be positive, and its beta not negative')
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.speed = 0.0
+        self.stamp = None
+
+    def __call__(self, value, now):
+        if self.value is None:
+            self.value = value
+            self.speed = 0.0
+        else:
+            elapsed = now - self.stamp
+            if elapsed > 0:
+                self.speed += _alpha(self.d_cutoff, elapsed) * ((value - self.value) / elapsed - self.speed)
+            self.value += _alpha(self.min_cutoff + self.beta * abs(self.speed), elapsed) * (value - self.value)
+        self.stamp = now
+        return self.value
+
+FILTERS = {
+    'lowpass': LowPassFilter,
+    'one_euro': OneEuroFilter,
+}
+
+def parse_filter(spec):
+    '''
+    Turn the "filter" of a layout ({"type": "one_euro", "min_cutoff": 1.0, "beta": 0.5},
+    {"type": "lowpass", "cutoff": 5.0}, or null) into a function making a filter per axis, or None.
+    '''
+    if spec is None:
+        return None
+    if not isinstance(spec, dict) or spec.get('type') not in FILTERS:
+        raise ValueError(f'Invalid filter {spec!r}: expected {{"type": one of {", ".join(FILTERS)}, ...}}')
+    kind = FILTERS[spec['type']]
+    params = {key: value for key, value in spec.items() if key != 'type'}
+    try:
+        kind(**params)
+    except TypeError as e:
+        raise ValueError(f'Invalid {spec["type"]} filter: {e}')
+    return lambda: kind(**params)
+
+class StickConditioner(object):
+    '''
+    Conditions the axes of one stick: the two axes of a stick share a radial deadzone (unless "radial"
+    is False), a single axis (e.g. a zoom stick) has an axial one. Every joystick needs conditioners
+    of its own, since the filters remember the past positions.
+    "values" is the conditioned position, within -1 and 1 and 0.0 at rest; update() tells whether it has moved.
+    '''
+
+    def __init__(self, axes=2, center=0.0, deadzone=DEADZONE, saturation=SATURATION, radial=True,
+                 curve=None, filter=None, resolution=RESOLUTION):
+        if not 0 <= deadzone < saturation:
+            raise ValueError(f'The deadzone ({deadzone}) should be within 0 and the saturation ({saturation})')
+        if resolution <= 0:
+            raise ValueError(f'The resolution should be positive, not {resolution}')
+        self.center = center
+        self.deadzone = deadzone
+        self.saturation = saturation
+        self.radial = radial and axes == 2
+        self.curve = curve
+        self.filters = [filter() for i in range(axes)] if filter is not None else None
+        self.resolution = resolution
+        self.values = (0.0,) * axes
+        # The positions the filters are heading for (after the deadzone)
+        self.targets = (0.0,) * axes
+
+    def condition(self, raw, now):
+        ''' The conditioned position of the raw axis values "raw". '''
+        if self.radial:
+            x, y = raw[0] - self.center, raw[1] - self.center
+            values = radial_deadzone(x, y, self.deadzone, self.saturation)
+            # The drift of the other axis does not count either while the stick is pushed along one axis.
+            values = [0.0 if abs(value) <= self.deadzone else out for value, out in zip((x, y), values)]
+        else:
+            values = [axial_deadzone(value - self.center, self.deadzone, self.saturation) for value in raw]
+        self.targets = tuple(values)
+
+        conditioned = []
+        for i, value in enumerate(values):
+            if self.filters is not None:
+                # An axis at rest stops at once, and starts its next movement afresh.
+                if value == 0.0:
+                    self.filters[i].reset()
+                else:
+                    filtered = self.filters[i](value, now)
+                    # Close enough: the filter has caught up with the stick.
+                    if abs(filtered - value) < self.resolution:
+                        self.filters[i].value = filtered = value
+                    value = filtered
+            if self.curve is not None:
+                value = self.curve(value)
+            # The second rounding drops the binary noise of the product (0.6950000000000001), "+ 0.0" turns -0.0 into 0.0.
+            conditioned.append(round(round(value / self.resolution) * self.resolution, 9) + 0.0)
+        return tuple(conditioned)
+
+    def update(self, *raw, now=None):
+        ''' Condition the new raw values of the axes. Returns True if the conditioned position has moved. '''
+        values = self.condition(raw, time.monotonic() if now is None else now)
+        if values == self.values:
+            return False
+        self.values = values
+        return True
+
+    @property
+    def settling(self):
+        ''' True while a filter lags behind the stick, so that update() should be called again even without input. '''
+        if self.filters is None:
+            return False
+        return any(f.value is not None and f.value != target for f, target in zip(self.filters, self.targets))
+
+    def reset(self):
+        ''' Back to rest (e.g. when the joystick is disconnected). '''
+        self.values = (0.0,) * len(self.values)
+        self.targets = (0.0,) * len(self.targets)
+        for f in self.filters or ():
+            f.reset()
+
+def settling(sticks):
+    ''' True if any of the StickConditioners "sticks" (e.g. those of a joystick) is settling. '''
+    return any(stick.settling for stick in sticks)
+
+def parse_conditioning(section):
+    '''
+    Read the conditioning settings of the "sticks" section of a layout
+    ("deadzone", "saturation", "radial", "curve", "filter" and "resolution").
+    Returns the keyword arguments of StickConditioner.
+    '''
+    curve = section.get('curve')
+    conditioning = {
+        'deadzone': float(section.get('deadzone', DEADZONE)),
+        'saturation': float(section.get('saturation', SATURATION)),
+        'radial': bool(section.get('radial', True)),
+        'curve': None if curve is None or curve == 1 else Curve(curve),
+        'filter': parse_filter(section.get('filter')),
+        'resolution': float(section.get('resolution', RESOLUTION)),
+    }
+    # Check the settings now rather than when a joystick gets connected.
+    StickConditioner(**conditioning)
+    return conditioning
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#
+# Serial port auto-discovery
+# Licensed under GPL-3.0
+# ---
+# Instead of typing the serial port in, the serial ports of the machine are probed for
+# VISCA cameras. Every port is probed by its own thread, so that the silent ports all
+# time out together: discovering any number of ports takes about one probe timeout.
+# A probe numbers the cameras of the chain (Address Set, 88 30 01 FF, answered with
+# 88 30 0w FF by the last camera, w - 1 being the number of cameras) and asks each of
+# them for its version (CAM_VersionInq, 8x 09 00 02 FF).
+#
+# Usage:
+#   python -m ptz_gamepad.discovery [--timeout 0.5] [PORT ...]
+
+from ptz_gamepad.cameras import ADDRESS_SET
+from ptz_gamepad.packets import VENDORS
+from ptz_gamepad.packets import VERSION_INQ
+from ptz_gamepad.packets import version_info
+from threading import Thread
+import argparse
+import binascii
+import serial
+import time
+
+# How long a port gets to answer (in second)
+PROBE_TIMEOUT = 0.5
+
+class FoundCamera(object):
+    ''' A camera that has answered the version inquiry. '''
+    __slots__ = ('port', 'address', 'vendor', 'model', 'rom')
+
+    def __init__(self, port, address, vendor, model, rom):
+        self.port = port
+        self.address = address
+        self.vendor = vendor
+        self.model = model
+        self.rom = rom
+
+    def __str__(self):
+        vendor = VENDORS.get(self.vendor, f'vendor {self.vendor:04X}')
+        return f'{self.port}@{self.address}: {vendor} model {self.model:04X} (ROM {self.rom:04X})'
+
+def candidate_ports():
+    ''' The serial ports of the machine, e.g. ['COM3', 'COM7'] or ['/dev/ttyUSB0']. '''
+    from serial.tools.list_ports import comports
+    return sorted(port.device for port in comports())
+
+def _read_packets(port, deadline, done):
+    '''
+    Read packets (bytes ending with FF) from an open serial port until "done(packets)"
+    returns True or the deadline has passed. Returns the packets read.
+    '''
+    packets = []
+    buffer = bytearray()
+    while not done(packets):
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        port.timeout = left
+        data = port.read(max(1, port.in_waiting))
+        buffer += data
+        while 0xFF in buffer:
+            end = buffer.index(0xFF) + 1
+            packets.append(bytes(buffer[:end]))
+            del buffer[:end]
+    return packets
+
+def _answer(packets, address):
+    ''' The decoded version answer of the camera at "address" among the packets, or None. '''
+    for packet in packets:
+        if packet[0] == (8 + address) << 4:
+            info = version_info(packet)
+            if info is not None:
+                return info
+    return None
+
+def probe(name, timeout=PROBE_TIMEOUT, baudrate=9600):
+    '''
+    Look for VISCA cameras on a serial port.
+    Returns the list of FoundCamera objects (empty if nothing answers, or the port cannot be opened).
+    '''
+    try:
+        port = serial.Serial(name, baudrate, timeout=timeout, write_timeout=timeout)
+    except (OSError, ValueError):
+        return []
+
+    found = []
+    try:
+        port.reset_input_buffer()
+        # Number the chain and ask camera 1 at once, so that a silent port costs a single timeout.
+        port.write(binascii.unhexlify(ADDRESS_SET) + binascii.unhexlify(VERSION_INQ))
+        chain = [0]
+
+        def done(packets):
+            for packet in packets:
+                if packet[:2] == b'\x88\x30' and len(packet) == 4:
+                    chain[0] = packet[2] - 1
+            return chain[0] and _answer(packets, 1) is not None
+
+        packets = _read_packets(port, time.monotonic() + timeout, done)
+        info = _answer(packets, 1)
+        if info is not None:
+            found.append(FoundCamera(name, 1, *info[:3]))
+
+        # The other cameras of the chain (if any) answer quickly, now that the port is known to be alive.
+        for address in range(2, min(chain[0], 7) + 1):
+            port.write(binascii.unhexlify(f'8{address:X}' + VERSION_INQ[2:]))
+            packets = _read_packets(port, time.monotonic() + timeout, lambda packets: _answer(packets, address) is not None)
+            info = _answer(packets, address)
+            if info is not None:
+                found.append(FoundCamera(name, address, *info[:3]))
+    except (OSError, serial.SerialException):
+        pass
+    finally:
+        port.close()
+    return found
+
+def discover(ports=None, timeout=PROBE_TIMEOUT, baudrate=9600):
+    '''
+    Probe the serial ports (by default every port of the machine) at the same time.
+    Returns the list of FoundCamera objects, by port and address.
+    '''
+    ports = candidate_ports() if ports is None else list(ports)
+    results = {}
+
+    def run(name):
+        results[name] = probe(name, timeout, baudrate)
+
+    threads = [Thread(target=run, args=(name,), name=f'Probe {name}', daemon=True) for name in ports]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        # A port whose driver hangs is left behind.
+        thread.join(timeout * 8 + 1)
+
+    return [camera for name in ports for camera in results.get(name, [])]
+
+def camera_spec(cameras):
+    ''' Camera list for CameraRig (e.g. "COM7@1,2,3 COM8@1") of the cameras found. '''
+    ports = {}
+    for camera in cameras:
+        ports.setdefault(camera.port, []).append(str(camera.address))
+    return ' '.join(f'{port}@{",".join(addresses)}' for port, addresses in ports.items())
+
+def main():
+    parser = argparse.ArgumentParser(description='Look for VISCA cameras on the serial ports.')
+    parser.add_argument('ports', nargs='*', help='Serial ports to probe (default: every serial port of the machine)')
+    parser.add_argument('--timeout', type=float, default=PROBE_TIMEOUT, help=f'Probe timeout, in second (default: {PROBE_TIMEOUT})')
+    parser.add_argument('--baud', type=int, default=9600, help='Serial speed (default: 9600)')
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    cameras = discover(args.ports or None, args.timeout, args.baud)
+    elapsed = time.monotonic() - start
+
+    for camera in cameras:
+        print(camera)
+    print(f'{len(cameras)} camera(s) found in {elapsed:.2f} s')
+    if cameras:
+        print(f'Camera list: {camera_spec(cameras)}')
+
+if __name__ == '__main__':
+    main()
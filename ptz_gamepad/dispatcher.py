@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+#
+# Asynchronous VISCA command dispatcher
+# Licensed under GPL-3.0
+# ---
+# Every serial write to the PTZ camera happens on the dispatcher's own thread,
+# so the gamepad loop never stalls on the serial port nor on the stop delays.
+# Commands queued under the same key (e.g. 'pan_tilt', 'zoom') collapse into the newest one,
+# which keeps a fast stick sweep from building a backlog on a 9600 baud link.
+# ---
+# The camera only has two command buffers (sockets). The dispatcher follows the
+# ACK/Completion replies and holds back the next command until the camera can take it,
+# instead of firing blindly and having it dropped with a "command buffer full" error.
+# Several cameras may share the port (a VISCA daisy chain): every command carries the
+# address of its camera, and the sockets of each camera are followed separately.
+# ---
+# When the serial port fails (e.g. a USB-serial adapter glitch), only the port is reopened,
+# retrying with an exponential backoff, and the on_reconnect callbacks send the desired
+# state again. The controller keeps reading the gamepad all along.
+# ---
+# Low-priority inquiries (see poll()) wait in a queue of their own, and only go out
+# once the port has been quiet for IDLE_GAP: they fill the gaps between the commands
+# instead of holding a stick command back behind an inquiry's answer.
+
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import Future
+from itertools import count
+from ptz_gamepad import log
+from ptz_gamepad import metrics
+from ptz_gamepad.replies import ACK
+from ptz_gamepad.replies import ANSWER
+from ptz_gamepad.replies import COMPLETION
+from ptz_gamepad.replies import ERROR
+from ptz_gamepad.replies import ERROR_BUFFER_FULL
+from ptz_gamepad.replies import ReplyReader
+from ptz_gamepad.replies import parse_reply
+from threading import Condition
+from threading import Thread
+import time
+
+# Number of command buffers (sockets) of a VISCA camera
+SOCKETS = 2
+
+# Some VISCA clones never reply at all. If nothing comes back in time,
+# assume the command has gone through and carry on.
+ACK_TIMEOUT = 0.2
+COMPLETION_TIMEOUT = 10.0
+INQUIRY_TIMEOUT = 1.0
+
+# How many times a command is sent again after a "command buffer full" error
+BUFFER_FULL_RETRIES = 3
+
+# Camera address of the broadcast packets (88 ...), executed by every camera of the chain
+BROADCAST = 8
+
+# How long the port has to be quiet (no command queued) before a low-priority inquiry is sent
+IDLE_GAP = 0.05
+
+# Delays between the attempts to reopen a failed serial port (in second), doubling up to the maximum
+RECONNECT_DELAY = 0.1
+RECONNECT_DELAY_MAX = 5.0
+
+COMMANDS_SENT = metrics.counter('ptz_commands_sent_total', 'VISCA packets written, by kind and by control slot (or method name)', ('port', 'kind', 'command'))
+COMMANDS_COALESCED = metrics.counter('ptz_commands_coalesced_total', 'Pending commands replaced by a newer one for the same control before being sent', ('port',))
+COMMANDS_DROPPED = metrics.counter('ptz_commands_dropped_total', 'Commands given up on', ('port', 'reason'))
+COMMANDS_RETRIED = metrics.counter('ptz_commands_retried_total', 'Commands sent again after a "command buffer full" error', ('port',))
+REPLY_ERRORS = metrics.counter('ptz_reply_errors_total', 'VISCA error replies, by error code', ('port', 'code'))
+REPLY_TIMEOUTS = metrics.counter('ptz_reply_timeouts_total', 'Replies that did not come in time', ('port', 'kind'))
+REPLY_TIME = metrics.histogram('ptz_reply_seconds', 'Time from writing a packet to its ACK (commands) or answer (inquiries)', ('port', 'kind'))
+QUEUE_DEPTH = metrics.gauge('ptz_dispatcher_queue_depth', 'Commands waiting to be sent', ('port',))
+RECONNECTS = metrics.counter('ptz_serial_reconnects_total', 'Times the serial port has been reopened after a failure', ('port',))
+
+# Kinds of queued entries
+COMMAND = 'command'  # 8x 01 ... FF, answered by ACK and Completion
+INQUIRY = 'inquiry'  # 8x 09 ... FF, answered by y0 50 ... FF
+LOCAL = 'local'      # Not sent to the camera (e.g. reset_port), no reply expected
+
+# Returned by _next() when the serial port has to be reopened
+_RECONNECT = object()
+
+class _Entry(object):
+    __slots__ = ('key', 'due', 'kind', 'name', 'args', 'address', 'follow', 'future', 'sent', 'tries', 'replies', 'wait')
+
+    def __init__(self, key, due, kind, name, args, address=1, follow=None, future=None):
+        self.key = key
+        self.due = due
+        self.kind = kind
+        self.name = name
+        self.args = args
+        self.address = address
+        self.follow = follow
+        self.future = future
+        self.sent = None
+        self.tries = 0
+        self.replies = 0
+        # How long to wait for the reply once sent
+        self.wait = INQUIRY_TIMEOUT if kind == INQUIRY else ACK_TIMEOUT
+
+def _command_label(entry):
+    ''' The control slot of an entry (e.g. 'pan_tilt', 'zoom'), or its method name when it has none. '''
+    key = entry.key
+    # CameraHandle prefixes the keys with the camera address.
+    if isinstance(key, tuple) and len(key) == 2 and key[0] != '_':
+        key = key[1]
+    if isinstance(key, tuple) and key and isinstance(key[0], str) and key[0] != '_':
+        # A command slot of a button binding, e.g. ('preset_recall', 4)
+        return key[0]
+    return key if isinstance(key, str) else entry.name
+
+class ViscaDispatcher(object):
+    '''
+    Wraps a visca.PTZ object and sends its commands from a background thread.
+    Any PTZ method can be called on the dispatcher directly (e.g. cam.preset_recall(4));
+    such calls are queued in order and never coalesced. Use send() and pulse() for
+    continuous movement commands that should be coalesced per axis.
+    If replies is False, the camera's replies are not read and commands are sent
+    as soon as they are queued.
+    With a daisy chain, "cam" must be an AddressedPTZ (see ptz_gamepad.cameras), and the "chain"
+    attribute must be set to the number of cameras on the port after construction (it is 1 by default).
+    Reconnecting also needs the reopen() method of an AddressedPTZ.
+    '''
+
+    def __init__(self, cam, replies=True):
+        self.cam = cam
+        # Label of the port in the metrics
+        self.port = getattr(cam, 'serial_port', '')
+
+        # Pending entries, in order of arrival: key -> _Entry
+        self._pending = OrderedDict()
+        self._cond = Condition()
+        self._seq = count()
+        self._running = False
+        self._thread = Thread(target=self._run, name='ViscaDispatcher', daemon=True)
+
+        # Flow control: the entry waiting for its ACK (or inquiry answer),
+        # and the commands being executed in the camera's sockets.
+        self._awaiting = None
+        self._sockets = {}  # (camera address, socket) -> _Entry
+        self.chain = 1
+        self._reader = ReplyReader(cam, self._on_reply, self._fail) if replies else None
+
+        # Low-priority inquiries, sent in the idle gaps between the commands
+        self._idle = deque()
+        self._last_put = 0.0
+
+        # Serial port failure handling: callbacks run (on the dispatcher thread) after the port has been reopened.
+        self._broken = False
+        self._delay = RECONNECT_DELAY
+        self.reconnects = 0
+        self.on_reconnect = []
+
+    def __getattr__(self, name):
+        # Only called for attributes the dispatcher itself does not have,
+        # i.e. the visca.PTZ command methods.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        def queued(*args):
+            self.send(None, name, *args)
+        return queued
+
+    def start(self):
+        self._running = True
+        if self._reader is not None:
+            self._reader.start()
+        self._thread.start()
+        return self
+
+    def close(self):
+        ''' Stop the worker thread once the already-queued commands have been sent, then close the serial port. '''
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+        if self._reader is not None:
+            self._reader.stop()
+        self._abandon(ConnectionError('The dispatcher is closed'))
+        try:
+            self.cam.close()
+        except OSError:
+            # The port has failed and could not be reopened.
+            pass
+
+    def send(self, key, name, *args, address=1):
+        '''
+        Queue cam.<name>(*args), for the camera at "address".
+        A pending command with the same key is replaced by this one (latest wins).
+        If key is None, the command is always sent on its own.
+        '''
+        self._put(_Entry(key, time.monotonic(), COMMAND, name, args, address))
+
+    def pulse(self, key, start, stop, duration, address=1):
+        '''
+        Queue a movement pulse: send the start command, then the stop command after "duration" second.
+        Both are tuples of (name, *args), e.g. pulse('pan', ('left', 3), ('stop',), 0.05).
+        A newer command for the same key cancels the pending stop, so continuous
+        stick movement is not interrupted by a stop between every pulse.
+        '''
+        self._put(_Entry(key, time.monotonic(), COMMAND, start[0], start[1:], address, follow=(duration, stop[0], stop[1:])))
+
+    def call(self, name, *args, timeout=None):
+        '''
+        Run cam.<name>(*args) on the dispatcher thread, in order with the queued commands,
+        and wait for its return value. Meant for methods that do not talk to the camera,
+        such as reset_port(); use inquire() for inquiries.
+        '''
+        future = Future()
+        self._put(_Entry(None, time.monotonic(), LOCAL, name, args, future=future))
+        return future.result(timeout)
+
+    def inquire(self, packet, timeout=None, address=1, reply_timeout=INQUIRY_TIMEOUT):
+        '''
+        Send an inquiry packet (hexadecimal string, e.g. '81090400FF') to the camera at "address",
+        in order with the queued commands, and wait for the camera's answer. Returns the answer packet as bytes.
+        Raises TimeoutError if the camera does not answer within "reply_timeout" once sent,
+        or if "timeout" (in second) passes before that. The port is held for the camera's answer,
+        so polling a camera that may not answer (e.g. while it boots) should use a short reply_timeout.
+        '''
+        future = Future()
+        entry = _Entry(None, time.monotonic(), INQUIRY, 'comm', (packet,), address, future=future)
+        entry.wait = reply_timeout
+        self._put(entry)
+        return future.result(timeout)
+
+    def poll(self, packet, address=1, reply_timeout=INQUIRY_TIMEOUT):
+        '''
+        Queue a low-priority inquiry (see inquire()), only sent once no command is pending
+        and none has been queued for IDLE_GAP. Returns a concurrent.futures.Future of the answer packet.
+        The future fails with ConnectionError if the dispatcher is closed or the port fails first.
+        '''
+        future = Future()
+        if self._reader is None:
+            future.set_exception(RuntimeError('The replies of the camera are not read'))
+            return future
+        entry = _Entry(None, time.monotonic(), INQUIRY, 'comm', (packet,), address, future=future)
+        entry.wait = reply_timeout
+        with self._cond:
+            if not self._running:
+                future.set_exception(ConnectionError('The dispatcher is not running'))
+                return future
+            self._idle.append(entry)
+            self._cond.notify()
+        return future
+
+    def _abandon(self, error):
+        ''' Fail the futures of the inquiries that will not be answered anymore. '''
+        with self._cond:
+            entries = list(self._idle)
+            self._idle.clear()
+            if self._awaiting is not None and self._awaiting.kind == INQUIRY:
+                entries.append(self._awaiting)
+                self._awaiting = None
+        for entry in entries:
+            if not entry.future.done():
+                entry.future.set_exception(error)
+
+    def _put(self, entry):
+        with self._cond:
+            self._last_put = entry.due
+            if entry.key is None:
+                entry.key = ('_', next(self._seq))
+            else:
+                # Latest wins: drop whatever is still waiting for this axis.
+                if self._pending.pop(entry.key, None) is not None:
+                    COMMANDS_COALESCED.inc(self.port)
+            self._pending[entry.key] = entry
+            QUEUE_DEPTH.set(len(self._pending), self.port)
+            self._cond.notify()
+
+    def _expire(self, now):
+        '''
+        Give up on replies that are overdue. Must be called with the lock held.
+        Returns the time until the next reply deadline, or None.
+        '''
+        timeout = None
+
+        entry = self._awaiting
+        if entry is not None:
+            deadline = entry.sent + entry.wait
+            if now >= deadline:
+                self._awaiting = None
+                REPLY_TIMEOUTS.inc(self.port, entry.kind)
+                if entry.future is not None and not entry.future.done():
+                    entry.future.set_exception(TimeoutError(f'No reply to "{entry.args[0]}"'))
+            else:
+                timeout = deadline - now
+
+        for socket, entry in list(self._sockets.items()):
+            deadline = entry.sent + COMPLETION_TIMEOUT
+            if now >= deadline:
+                del self._sockets[socket]
+                REPLY_TIMEOUTS.inc(self.port, 'completion')
+            elif timeout is None or deadline - now < timeout:
+                timeout = deadline - now
+
+        return timeout
+
+    def _next(self):
+        ''' Wait for the next command that is due and that the camera can take. Returns None when closing. '''
+        with self._cond:
+            while True:
+                if self._broken:
+                    return _RECONNECT if self._running else None
+                if not self._pending and not self._running:
+                    return None
+
+                now = time.monotonic()
+                timeout = self._expire(now)
+                if self._awaiting is None:
+                    for key, entry in self._pending.items():
+                        if entry.due > now:
+                            wait = entry.due - now
+                            timeout = wait if timeout is None or wait < timeout else timeout
+                            continue
+
+                        # Both command buffers are busy: keep the order and wait for a Completion.
+                        if entry.kind == COMMAND and self._busy(entry.address):
+                            break
+
+                        del self._pending[key]
+                        QUEUE_DEPTH.set(len(self._pending), self.port)
+
+                        # Schedule the stop command of a pulse under the same key.
+                        if entry.follow is not None:
+                            duration, name, args = entry.follow
+                            self._pending[key] = _Entry(key, now + duration, COMMAND, name, args, entry.address)
+
+                        if self._reader is not None and entry.kind != LOCAL:
+                            entry.sent = now
+                            self._awaiting = entry
+                        return entry
+
+                    # The port is idle: send a low-priority inquiry.
+                    if self._idle and not self._pending and self._running:
+                        wait = self._last_put + IDLE_GAP - now
+                        if wait <= 0:
+                            entry = self._idle.popleft()
+                            entry.sent = now
+                            self._awaiting = entry
+                            return entry
+                        timeout = wait if timeout is None or wait < timeout else timeout
+
+                # When closing, the pending stop commands are still sent once they are due.
+                self._cond.wait(timeout)
+
+    def _busy(self, address):
+        ''' Whether the camera at "address" (any camera, for a broadcast) has no free socket. Must be called with the lock held. '''
+        used = {}
+        for camera, _ in self._sockets:
+            used[camera] = used.get(camera, 0) + 1
+        if address == BROADCAST:
+            return any(n >= SOCKETS for n in used.values())
+        return used.get(address, 0) >= SOCKETS
+
+    def _matches(self, entry, address):
+        return entry is not None and (entry.address == address or entry.address == BROADCAST)
+
+    def _on_reply(self, packet):
+        ''' Called by the reply reader for every packet coming from the camera(s). '''
+        reply = parse_reply(packet)
+        if reply is None:
+            return
+        kind, socket, payload = reply
+        # Replies start with y0, y = 8 + the address of the camera sending it.
+        address = (packet[0] >> 4) - 8
+
+        with self._cond:
+            awaiting = self._awaiting if self._matches(self._awaiting, address) else None
+
+            # A broadcast is done once every camera of the chain has replied to it.
+            if awaiting is not None and awaiting.address == BROADCAST and kind != ANSWER:
+                awaiting.replies += 1
+                if awaiting.replies < self.chain:
+                    if kind == ACK:
+                        self._sockets[(address, socket)] = awaiting
+                    self._cond.notify()
+                    return
+
+            if kind == ACK:
+                if awaiting is not None and awaiting.kind == COMMAND:
+                    self._sockets[(address, socket)] = awaiting
+                    self._awaiting = None
+                    REPLY_TIME.observe(time.monotonic() - awaiting.sent, self.port, COMMAND)
+
+            elif kind == COMPLETION:
+                if self._sockets.pop((address, socket), None) is None and awaiting is not None and awaiting.kind == COMMAND:
+                    # Completed without an ACK first (e.g. commands that need no socket).
+                    self._awaiting = None
+
+            elif kind == ANSWER:
+                if awaiting is not None and awaiting.kind == INQUIRY:
+                    self._awaiting = None
+                    REPLY_TIME.observe(time.monotonic() - awaiting.sent, self.port, INQUIRY)
+                    if not awaiting.future.done():
+                        awaiting.future.set_result(packet)
+
+            elif kind == ERROR:
+                payload = payload or 0
+                REPLY_ERRORS.inc(self.port, f'{payload:#04x}')
+                if awaiting is not None:
+                    entry = awaiting
+                    self._awaiting = None
+                else:
+                    entry = self._sockets.pop((address, socket), None)
+
+                if entry is not None and entry.kind == INQUIRY:
+                    if not entry.future.done():
+                        entry.future.set_exception(RuntimeError(f'VISCA error {payload:#04x} for "{entry.args[0]}"'))
+                elif entry is not None and payload == ERROR_BUFFER_FULL and entry.tries < BUFFER_FULL_RETRIES and entry.address != BROADCAST:
+                    # Send it again as soon as a socket is free, unless a newer command has replaced it.
+                    if entry.key not in self._pending:
+                        entry.tries += 1
+                        COMMANDS_RETRIED.inc(self.port)
+                        self._pending[entry.key] = entry
+                        self._pending.move_to_end(entry.key, last=False)
+                elif entry is not None:
+                    if payload == ERROR_BUFFER_FULL:
+                        COMMANDS_DROPPED.inc(self.port, 'buffer_full')
+                    log.warning('VISCA error %#04x for "%s" (camera %s)', payload, entry.name, address, port=self.port)
+
+            self._cond.notify()
+
+    def _fail(self, error):
+        ''' Report a serial port failure; the worker thread reopens the port. '''
+        with self._cond:
+            if not self._broken:
+                log.error('Serial port failure: %s', error, port=self.port)
+                self._broken = True
+                self._cond.notify()
+
+    def _reconnect(self):
+        ''' Reopen the serial port until it works again, then replay the desired state. '''
+        # The delay keeps growing while the port fails again right after being reopened,
+        # and goes back to RECONNECT_DELAY once a command has gone through.
+        delay = self._delay
+        while self._running:
+            time.sleep(delay)
+            delay = min(RECONNECT_DELAY_MAX, delay * 2)
+            try:
+                self.cam.reopen()
+                break
+            except Exception as e:
+                log.warning('Could not reopen the serial port, retrying in %.1f s: %s', delay, e, port=self.port)
+        else:
+            return
+
+        # Whatever was in flight is lost, and the camera's sockets are unknown.
+        self._abandon(ConnectionError('The serial port has failed'))
+        with self._cond:
+            self._broken = False
+            self._awaiting = None
+            self._sockets.clear()
+        self._delay = delay
+        self.reconnects += 1
+        RECONNECTS.inc(self.port)
+        log.info('Serial port reopened', port=self.port)
+
+        for callback in self.on_reconnect:
+            try:
+                callback()
+            except Exception as e:
+                log.error('Error while restoring the camera state: %s', e, port=self.port)
+
+    def _run(self):
+        while True:
+            entry = self._next()
+            if entry is None:
+                return
+            if entry is _RECONNECT:
+                self._reconnect()
+                continue
+
+            try:
+                if entry.kind != LOCAL:
+                    # Point the (addressed) PTZ object at the camera of this entry.
+                    self.cam.address = entry.address
+                result = getattr(self.cam, entry.name)(*entry.args)
+                if entry.kind != LOCAL:
+                    COMMANDS_SENT.inc(self.port, entry.kind, _command_label(entry))
+                    if log.tracing:
+                        log.trace('Sent %s%r to camera %s', entry.name, entry.args, entry.address, port=self.port)
+                self._delay = RECONNECT_DELAY
+                if entry.kind == LOCAL and entry.future is not None:
+                    entry.future.set_result(result)
+            except OSError as e:
+                # The serial port has failed (serial.SerialException is an OSError).
+                with self._cond:
+                    if self._awaiting is entry:
+                        self._awaiting = None
+                    # Send the command again once the port is back, unless a newer one has replaced it.
+                    if entry.kind == COMMAND and entry.key not in self._pending:
+                        self._pending[entry.key] = entry
+                        self._pending.move_to_end(entry.key, last=False)
+                if entry.kind != COMMAND and entry.future is not None and not entry.future.done():
+                    entry.future.set_exception(e)
+                self._fail(e)
+            except Exception as e:
+                log.error('Error while dispatching "%s": %s', entry.name, e, port=self.port)
+                COMMANDS_DROPPED.inc(self.port, 'error')
+                with self._cond:
+                    if self._awaiting is entry:
+                        self._awaiting = None
+                if entry.future is not None and not entry.future.done():
+                    entry.future.set_exception(e)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+#
+# Event-driven gamepad input engine
+# Licensed under GPL-3.0
+# ---
+# Instead of calling get_button()/get_axis() for every control on every loop pass,
+# the engine sleeps on pygame's event queue and only touches the cached state
+# of a joystick when SDL reports that one of its controls has changed.
+# -> SOURCE: https://www.pygame.org/docs/ref/event.html#pygame.event.wait
+
+from ptz_gamepad import log
+from ptz_gamepad import metrics
+from threading import Event
+import os
+import pygame
+import time
+
+# The only events that should ever wake the control loop up.
+JOYSTICK_EVENTS = (
+    pygame.JOYAXISMOTION,
+    pygame.JOYBUTTONDOWN,
+    pygame.JOYBUTTONUP,
+    pygame.JOYHATMOTION,
+    pygame.JOYDEVICEADDED,
+    pygame.JOYDEVICEREMOVED,
+    pygame.QUIT,
+)
+
+INPUT_EVENTS = metrics.counter('ptz_input_events_total', 'Gamepad events applied, by event type', ('type',))
+LOOP_STEP = metrics.histogram('ptz_loop_step_seconds', 'Time from the control loop waking up to it waiting for the gamepad again')
+
+# Set once an InputEngine listens for the joystick events; the events posted before are flushed.
+# A harness feeding events to a script (trace replays, benchmarks) clears it, starts the script, and waits for it.
+listening = Event()
+
+# An axis counts as a pressed button (e.g. an analog trigger) beyond this deflection
+AXIS_PRESS = 0.5
+
+def axis_side(value):
+    ''' Which end of an axis is "pressed": 1, -1, or 0 when it is in between. '''
+    return 1 if value > AXIS_PRESS else -1 if value < -AXIS_PRESS else 0
+
+def init_joysticks():
+    '''
+    Initialize only what the control loop needs instead of the whole of pygame.init() (audio, fonts, ...):
+    the joysticks, and the event queue, which pygame ties to its display module (no window gets opened).
+    '''
+    if not pygame.display.get_init():
+        pygame.display.init()
+    if not pygame.joystick.get_init():
+        pygame.joystick.init()
+
+class PadState(object):
+    '''
+    Compact snapshot of a single joystick's controls.
+    It mirrors the read-only part of pygame's Joystick interface (get_axis, get_button, get_hat, ...),
+    so existing mapping code can read from the cache without issuing any SDL call.
+    '''
+    
+    __slots__ = ('joystick', 'instance_id', 'axes', 'buttons', 'hats')
+    
+    def __init__(self, joystick):
+        self.joystick = joystick
+        self.instance_id = joystick.get_instance_id()
+        
+        # Read every control once; from now on only the events update these lists.
+        self.axes = [joystick.get_axis(i) for i in range(joystick.get_numaxes())]
+        self.buttons = [joystick.get_button(i) for i in range(joystick.get_numbuttons())]
+        self.hats = [joystick.get_hat(i) for i in range(joystick.get_numhats())]
+    
+    def get_axis(self, i):
+        return self.axes[i] if i < len(self.axes) else 0.0
+    
+    def get_button(self, i):
+        return self.buttons[i] if i < len(self.buttons) else 0
+    
+    def get_hat(self, i):
+        return self.hats[i] if i < len(self.hats) else (0, 0)
+    
+    def get_instance_id(self):
+        return self.instance_id
+    
+    def get_name(self):
+        return self.joystick.get_name()
+    
+    def get_guid(self):
+        # Virtual joysticks (benchmarks, replays) may not have one.
+        get_guid = getattr(self.joystick, 'get_guid', None)
+        return get_guid() if get_guid is not None else ''
+
+class InputEngine(object):
+    ''' Blocks on pygame's event queue and keeps a PadState for every connected joystick. '''
+    
+    def __init__(self, recorder=None):
+        init_joysticks()
+        
+        # This dict can be left as-is, since pygame will generate a
+        # pygame.JOYDEVICEADDED event for every joystick connected
+        # at the start of the program.
+        self.pads = {}
+        self.done = False
+        
+        # Optional TraceRecorder logging every applied event.
+        # Setting PTZ_GAMEPAD_RECORD to a file path records the session of any gamepad script.
+        if recorder is None and os.environ.get('PTZ_GAMEPAD_RECORD'):
+            from ptz_gamepad.trace import shared_recorder
+            recorder = shared_recorder(os.environ['PTZ_GAMEPAD_RECORD'])
+        self.recorder = recorder
+        
+        # Press and release of every button-like control, in order, during the last wait():
+        # (PadState, control, pressed) with control being ('button', i), ('hat', i, (x, y)) or ('axis', i, side).
+        # See ptz_gamepad.bindings for the lookup tables they are meant for.
+        self.controls = []
+        
+        # Instance IDs of the joysticks disconnected during the last wait(), so that the
+        # control loop can stop whatever their sticks were driving.
+        self.removed = []
+        
+        # When the last wait() has woken up, to time the step of the control loop
+        self.woke = None
+        
+        # Do not let mouse, keyboard or window events wake the loop up.
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(JOYSTICK_EVENTS)
+        
+        # Blocking the events flushes them from the queue, including the JOYDEVICEADDED events
+        # of the joysticks that were connected at startup: announce those again.
+        for i in range(pygame.joystick.get_count()):
+            pygame.event.post(pygame.event.Event(pygame.JOYDEVICEADDED, device_index=i))
+        listening.set()
+    
+    def wait(self, timeout=None):
+        '''
+        Sleep until at least one gamepad event arrives, then apply every queued event.
+        If timeout (in second) is given, return after that time even when nothing has happened.
+        Returns the list of PadState objects that have changed.
+        '''
+        self._step_done()
+        if timeout is None:
+            event = pygame.event.wait()
+        else:
+            # A zero timeout would mean "wait forever" to pygame.
+            event = pygame.event.wait(max(1, int(timeout * 1000)))
+        return self._drain(event)
+    
+    def tick(self, scheduler, timeout=None):
+        '''
+        Fixed-rate variant of wait(), paced by a FixedRateScheduler (see ptz_gamepad/scheduler.py):
+        the events are applied together at the deadlines of the scheduler, and once none has arrived
+        for a whole period, the engine sleeps until the next event (restarting the scheduler's grid),
+        or for at most "timeout" seconds if given.
+        Returns the list of PadState objects that have changed.
+        '''
+        self._step_done()
+        event = scheduler.ready(pygame.event.poll)
+        if not event:
+            event = pygame.event.wait() if timeout is None else pygame.event.wait(max(1, int(timeout * 1000)))
+            scheduler.restart()
+        return self._drain(event)
+    
+    def _step_done(self):
+        if self.woke is not None:
+            LOOP_STEP.observe(time.monotonic() - self.woke)
+            self.woke = None
+    
+    def _drain(self, event):
+        ''' Apply "event" and every queued event after it. '''
+        self.woke = time.monotonic()
+        changed = {}
+        del self.controls[:]
+        del self.removed[:]
+        while event.type != pygame.NOEVENT:
+            INPUT_EVENTS.inc(pygame.event.event_name(event.type))
+            self.apply(event, changed)
+            event = pygame.event.poll()
+        
+        return list(changed.values())
+    
+    def apply(self, event, changed=None):
+        ''' Update the cached pad states from a single pygame event. '''
+        changed = {} if changed is None else changed
+        pad = None
+        
+        if event.type == pygame.JOYAXISMOTION:
+            pad = self.pads.get(event.instance_id)
+            if pad is not None and event.axis < len(pad.axes):
+                old = axis_side(pad.axes[event.axis])
+                new = axis_side(event.value)
+                if old != new:
+                    if old:
+                        self.controls.append((pad, ('axis', event.axis, old), False))
+                    if new:
+                        self.controls.append((pad, ('axis', event.axis, new), True))
+                pad.axes[event.axis] = event.value
+                changed[pad.instance_id] = pad
+        
+        elif event.type == pygame.JOYBUTTONDOWN or event.type == pygame.JOYBUTTONUP:
+            pad = self.pads.get(event.instance_id)
+            if pad is not None and event.button < len(pad.buttons):
+                pressed = event.type == pygame.JOYBUTTONDOWN
+                if pad.buttons[event.button] != pressed:
+                    self.controls.append((pad, ('button', event.button), pressed))
+                pad.buttons[event.button] = 1 if pressed else 0
+                changed[pad.instance_id] = pad
+        
+        elif event.type == pygame.JOYHATMOTION:
+            pad = self.pads.get(event.instance_id)
+            if pad is not None and event.hat < len(pad.hats):
+                old = tuple(pad.hats[event.hat])
+                new = tuple(event.value)
+                if old != new:
+                    if old != (0, 0):
+                        self.controls.append((pad, ('hat', event.hat, old), False))
+                    if new != (0, 0):
+                        self.controls.append((pad, ('hat', event.hat, new), True))
+                pad.hats[event.hat] = event.value
+                changed[pad.instance_id] = pad
+        
+        # Handle hotplugging
+        elif event.type == pygame.JOYDEVICEADDED:
+            # This event will be generated when the program starts for every
+            # joystick, filling up the dict without needing to create them manually.
+            # A "joystick" attribute carries a virtual joystick object instead (e.g. posted by a benchmark).
+            joystick = getattr(event, 'joystick', None)
+            if joystick is None:
+                joystick = pygame.joystick.Joystick(event.device_index)
+            pad = PadState(joystick)
+            self.pads[pad.instance_id] = pad
+            changed[pad.instance_id] = pad
+            log.info("Joystick %s connected", pad.instance_id)
+        
+        elif event.type == pygame.JOYDEVICEREMOVED:
+            removed = self.pads.pop(event.instance_id, None)
+            if removed is not None:
+                # Whatever was held on the pad counts as released.
+                for i, value in enumerate(removed.buttons):
+                    if value:
+                        self.controls.append((removed, ('button', i), False))
+                for i, value in enumerate(removed.hats):
+                    if tuple(value) != (0, 0):
+                        self.controls.append((removed, ('hat', i, tuple(value)), False))
+                for i, value in enumerate(removed.axes):
+                    if axis_side(value):
+                        self.controls.append((removed, ('axis', i, axis_side(value)), False))
+                self.removed.append(event.instance_id)
+                log.info("Joystick %s disconnected", event.instance_id)
+        
+        elif event.type == pygame.QUIT:
+            log.info("Quitting.")
+            self.done = True
+        
+        if self.recorder is not None:
+            self.recorder.record(event, pad)
+        
+        return changed
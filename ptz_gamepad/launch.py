@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# Command line and config file launch options
+# Licensed under GPL-3.0
+# ---
+# The scripts used to ask for the serial port in a Tk dialog, which needs a display
+# server and costs a second on a slow machine. The port and the other settings may
+# now come from the command line or from a JSON config file instead, e.g.:
+#   python gamepad_xbox360.py --headless --port "COM7@1-3 COM8"
+#   {"port": "/dev/ttyUSB0", "layout": "taffgo", "headless": true, "rate": 60}
+# Without a port (or with the port "auto"), the serial ports are probed for cameras first
+# (see ptz_gamepad/discovery.py), and the port is only asked for if none answers.
+# Tk is only imported when the dialog is really shown.
+# The metrics (see ptz_gamepad/metrics.py) may be served over HTTP and/or written to a file.
+# The event log (see ptz_gamepad/log.py) goes to the console, or to --log-file; the per-command
+# tracing is switched on with --trace, or at runtime with SIGUSR1 (where available).
+# With --listen, the script also serves its cameras to other tools (see ptz_gamepad/server.py).
+# With --pads, each gamepad drives cameras of its own, e.g. --pads "0=1 1=2-3".
+
+from ptz_gamepad import log
+import argparse
+import atexit
+import json
+import os
+import signal
+import sys
+
+# Read when no --config is given and the file exists
+CONFIG_PATH = os.environ.get('PTZ_GAMEPAD_CONFIG') or os.path.join(os.path.expanduser('~'), '.ptz_gamepad', 'config.json')
+
+PORT_PROMPT = (
+    'Please enter the VISCA PTZ\'s registered serial port\n'
+    'e.g. Windows: "COM1", "COM2", etc.\n'
+    'e.g. Linux: "/dev/ttyUSB0", "/dev/ttyUSB1", etc.\n'
+    'Several cameras: "COM1@1-3 COM2" (daisy-chain addresses after "@").'
+)
+
+# Set by parse_options(): no dialog is ever shown when True.
+headless = False
+
+def load_config(path):
+    ''' Read a JSON config file. Returns an empty dict if the file does not exist. '''
+    try:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(config, dict):
+        raise ValueError(f'{path} should hold a JSON object')
+    return config
+
+def ask_port(initialvalue=None):
+    ''' Prompt for the PTZ's USB serial port in a Tk dialog. '''
+    from tkinter.simpledialog import askstring
+    return askstring('Serial USB Input', PORT_PROMPT, initialvalue=initialvalue)
+
+def show_error(title, message):
+    ''' Report an error in a Tk message box, or on the console when headless (or without Tk). '''
+    print(f'{title}: {message}', file=sys.stderr)
+    if headless:
+        return
+    try:
+        from tkinter import messagebox
+    except ImportError:
+        return
+    messagebox.showerror(title, message)
+
+def find_cameras():
+    ''' Probe the serial ports for cameras. Returns their camera list (e.g. "COM7@1,2 COM8@1"), or None. '''
+    from ptz_gamepad.discovery import camera_spec
+    from ptz_gamepad.discovery import discover
+
+    log.info('Looking for cameras on the serial ports...')
+    cameras = discover()
+    for camera in cameras:
+        log.info('Found %s', camera)
+    return camera_spec(cameras) if cameras else None
+
+def start_metrics(parser, port=None, path=None):
+    ''' Serve the metrics on a local HTTP port, and/or write them to a file, periodically and on exit. '''
+    from ptz_gamepad import metrics
+
+    if port:
+        try:
+            metrics.serve(int(port))
+        except (OSError, ValueError) as e:
+            parser.error(f'Cannot serve the metrics on port {port}: {e}')
+        log.info('Serving the metrics on http://127.0.0.1:%s/metrics', port)
+    if path:
+        dumper = metrics.MetricsDumper(path)
+        dumper.start()
+        atexit.register(dumper.stop)
+
+def start_log(path=None, trace=False):
+    ''' Send the event log to a file, if given, and set up the switches of the per-command tracing. '''
+    if path:
+        log.configure(path)
+    if trace:
+        log.set_tracing(True)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: log.toggle_tracing())
+
+def parse_options(description, argv=None, initialvalue=None):
+    '''
+    Parse the launch options of a gamepad script.
+    Every setting comes from the command line first, then from the config file.
+    Without a port, the cameras are looked for on every serial port; if none is found,
+    the port is asked in a dialog, or the program exits when headless.
+    Starts serving or writing the metrics, if asked to, and sets up the event log.
+    Returns an argparse.Namespace with "port", "layout", "headless", "rate", "metrics_port", "metrics_file",
+    "log_file", "trace", "listen" and "pads".
+    '''
+    global headless
+
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--port', help='Serial port(s) of the cameras, e.g. "COM7" or "COM7@1-3 COM8", or "auto" to look for them')
+    parser.add_argument('--layout', help='Button layout: a name of the bindings directory or a JSON file')
+    parser.add_argument('--headless', action='store_true', default=None, help='Never open a window or a dialog')
+    parser.add_argument('--rate', type=float, help='Run the control loop at this fixed rate (in Hz, e.g. 60) instead of once per gamepad event')
+    parser.add_argument('--metrics-port', type=int, help='Serve the metrics in the Prometheus text format on this local HTTP port')
+    parser.add_argument('--metrics-file', help='Write the metrics to this file every 10 s and on exit')
+    parser.add_argument('--log-file', help='Write the event log to this file instead of the console')
+    parser.add_argument('--trace', action='store_true', default=None, help='Log every command sent to the cameras (toggled at runtime with SIGUSR1)')
+    parser.add_argument('--listen', type=int, help='Serve the cameras to other tools on this local TCP port (e.g. 5678)')
+    parser.add_argument('--pads', help='Cameras of each gamepad, by joystick instance ID, e.g. "0=1 1=2-3" (cameras numbered from 1)')
+    parser.add_argument('--config', help=f'JSON file with the same settings (default: {CONFIG_PATH})')
+    options = parser.parse_args(argv)
+
+    try:
+        config = load_config(options.config or CONFIG_PATH)
+    except (OSError, ValueError) as e:
+        parser.error(f'Cannot read the config file: {e}')
+
+    for name in ('port', 'layout', 'headless', 'rate', 'metrics_port', 'metrics_file', 'log_file', 'trace', 'listen', 'pads'):
+        if getattr(options, name) is None:
+            setattr(options, name, config.get(name))
+    options.headless = bool(options.headless)
+    options.trace = bool(options.trace)
+    if options.rate is not None and not (isinstance(options.rate, (int, float)) and options.rate > 0):
+        parser.error(f'The rate should be a positive number of Hz, not {options.rate!r}')
+    headless = options.headless
+
+    start_log(options.log_file, options.trace)
+    start_metrics(parser, options.metrics_port, options.metrics_file)
+
+    if options.headless:
+        # SDL must not look for a display server.
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    if not options.port or options.port == 'auto':
+        options.port = find_cameras()
+    if not options.port:
+        if options.headless:
+            parser.error('No camera found: --port (or "port" in the config file) is required')
+        options.port = ask_port(initialvalue)
+
+    return options
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Asynchronous event log
+# Licensed under GPL-3.0
+# ---
+# A print() on a slow console (a Windows console, an SSH session) blocks the caller until
+# the text is out, which used to stall the control loop on every dispatched command.
+# Logging a record only appends it to an in-memory ring buffer instead; a background
+# thread formats the records and writes them in batches to the console or to a file.
+# If the writer falls behind, the oldest records are overwritten (and counted) rather
+# than ever blocking the loop.
+# The per-command records are logged at the TRACE level, which is off unless switched on
+# (--trace, PTZ_GAMEPAD_TRACE=1, or at runtime with set_tracing()). The hot paths test the
+# "tracing" flag before building anything, so they cost nothing while it is off:
+#   if log.tracing:
+#       log.trace('Dispatched command: %s', command)
+
+from collections import deque
+from ptz_gamepad import metrics
+from threading import Event
+from threading import Lock
+from threading import Thread
+import atexit
+import os
+import sys
+import time
+
+# Levels
+TRACE = 5
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {TRACE: 'TRACE', DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARN', ERROR: 'ERROR'}
+
+# Records kept in memory until the writer gets to them
+BUFFER_SIZE = 4096
+# Time between two batches of the writer (in second). Warnings and errors are written at once.
+FLUSH_INTERVAL = 0.1
+
+DROPPED = metrics.counter('ptz_log_dropped_total', 'Log records overwritten in the ring buffer before being written')
+
+class EventLog(object):
+    '''
+    Ring buffer of log records, written by a background thread.
+    A record is a tuple of (time, level, message, args, fields): the message is only
+    formatted (message % args, then the fields as key=value) by the writer.
+    Without a path, the records go to the console (sys.stdout).
+    '''
+
+    def __init__(self, path=None, level=INFO, size=BUFFER_SIZE, interval=FLUSH_INTERVAL):
+        self.path = path
+        self.level = level
+        self.interval = interval
+        self.records = deque(maxlen=size)
+        self.dropped = 0
+
+        self._file = None
+        self._wake = Event()
+        self._lock = Lock()
+        self._thread = None
+        self._running = False
+
+    def log(self, level, message, *args, **fields):
+        if level >= self.level:
+            self.record(level, message, *args, **fields)
+
+    def record(self, level, message, *args, **fields):
+        ''' Buffer a record, whatever its level. '''
+        records = self.records
+        if len(records) == records.maxlen:
+            self.dropped += 1
+            DROPPED.inc()
+        # deque.append() is atomic, so the callers never wait for each other nor for the writer.
+        records.append((time.time(), level, message, args, fields))
+        if self._thread is None:
+            self.start()
+        if level >= WARNING:
+            self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._running = True
+                self._thread = Thread(target=self._run, name='EventLog', daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def _format(self, record):
+        stamp, level, message, args, fields = record
+        if args:
+            try:
+                message = message % args
+            except (TypeError, ValueError):
+                message = f'{message} {args!r}'
+        if fields:
+            message += ' ' + ' '.join(f'{key}={value!r}' for key, value in fields.items())
+        clock = time.strftime('%H:%M:%S', time.localtime(stamp))
+        return f'{clock}.{int(stamp % 1 * 1000):03d} {LEVEL_NAMES.get(level, level):<5} {message}\n'
+
+    def flush(self):
+        ''' Write every buffered record, in a single write. '''
+        with self._lock:
+            lines = []
+            records = self.records
+            while records:
+                lines.append(self._format(records.popleft()))
+            if not lines:
+                return
+            try:
+                if self.path is None:
+                    stream = sys.stdout
+                else:
+                    if self._file is None:
+                        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                        self._file = open(self.path, 'a', encoding='utf-8')
+                    stream = self._file
+                stream.write(''.join(lines))
+                stream.flush()
+            except (OSError, ValueError, AttributeError):
+                # No console (e.g. pythonw), or the file cannot be written: the records are lost.
+                pass
+
+    def close(self):
+        ''' Write the remaining records and stop the writer. '''
+        self._running = False
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(1.0)
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+# The log of the controller, and whether the TRACE records are logged
+events = EventLog()
+tracing = os.environ.get('PTZ_GAMEPAD_TRACE', '') not in ('', '0')
+
+atexit.register(lambda: events.close())
+
+def configure(path=None, level=None):
+    ''' Send the log to a file instead of the console, and/or change its level. '''
+    global events
+    if path is not None and path != events.path:
+        old, events = events, EventLog(path, events.level)
+        old.close()
+    if level is not None:
+        events.level = level
+
+def set_tracing(on):
+    ''' Switch the per-command TRACE records on or off, at any time. '''
+    global tracing
+    tracing = bool(on)
+
+def toggle_tracing():
+    set_tracing(not tracing)
+    info('Command tracing %s', 'on' if tracing else 'off')
+    return tracing
+
+def trace(message, *args, **fields):
+    if tracing:
+        events.record(TRACE, message, *args, **fields)
+
+def debug(message, *args, **fields):
+    events.log(DEBUG, message, *args, **fields)
+
+def info(message, *args, **fields):
+    events.log(INFO, message, *args, **fields)
+
+def warning(message, *args, **fields):
+    events.log(WARNING, message, *args, **fields)
+
+def error(message, *args, **fields):
+    events.log(ERROR, message, *args, **fields)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+#
+# Built-in metrics, in the Prometheus text format
+# Licensed under GPL-3.0
+# ---
+# The dispatchers, the reply readers, the input engine and the loop scheduler count what
+# they do (commands sent per type, serial bytes, reply errors, coalesced commands, queue
+# depth, reply and loop timings, input events) in the metrics of this module. They can be
+# served over HTTP for a Prometheus server to scrape, and written to a file:
+#   python gamepad.py --metrics-port 9108 --metrics-file metrics.prom
+#   curl http://127.0.0.1:9108/metrics
+# A metric holds one value (or histogram) per combination of its label values.
+# -> SOURCE: https://prometheus.io/docs/instrumenting/exposition_formats/
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from threading import Lock
+from threading import Thread
+import bisect
+import os
+import time
+
+# Upper bounds of the histogram buckets (in second)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, float('inf'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Histogram(object):
+    ''' Counts of values (in second) per bucket, along with their count and sum. '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        ''' Upper bound of the bucket holding the p-th percentile, or None if empty. '''
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return bound
+        return self.buckets[-1]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric(object):
+    ''' A metric: a value per combination of label values (a tuple, in the order of "labels"). '''
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = Lock()
+
+    def _labels(self, values, extra=None):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra is not None:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self):
+        ''' The lines of the metric's samples, in the text format. '''
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: tuple(map(str, item[0])))
+        return [f'{self.name}{self._labels(labels)} {_number(value)}' for labels, value in values]
+
+    def render(self):
+        return '\n'.join([f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}'] + self.samples())
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+class HistogramMetric(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        with self.lock:
+            histogram = self.values.get(labels)
+            if histogram is None:
+                histogram = self.values[labels] = Histogram(self.buckets)
+            histogram.add(value)
+
+    def get(self, *labels):
+        return self.values.get(labels)
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: tuple(map(str, item[0])))
+            for labels, histogram in values:
+                total = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    total += count
+                    le = 'le="%s"' % _number(bound)
+                    lines.append(f'{self.name}_bucket{self._labels(labels, le)} {total}')
+                lines.append(f'{self.name}_sum{self._labels(labels)} {_number(histogram.sum)}')
+                lines.append(f'{self.name}_count{self._labels(labels)} {histogram.count}')
+        return lines
+
+# Every metric, by name
+REGISTRY = {}
+
+def _register(cls, name, help, labels, **kwargs):
+    metric = REGISTRY.get(name)
+    if metric is None:
+        metric = REGISTRY[name] = cls(name, help, labels, **kwargs)
+    elif not isinstance(metric, cls) or metric.labels != tuple(labels):
+        raise ValueError(f'The metric {name} is already registered with another type or labels')
+    return metric
+
+def counter(name, help, labels=()):
+    ''' The counter "name", registered on first use. '''
+    return _register(Counter, name, help, labels)
+
+def gauge(name, help, labels=()):
+    ''' The gauge "name", registered on first use. '''
+    return _register(Gauge, name, help, labels)
+
+def histogram(name, help, labels=(), buckets=BUCKETS):
+    ''' The histogram "name" (of values in second), registered on first use. '''
+    return _register(HistogramMetric, name, help, labels, buckets=buckets)
+
+def render():
+    ''' Every metric, in the Prometheus text format. '''
+    return ''.join(REGISTRY[name].render() + '\n' for name in sorted(REGISTRY))
+
+def dump(path):
+    ''' Write every metric to a file, aside first, so that a reader never sees half of it. '''
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(render())
+    os.replace(path + '.tmp', path)
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the scrapes out of the console.
+        pass
+
+def serve(port, host='127.0.0.1'):
+    ''' Serve the metrics on http://host:port/metrics from a background thread. Returns the server. '''
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='MetricsServer', daemon=True).start()
+    return server
+
+class MetricsDumper(Thread):
+    ''' Writes the metrics to a file every "interval" second, and once more on stop(). '''
+
+    def __init__(self, path, interval=10.0):
+        Thread.__init__(self, name='MetricsDumper', daemon=True)
+        self.path = path
+        self.interval = interval
+        self.running = True
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            self.write()
+
+    def write(self):
+        # Imported here: the log counts its own dropped records in a metric.
+        from ptz_gamepad import log
+
+        try:
+            dump(self.path)
+        except OSError as e:
+            log.warning('Could not write the metrics to %s: %s', self.path, e)
+
+    def stop(self):
+        self.running = False
+        self.write()
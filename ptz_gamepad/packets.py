@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#
+# VISCA packet builders
+# Licensed under GPL-3.0
+# ---
+# The packets are hexadecimal strings, just like the ones pyvisca sends through PTZ.comm().
+# VISCA command documentation was obtained from Crestron
+# -> SOURCE: https://docs.crestron.com/en-us/9326/Content/Topics/Configuration/VISCA-Comands.htm
+
+from ptz_gamepad.speed import PAN_SPEED_MAX
+from ptz_gamepad.speed import TILT_SPEED_MAX
+
+# Direction bytes of the Pan-tiltDrive command (XX for pan, YY for tilt). 03 means "stop".
+PAN_DIRECTIONS = {'left': '01', 'right': '02'}
+TILT_DIRECTIONS = {'up': '01', 'down': '02'}
+DIRECTION_STOP = '03'
+
+def _speed(speed, max_speed):
+    return '%02X' % max(1, min(max_speed, int(speed)))
+
+def pan_tilt_drive(pan, tilt, address=1):
+    '''
+    Build a single Pan-tiltDrive packet (8x 01 06 01 VV WW XX YY FF) moving both axes at once.
+    Both "pan" and "tilt" are (direction, speed) tuples, such as ('left', 5) and ('down', 3),
+    or None when that axis should stand still. Passing None for both stops the camera.
+    '''
+    pan_speed = pan_dir = tilt_speed = tilt_dir = None
+    if pan is not None:
+        pan_dir = PAN_DIRECTIONS[pan[0]]
+        pan_speed = _speed(pan[1], PAN_SPEED_MAX)
+    if tilt is not None:
+        tilt_dir = TILT_DIRECTIONS[tilt[0]]
+        tilt_speed = _speed(tilt[1], TILT_SPEED_MAX)
+
+    return (
+        f'8{address:X}010601'
+        f'{pan_speed or "01"}{tilt_speed or "01"}'
+        f'{pan_dir or DIRECTION_STOP}{tilt_dir or DIRECTION_STOP}FF'
+    )
+
+def _position(value):
+    ''' Encode a 16-bit position as VISCA nibble bytes (0p 0q 0r 0s), in hexadecimal. '''
+    value &= 0xFFFF
+    return ''.join(f'0{(value >> shift) & 0x0F:X}' for shift in (12, 8, 4, 0))
+
+def pan_tilt_absolute(pan, tilt, pan_speed=PAN_SPEED_MAX, tilt_speed=TILT_SPEED_MAX, address=1):
+    '''
+    Build a Pan-tiltDrive AbsolutePosition packet (8x 01 06 02 VV WW 0Y 0Y 0Y 0Y 0Z 0Z 0Z 0Z FF),
+    moving to the "pan" and "tilt" positions (signed, as answered by PAN_TILT_POS_INQ) at the given speeds.
+    '''
+    return (
+        f'8{address:X}010602'
+        f'{_speed(pan_speed, PAN_SPEED_MAX)}{_speed(tilt_speed, TILT_SPEED_MAX)}'
+        f'{_position(pan)}{_position(tilt)}FF'
+    )
+
+def zoom_direct(position, address=1):
+    ''' Build a CAM_Zoom Direct packet (8x 01 04 47 0p 0q 0r 0s FF) to a zoom position. '''
+    return f'8{address:X}010447{_position(position)}FF'
+
+def focus_direct(position, address=1):
+    ''' Build a CAM_Focus Direct packet (8x 01 04 48 0p 0q 0r 0s FF) to a focus position. '''
+    return f'8{address:X}010448{_position(position)}FF'
+
+# Inquiry packets
+POWER_INQ = '81090400FF'
+
+def power_state(answer):
+    '''
+    Decode the answer to POWER_INQ (y0 50 0p FF).
+    Returns 1 if the PTZ is already on, 0 if it is in standby mode, -1 if the state is unexpected.
+    '''
+    if len(answer) >= 4 and answer[2] == 0x02:
+        return 1
+    if len(answer) >= 4 and answer[2] == 0x03:
+        return 0
+    return -1
+
+# Version inquiry (CAM_VersionInq), answered by y0 50 GG GG HH HH JJ JJ KK FF
+VERSION_INQ = '81090002FF'
+
+# Vendor IDs (GG GG) of the version inquiry
+VENDORS = {0x0020: 'Sony'}
+
+def version_info(answer):
+    '''
+    Decode the answer to VERSION_INQ.
+    Returns a tuple of (vendor ID, model ID, ROM version, max socket number), or None if the answer is not one.
+    '''
+    if len(answer) != 10 or answer[1] != 0x50:
+        return None
+    return (
+        int.from_bytes(answer[2:4], 'big'),
+        int.from_bytes(answer[4:6], 'big'),
+        int.from_bytes(answer[6:8], 'big'),
+        answer[8],
+    )
+
+# Position and mode inquiries, polled in the background (see ptz_gamepad/status.py)
+PAN_TILT_POS_INQ = '81090612FF'
+ZOOM_POS_INQ = '81090447FF'
+FOCUS_POS_INQ = '81090448FF'
+EXPOSURE_MODE_INQ = '81090439FF'
+
+# Answers to EXPOSURE_MODE_INQ (y0 50 0p FF)
+EXPOSURE_MODES = {0x00: 'auto', 0x03: 'manual', 0x0A: 'shutter', 0x0B: 'iris', 0x0D: 'bright'}
+
+def _nibbles(data):
+    ''' Decode VISCA nibble bytes (0p 0q 0r 0s) into a signed 16-bit value. '''
+    value = 0
+    for b in data:
+        value = (value << 4) | (b & 0x0F)
+    return value - 0x10000 if value & 0x8000 else value
+
+def pan_tilt_position(answer):
+    '''
+    Decode the answer to PAN_TILT_POS_INQ (y0 50 0w 0w 0w 0w 0z 0z 0z 0z FF).
+    Returns a tuple of (pan, tilt) positions, or None if the answer is not one.
+    '''
+    if len(answer) != 11 or answer[1] != 0x50:
+        return None
+    return (_nibbles(answer[2:6]), _nibbles(answer[6:10]))
+
+def lens_position(answer):
+    '''
+    Decode the answer to ZOOM_POS_INQ or FOCUS_POS_INQ (y0 50 0p 0q 0r 0s FF).
+    Returns the position (0 is wide / far), or None if the answer is not one.
+    '''
+    if len(answer) != 7 or answer[1] != 0x50:
+        return None
+    return _nibbles(answer[2:6]) & 0xFFFF
+
+def exposure_mode(answer):
+    '''
+    Decode the answer to EXPOSURE_MODE_INQ (y0 50 0p FF).
+    Returns the mode name ('auto', 'manual', ...), its code for the unknown modes, or None if the answer is not one.
+    '''
+    if len(answer) != 4 or answer[1] != 0x50:
+        return None
+    return EXPOSURE_MODES.get(answer[2], answer[2])
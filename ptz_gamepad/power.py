@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# Non-blocking power-on sequence
+# Licensed under GPL-3.0
+# ---
+# A VISCA camera takes up to half a minute to boot after CAM_Power On, and does not
+# answer anything meanwhile. Instead of freezing the control loop for the worst case,
+# a background thread keeps asking the camera for its power state (CAM_PowerInq)
+# and hands the controls back as soon as the camera reports that it is on.
+# The camera's controls are held in the meantime: their latest desired state is
+# sent once it is ready, and the other cameras are not affected at all.
+# A power state the StatusPoller has received recently spares the first inquiry. A camera that does
+# not answer it (e.g. just plugged in, or still starting up) gets the power-on all the same.
+# A sequence drives a single camera, since a broadcast cannot be inquired: to power several
+# cameras on, start one sequence per camera (see CameraRig.power_on()).
+
+from ptz_gamepad import log
+from ptz_gamepad.dispatcher import BROADCAST
+from ptz_gamepad.packets import POWER_INQ
+from ptz_gamepad.packets import power_state
+from threading import Thread
+import time
+
+# Give up waiting for the camera after this long (in second), and hand the controls back anyway
+POWER_ON_TIMEOUT = 60.0
+# Time between two power inquiries while the camera boots
+POLL_INTERVAL = 1.0
+# How long to wait for the answer to one inquiry. It is kept short because the port
+# (and so the other cameras of the chain) waits with it, and a booting camera is silent.
+POLL_REPLY_TIMEOUT = 0.15
+# A cached power state younger than this is trusted (in second)
+POWER_MAX_AGE = 1.0
+
+# States of the sequence
+CHECKING = 'checking'
+BOOTING = 'booting'
+READY = 'ready'
+FAILED = 'failed'
+
+class PowerSequencer(Thread):
+    '''
+    Powers a camera on in the background.
+    "cam" is its ViscaDispatcher (or CameraHandle), "state" its CameraState, held during the sequence.
+    If flush is True, the input buffer of the port is emptied once the camera is up (on the
+    dispatcher's thread, in order with its commands), discarding whatever the camera has sent while booting.
+    "status" is the camera's StatusCache, if any: it is read first, and kept up to date.
+    Raises ValueError if "cam" is a broadcast, which could not answer the power inquiries.
+    '''
+
+    def __init__(self, cam, state, timeout=POWER_ON_TIMEOUT, flush=True, status=None):
+        Thread.__init__(self, name='PowerSequencer', daemon=True)
+        if getattr(cam, 'address', None) == BROADCAST or isinstance(getattr(cam, 'handles', None), list):
+            raise ValueError(f'Cannot power {cam} on at once: start a sequence per camera')
+        self.cam = cam
+        self.state = state
+        self.timeout = timeout
+        self.flush = flush
+        self.cache = status
+        self.status = CHECKING
+        self.elapsed = None
+
+    def _power(self, cached=False):
+        '''
+        Returns the power state of the camera (1 on, 0 standby), or -1 if it does not answer.
+        If "cached" is True, a recent power state of the status cache is returned instead of inquiring.
+        '''
+        if cached and self.cache is not None:
+            power = self.cache.get('power', POWER_MAX_AGE)
+            if power in (0, 1):
+                return power
+        try:
+            power = power_state(self.cam.inquire(POWER_INQ, reply_timeout=POLL_REPLY_TIMEOUT))
+        except (TimeoutError, RuntimeError, OSError):
+            return -1
+        if self.cache is not None:
+            self.cache.set('power', power)
+        return power
+
+    def run(self):
+        self.state.hold()
+        start = time.monotonic()
+        try:
+            power = self._power(cached=True)
+            if power == 1:
+                log.debug("The PTZ camera is already on.")
+                self.status = READY
+                return
+            if power == -1:
+                # Powering on a camera that is already on does no harm.
+                log.warning("The PTZ camera does not answer the power inquiry; powering it on anyway.")
+
+            log.info("Starting the PTZ camera ...")
+            self.cam.send(None, 'power', 1)
+            self.status = BOOTING
+
+            while time.monotonic() - start < self.timeout:
+                time.sleep(POLL_INTERVAL)
+                power = self._power()
+                if power == 0:
+                    # Still in standby: a camera that was not listening yet has missed the power-on.
+                    self.cam.send(None, 'power', 1)
+                elif power == 1:
+                    if self.flush:
+                        # The port itself is left open: closing it under the dispatcher's reply
+                        # reader would pass for a port failure, and start a reconnection.
+                        self.cam.call('reset_input_buffer')
+                    self.status = READY
+                    self.elapsed = time.monotonic() - start
+                    log.info("PTZ Initialization complete! (%.1f s)", self.elapsed)
+                    return
+
+            log.warning("The PTZ camera did not report being on within %.0f s.", self.timeout)
+            self.status = FAILED
+        finally:
+            self.state.release()
+
+    @property
+    def busy(self):
+        return self.status in (CHECKING, BOOTING)
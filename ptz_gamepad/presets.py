@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Local preset bank
+# Licensed under GPL-3.0
+# ---
+# A VISCA camera only remembers 16 presets (0-15), in its own memory. The preset bank
+# keeps any number of named shots in a JSON file instead, as absolute pan, tilt, zoom and
+# focus positions, and recalls them with the absolute position commands at a chosen speed.
+# The shots are not tied to a camera head: a replaced camera goes to the same positions.
+# The bank is a dict in memory, so looking a shot up and recalling it costs the same
+# whatever the number of shots; the file is only written when a shot is stored or deleted.
+#
+# Usage:
+#   python -m ptz_gamepad.presets list
+#   python -m ptz_gamepad.presets store NAME --port "COM7@2"
+#   python -m ptz_gamepad.presets recall NAME --port COM7 [--speed 12]
+#   python -m ptz_gamepad.presets delete NAME
+
+from ptz_gamepad import log
+from ptz_gamepad.packets import FOCUS_POS_INQ
+from ptz_gamepad.packets import PAN_TILT_POS_INQ
+from ptz_gamepad.packets import ZOOM_POS_INQ
+from ptz_gamepad.packets import lens_position
+from ptz_gamepad.packets import pan_tilt_position
+from ptz_gamepad.speed import PAN_SPEED_MAX
+from ptz_gamepad.speed import TILT_SPEED_MAX
+from threading import RLock
+import argparse
+import json
+import os
+
+PRESETS_PATH = os.environ.get('PTZ_GAMEPAD_PRESETS') or os.path.join(os.path.expanduser('~'), '.ptz_gamepad', 'presets.json')
+
+class Preset(object):
+    ''' A stored shot: absolute positions (zoom and focus may be None), and its own pan-tilt speed (or None). '''
+    __slots__ = ('name', 'pan', 'tilt', 'zoom', 'focus', 'speed')
+
+    def __init__(self, name, pan, tilt, zoom=None, focus=None, speed=None):
+        self.name = name
+        self.pan = pan
+        self.tilt = tilt
+        self.zoom = zoom
+        self.focus = focus
+        self.speed = speed
+
+    def __str__(self):
+        text = f'{self.name}: pan {self.pan}, tilt {self.tilt}'
+        if self.zoom is not None:
+            text += f', zoom {self.zoom}'
+        if self.focus is not None:
+            text += f', focus {self.focus}'
+        if self.speed is not None:
+            text += f', speed {self.speed}'
+        return text
+
+    def to_json(self):
+        return {name: getattr(self, name) for name in self.__slots__[1:] if getattr(self, name) is not None}
+
+def capture(cam, timeout=None):
+    '''
+    Inquire the current pan-tilt, zoom and focus positions of a camera (a CameraHandle or ViscaDispatcher),
+    in order with the commands already queued. Returns a (pan, tilt, zoom, focus) tuple, zoom and focus
+    being None if the camera does not answer them. Raises TimeoutError if the pan-tilt position is not answered.
+    '''
+    position = pan_tilt_position(cam.inquire(PAN_TILT_POS_INQ, timeout))
+    if position is None:
+        raise TimeoutError('No pan-tilt position answered')
+    lens = []
+    for packet in (ZOOM_POS_INQ, FOCUS_POS_INQ):
+        try:
+            lens.append(lens_position(cam.inquire(packet, timeout)))
+        except (TimeoutError, RuntimeError):
+            lens.append(None)
+    return position + tuple(lens)
+
+class PresetBank(object):
+    '''
+    Named shots, stored in a JSON file ({"name": {"pan": 0, "tilt": 0, "zoom": 0, "focus": 0}, ...}).
+    "speed" is the pan-tilt speed of the recalls (1 to the max speed), for the shots that have none of their own.
+    A file that cannot be read is renamed aside (to "<path>.bad") and the bank starts empty,
+    rather than keeping the controller from starting.
+    '''
+
+    def __init__(self, path=PRESETS_PATH, speed=PAN_SPEED_MAX):
+        self.path = path
+        self.speed = speed
+        # Shots may be stored from a background thread (see Operator.store_shot()).
+        self.lock = RLock()
+        try:
+            self.presets = self._load()
+        except ValueError as e:
+            self.presets = {}
+            try:
+                os.replace(self.path, self.path + '.bad')
+                log.error("%s Starting with no shots; the file is kept as %s.bad", e, self.path)
+            except OSError as backup_error:
+                log.error("%s Starting with no shots (could not keep the file aside: %s)", e, backup_error)
+
+    def __len__(self):
+        return len(self.presets)
+
+    def __contains__(self, name):
+        return name in self.presets
+
+    def __iter__(self):
+        return iter(self.presets.values())
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            raise ValueError(f'{self.path} is not a valid preset file: {e}.')
+        if not isinstance(saved, dict):
+            raise ValueError(f'{self.path} should hold a JSON object.')
+
+        presets = {}
+        for name, item in saved.items():
+            try:
+                presets[name] = Preset(
+                    name, int(item['pan']), int(item['tilt']),
+                    *(None if item.get(key) is None else int(item[key]) for key in ('zoom', 'focus', 'speed'))
+                )
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f'Invalid preset "{name}" in {self.path}.')
+        return presets
+
+    def save(self):
+        ''' Write the whole bank aside first, so that an interrupted write never leaves a broken file. '''
+        with self.lock:
+            saved = {name: preset.to_json() for name, preset in self.presets.items()}
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(saved, f, indent=2, sort_keys=True)
+            os.replace(self.path + '.tmp', self.path)
+
+    def get(self, name):
+        return self.presets.get(name)
+
+    def store(self, name, pan, tilt, zoom=None, focus=None, speed=None):
+        ''' Store (or overwrite) a shot, and save the bank. Returns the Preset. '''
+        with self.lock:
+            preset = self.presets[name] = Preset(name, pan, tilt, zoom, focus, speed)
+            self.save()
+        return preset
+
+    def delete(self, name):
+        ''' Delete a shot, and save the bank. Returns False if there is no such shot. '''
+        with self.lock:
+            if self.presets.pop(name, None) is None:
+                return False
+            self.save()
+        return True
+
+    def recall(self, name, state, speed=None):
+        '''
+        Send the camera of "state" (a CameraState) to a shot, at "speed" (by default the shot's own speed,
+        else the bank's speed). The tilt speed is scaled along. Returns the Preset, or None if there is no such shot.
+        '''
+        preset = self.presets.get(name)
+        if preset is None:
+            return None
+        speed = speed or preset.speed or self.speed
+        tilt_speed = max(1, round(speed * TILT_SPEED_MAX / PAN_SPEED_MAX))
+        state.move_to(preset.pan, preset.tilt, preset.zoom, preset.focus, speed, tilt_speed)
+        return preset
+
+def main():
+    from ptz_gamepad.cameras import CameraRig
+
+    parser = argparse.ArgumentParser(description='Manage the named shots of the local preset bank.')
+    parser.add_argument('command', choices=('list', 'store', 'recall', 'delete'))
+    parser.add_argument('name', nargs='?', help='Name of the shot')
+    parser.add_argument('--port', help='Camera to store from or recall on, e.g. "COM7" or "COM7@2"')
+    parser.add_argument('--speed', type=int, help=f'Pan-tilt speed of the recall (1-{PAN_SPEED_MAX})')
+    parser.add_argument('--file', default=PRESETS_PATH, help=f'Preset file (default: {PRESETS_PATH})')
+    args = parser.parse_args()
+
+    bank = PresetBank(args.file)
+    if args.command == 'list':
+        for preset in sorted(bank, key=lambda preset: preset.name):
+            print(preset)
+        print(f'{len(bank)} shot(s) in {bank.path}')
+        return
+    if not args.name:
+        parser.error(f'{args.command} needs the name of a shot')
+    if args.command == 'delete':
+        if not bank.delete(args.name):
+            parser.error(f'No shot named "{args.name}"')
+        return
+    if args.command == 'recall' and args.name not in bank:
+        parser.error(f'No shot named "{args.name}"')
+    if not args.port:
+        parser.error(f'{args.command} needs the --port of the camera')
+
+    rig = CameraRig(args.port, poll=False).start()
+    try:
+        if args.command == 'store':
+            print(bank.store(args.name, *capture(rig.cam), speed=args.speed))
+        else:
+            print(bank.recall(args.name, rig.state, args.speed))
+    finally:
+        rig.close()
+
+if __name__ == '__main__':
+    main()
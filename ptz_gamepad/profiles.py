@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+#
+# Gamepad profile auto-detection
+# Licensed under GPL-3.0
+# ---
+# Every gamepad model numbers its buttons and axes differently, which used to mean
+# one script per model. Instead, the model of a newly connected joystick is looked up
+# by its SDL GUID (which carries the USB vendor and product IDs) and its name in the
+# controller database (bindings/gamecontrollerdb.txt), and picks the button layout to use.
+# The answer is cached on disk per GUID, and the layouts are compiled up front,
+# so that hot-plugging another gamepad takes effect at once.
+# -> SOURCE: https://github.com/mdqinc/SDL_GameControllerDB
+
+from ptz_gamepad import log
+from ptz_gamepad.bindings import BINDINGS_DIR
+from ptz_gamepad.bindings import load_bindings
+from ptz_gamepad.conditioning import settling
+from ptz_gamepad.speed import FOCUS_SPEED_MAX
+from ptz_gamepad.speed import PAN_SPEED_MAX
+from ptz_gamepad.speed import SpeedQuantizer
+from ptz_gamepad.speed import TILT_SPEED_MAX
+from ptz_gamepad.speed import ZOOM_SPEED_MAX
+from ptz_gamepad.state import drive
+import json
+import os
+import time
+
+CONTROLLER_DB = os.path.join(BINDINGS_DIR, 'gamecontrollerdb.txt')
+
+# The resolved GUID -> profile mapping. It may be edited by hand to force a layout
+# for a gamepad (e.g. "taffgo" for an Xbox 360 compatible TaffGO pad).
+CACHE_PATH = os.environ.get('PTZ_GAMEPAD_CACHE') or os.path.join(os.path.expanduser('~'), '.ptz_gamepad', 'controllers.json')
+
+# Layout of the gamepads the database does not know
+DEFAULT_PROFILE = 'xbox360'
+
+def guid_ids(guid):
+    '''
+    Extract the USB (vendor, product) IDs of an SDL2 joystick GUID (32 hexadecimal digits),
+    or return None if the GUID does not carry them (e.g. an older driver's GUID).
+    '''
+    if len(guid) != 32 or guid[12:16] != '0000' or guid[20:24] != '0000':
+        return None
+    try:
+        # Both IDs are stored little-endian.
+        vendor = int(guid[10:12] + guid[8:10], 16)
+        product = int(guid[18:20] + guid[16:18], 16)
+    except ValueError:
+        return None
+    return (vendor, product) if vendor else None
+
+def read_controller_db(path=CONTROLLER_DB):
+    '''
+    Parse a controller database file.
+    Returns a list of (GUID, name, profile) tuples, the GUID being empty for the entries matched by name.
+    '''
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split(',')
+            mapping = dict(field.split(':', 1) for field in fields[2:] if ':' in field)
+            if 'profile' in mapping:
+                entries.append((fields[0].strip().lower(), fields[1].strip(), mapping['profile']))
+    return entries
+
+class PadDriver(object):
+    ''' Drives the camera state from one connected joystick, according to the layout of its profile. '''
+
+    def __init__(self, profile, table):
+        self.profile = profile
+        self.table = table
+        # Every joystick has its own quantizers, since they remember the current speed step.
+        self.speeds = {
+            'pan': SpeedQuantizer(PAN_SPEED_MAX),
+            'tilt': SpeedQuantizer(TILT_SPEED_MAX),
+            'zoom': SpeedQuantizer(ZOOM_SPEED_MAX),
+            'focus': SpeedQuantizer(FOCUS_SPEED_MAX),
+        }
+        # Its own stick conditioners as well, since their filters remember the past positions:
+        # pan and tilt make a single stick (with a radial deadzone), zoom and focus one axis each.
+        sticks = table.sticks
+        self.movement = [name for name in ('pan', 'tilt') if name in sticks.axes]
+        self.conditioners = {name: sticks.conditioner(1) for name in ('zoom', 'focus') if name in sticks.axes}
+        if self.movement:
+            self.conditioners['movement'] = sticks.conditioner(len(self.movement))
+
+    @property
+    def settling(self):
+        ''' True while a stick filter lags behind its stick, so that drive() should run again even without input. '''
+        return settling(self.conditioners.values())
+
+    def handle(self, pad, control, pressed, state, actions=None):
+        ''' Apply the press or release of a control (see BindingTable.handle()). '''
+        return self.table.handle(pad, control, pressed, state, actions)
+
+    def _axis(self, name, val, negative, positive, max_speed):
+        return drive(val, negative, positive, self.speeds[name](val, max_speed))
+
+    def drive(self, pad, state):
+        ''' Apply the stick positions of the pad to the camera state "state". '''
+        axes = self.table.sticks.axes
+        limits = self.table.sticks.limits(pad)
+        conditioners = self.conditioners
+        now = time.monotonic()
+
+        # Movement actions (left-right panning, up-down tilting)
+        if self.movement:
+            stick = conditioners['movement']
+            stick.update(*(pad.get_axis(axes[name]) for name in self.movement), now=now)
+            values = dict(zip(self.movement, stick.values))
+            pan = self._axis('pan', values['pan'], 'left', 'right', limits.get('movement')) if 'pan' in values else None
+            tilt = self._axis('tilt', values['tilt'], 'up', 'down', limits.get('movement')) if 'tilt' in values else None
+            state.pan_tilt(pan, tilt)
+
+        # Movement actions (zoom, focus)
+        if 'zoom' in conditioners:
+            conditioners['zoom'].update(pad.get_axis(axes['zoom']), now=now)
+            zoom = self._axis('zoom', conditioners['zoom'].values[0], 'zoom_in', 'zoom_out', limits.get('zoom'))
+            state.update('zoom', zoom or ('zoom_stop',))
+        if 'focus' in conditioners:
+            conditioners['focus'].update(pad.get_axis(axes['focus']), now=now)
+            focus = self._axis('focus', conditioners['focus'].values[0], 'focus_near', 'focus_far', limits.get('focus'))
+            state.update('focus', focus or ('focus_stop',))
+
+class ProfileResolver(object):
+    '''
+    Picks the profile (layout) of every connected joystick and keeps a PadDriver per joystick.
+    "actions" are the controller's own functions the layouts may bind (see BindingTable.handle()).
+    If "profile" is given, every joystick uses that layout instead.
+    '''
+
+    def __init__(self, actions=None, profile=None, db_path=CONTROLLER_DB, cache_path=CACHE_PATH):
+        self.actions = actions or {}
+        self.forced = profile
+        self.db = read_controller_db(db_path)
+        self.cache_path = cache_path
+        self.cache = self._load_cache()
+
+        # Compile every layout now, so that a newly plugged gamepad gets going at once.
+        self.layouts = {}
+        for name in {entry[2] for entry in self.db} | {DEFAULT_PROFILE, profile}:
+            if name is not None:
+                self.layouts[name] = load_bindings(name, self.actions)
+        # A hand-edited cache may name other layouts; a broken one is skipped, not fatal.
+        for name in set(self.cache.values()) - set(self.layouts):
+            try:
+                self.layouts[name] = load_bindings(name, self.actions)
+            except (OSError, ValueError) as e:
+                log.warning("Skipping the cached %s layout: %s", name, e)
+
+        # Joystick instance id -> PadDriver
+        self.pads = {}
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                return {key: entry['profile'] for key, entry in json.load(f).items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return {}
+
+    def _save_cache(self, key, name, profile):
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        saved[key] = {'name': name, 'profile': profile}
+
+        # Write the whole file aside first, so that an interrupted write never leaves a broken cache.
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(saved, f, indent=2, sort_keys=True)
+            os.replace(self.cache_path + '.tmp', self.cache_path)
+        except OSError as e:
+            log.warning("Could not cache the gamepad profile: %s", e)
+
+    def identify(self, guid, name):
+        '''
+        Look a joystick up in the controller database: by its exact GUID, then by its vendor
+        and product IDs, then by its name. Returns the profile name, or None if it is unknown.
+        '''
+        guid = guid.lower()
+        ids = guid_ids(guid)
+        for entry_guid, _, profile in self.db:
+            if entry_guid and entry_guid == guid:
+                return profile
+        for entry_guid, _, profile in self.db:
+            if entry_guid and ids is not None and guid_ids(entry_guid) == ids:
+                return profile
+        for entry_guid, entry_name, profile in self.db:
+            if not entry_guid and entry_name.lower() in name.lower():
+                return profile
+        return None
+
+    def resolve(self, pad):
+        ''' Pick the profile name of a joystick (a PadState, or anything with get_guid() and get_name()). '''
+        if self.forced is not None:
+            return self.forced
+
+        guid = pad.get_guid()
+        name = pad.get_name()
+        key = guid or name
+        profile = self.cache.get(key)
+        if profile in self.layouts:
+            return profile
+
+        profile = self.identify(guid, name)
+        if profile is None:
+            log.warning("Unknown gamepad \"%s\" (%s), using the %s layout", name, guid, DEFAULT_PROFILE)
+            return DEFAULT_PROFILE
+
+        self.cache[key] = profile
+        self._save_cache(key, name, profile)
+        return profile
+
+    def get(self, pad):
+        ''' The PadDriver of a joystick, picking its profile the first time the joystick is seen. '''
+        driver = self.pads.get(pad.instance_id)
+        if driver is None:
+            profile = self.resolve(pad)
+            driver = self.pads[pad.instance_id] = PadDriver(profile, self.layouts[profile])
+            log.info("Joystick %s (%s) uses the %s layout", pad.instance_id, pad.get_name(), profile)
+        return driver
+
+    def forget(self, instance_ids):
+        ''' Drop the drivers of the joysticks that are not connected anymore. '''
+        for instance_id in [i for i in self.pads if i not in instance_ids]:
+            del self.pads[instance_id]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# VISCA reply reader
+# Licensed under GPL-3.0
+# ---
+# Every VISCA command is answered by the camera: first an ACK (y0 4z FF) telling which
+# command buffer ("socket" z) has taken it, then a Completion (y0 5z FF) once it is done,
+# or an error (y0 6z EE FF) instead. Inquiries are answered directly (y0 50 ... FF).
+# The reader thread splits the incoming byte stream into packets and hands them over.
+
+from ptz_gamepad import metrics
+from threading import Thread
+import time
+
+# Reply types
+ACK = 'ack'
+COMPLETION = 'completion'
+ERROR = 'error'
+ANSWER = 'answer'
+
+BYTES_READ = metrics.counter('ptz_serial_bytes_read_total', 'Bytes read from the serial ports', ('port',))
+
+# Error codes (EE) of the error reply
+ERROR_SYNTAX = 0x02
+ERROR_BUFFER_FULL = 0x03
+ERROR_CANCELED = 0x04
+ERROR_NO_SOCKET = 0x05
+ERROR_NOT_EXECUTABLE = 0x41
+
+def parse_reply(packet):
+    '''
+    Classify a reply packet (bytes, terminated by 0xFF).
+    Returns a tuple of (type, socket, payload), or None if the packet is not a reply.
+    For errors the payload is the error code; for inquiry answers it is the data bytes.
+    '''
+    if len(packet) < 3 or packet[0] & 0x80 == 0:
+        return None
+
+    kind = packet[1] & 0xF0
+    socket = packet[1] & 0x0F
+    if kind == 0x40:
+        return (ACK, socket, None)
+    if kind == 0x60:
+        return (ERROR, socket, packet[2] if len(packet) > 3 else None)
+    if kind == 0x50:
+        # Inquiry answers carry data; a command Completion carries none.
+        if len(packet) > 3:
+            return (ANSWER, socket, packet[2:-1])
+        return (COMPLETION, socket, None)
+    return None
+
+class ReplyReader(Thread):
+    '''
+    Reads the serial port of a visca.PTZ object and calls on_reply(packet) for every reply packet.
+    The port object is looked up on every read, since PTZ.reset_port() and PTZ.open() may replace it.
+    If given, on_error(exception) is called when reading fails although the port is open (e.g. unplugged).
+    '''
+
+    def __init__(self, cam, on_reply, on_error=None):
+        Thread.__init__(self, name='ReplyReader', daemon=True)
+        self.cam = cam
+        self.on_reply = on_reply
+        self.on_error = on_error
+        self.running = True
+        # Label of the port in the metrics
+        self.port = getattr(cam, 'serial_port', '')
+
+    def stop(self):
+        self.running = False
+        try:
+            # Unblock the pending read() call.
+            self.cam._output.cancel_read()
+        except Exception:
+            pass
+
+    def run(self):
+        buffer = bytearray()
+        while self.running:
+            port = self.cam._output
+            try:
+                data = port.read(1)
+                if port.in_waiting:
+                    data += port.read(port.in_waiting)
+            except Exception as e:
+                # Either the port is being closed or reopened, or it has failed.
+                if self.running and self.on_error is not None and port is self.cam._output and port.is_open:
+                    self.on_error(e)
+                if self.running:
+                    time.sleep(0.05)
+                continue
+
+            BYTES_READ.inc(self.port, amount=len(data))
+            buffer += data
+            while 0xFF in buffer:
+                end = buffer.index(0xFF) + 1
+                packet = bytes(buffer[:end])
+                del buffer[:end]
+                self.on_reply(packet)
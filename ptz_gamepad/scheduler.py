@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#
+# Fixed-rate control loop scheduler
+# Licensed under GPL-3.0
+# ---
+# By default the control loop runs once per burst of gamepad events, so its rate follows
+# whatever the gamepad reports. With a fixed rate (e.g. 60 Hz), the input-to-command step runs
+# on a grid of deadlines on the monotonic clock instead: the events that arrive in between are
+# applied together at the next deadline, so the rate of the step (and of the commands it may
+# queue) is known in advance. The serial I/O happens on the dispatcher threads, so it never
+# delays the loop. A step that overruns its period does not shift the grid: the deadlines it
+# has missed are skipped, instead of being run in a burst to catch up.
+# While the gamepad is idle the loop still sleeps until the next event, and the grid restarts there.
+# The wake-up jitter and the step durations are recorded in histograms, and in the metrics (see ptz_gamepad/metrics.py).
+
+from ptz_gamepad import metrics
+from ptz_gamepad.metrics import Histogram
+import time
+
+LOOP_JITTER = metrics.histogram('ptz_loop_jitter_seconds', 'How late the fixed-rate control loop woke up after its deadlines')
+LOOP_OVERRUNS = metrics.counter('ptz_loop_overruns_total', 'Fixed-rate control loop steps that ran longer than their period')
+LOOP_MISSED = metrics.counter('ptz_loop_missed_deadlines_total', 'Deadlines of the fixed-rate control loop skipped after an overrun')
+
+class FixedRateScheduler(object):
+    '''
+    Paces a loop at "rate" steps per second on the monotonic clock.
+    Call wait() before every step; it returns once the next deadline has come.
+    A loop that should sleep while its input is idle calls ready() instead (see InputEngine.tick()).
+    '''
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError('The rate of the control loop must be positive')
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = None
+        # When the current step has started, to measure its duration
+        self.started = None
+
+        self.jitter = Histogram()
+        self.durations = Histogram()
+        self.steps = 0
+        self.overruns = 0
+        self.missed = 0
+
+    def _finish(self, now):
+        ''' Record the duration of the step that is ending. '''
+        if self.started is not None:
+            duration = now - self.started
+            self.durations.add(duration)
+            if duration > self.period:
+                self.overruns += 1
+                LOOP_OVERRUNS.inc()
+            self.started = None
+
+    def restart(self):
+        ''' Start the grid of deadlines over, now (e.g. after the loop has slept until an event). Counts as a step. '''
+        now = self.clock()
+        self._finish(now)
+        self.deadline = now + self.period
+        self._start(now)
+
+    def _start(self, now):
+        self.started = now
+        self.steps += 1
+
+    def _sleep(self):
+        ''' End the current step and sleep until the next deadline. Returns how late the wake-up was (in second). '''
+        now = self.clock()
+        self._finish(now)
+        if self.deadline is None:
+            self.deadline = now
+
+        # Skip the deadlines the last step has run past, keeping the grid in phase.
+        if now > self.deadline + self.period:
+            behind = int((now - self.deadline) / self.period)
+            self.missed += behind
+            LOOP_MISSED.inc(amount=behind)
+            self.deadline += behind * self.period
+
+        if self.deadline > now:
+            self.sleep(self.deadline - now)
+        now = self.clock()
+        late = max(0.0, now - self.deadline)
+        self.jitter.add(late)
+        LOOP_JITTER.observe(late)
+        self.deadline += self.period
+        return late
+
+    def wait(self):
+        ''' Sleep until the next deadline, and start a step. Returns how late the wake-up was (in second). '''
+        late = self._sleep()
+        self._start(self.clock())
+        return late
+
+    def ready(self, poll):
+        '''
+        Sleep until the next deadline, then call poll() for the input that has arrived meanwhile.
+        If there is some (poll() returns something true), start a step and return it.
+        Otherwise the input has been idle for a whole period: return None, and the caller should
+        sleep until the next input and call restart(), instead of waking up at every deadline.
+        '''
+        if self.deadline is not None:
+            self._sleep()
+            polled = poll()
+            if polled:
+                self._start(self.clock())
+                return polled
+        return None
+
+    def wait_for(self, changed):
+        '''
+        Wait for the next step of a loop driven by a threading.Event set on every input change
+        (see ready()), and clear the event.
+        '''
+        if not self.ready(changed.is_set):
+            changed.wait()
+            self.restart()
+        changed.clear()
+
+    def summary(self):
+        return {
+            'rate': self.rate,
+            'steps': self.steps,
+            'overruns': self.overruns,
+            'missed_deadlines': self.missed,
+            'jitter_s': self.jitter.summary(),
+            'step_duration_s': self.durations.summary(),
+        }
+
+    def __str__(self):
+        p50 = self.jitter.percentile(50)
+        p99 = self.jitter.percentile(99)
+        text = f'{self.rate:g} Hz, {self.steps} steps, {self.overruns} overruns, {self.missed} missed deadlines'
+        if p50 is not None:
+            text += f', wake-up jitter p50 <= {p50 * 1000:g} ms, p99 <= {p99 * 1000:g} ms'
+        return text
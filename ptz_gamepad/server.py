@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+#
+# Network control server
+# Licensed under GPL-3.0
+# ---
+# Only one process can hold a serial port, so the process that drives the cameras also
+# serves them to the other tools (a stream deck, a web panel, automation scripts) on a
+# local TCP port. A client sends one JSON object per line, and gets one JSON object per
+# line back ({"ok": true, ...} or {"ok": false, "error": "..."}):
+#   {"op": "hello", "name": "streamdeck", "priority": 5}
+#   {"op": "pan_tilt", "camera": 1, "pan": ["left", 5], "tilt": null}
+#   {"op": "update", "camera": 2, "slot": "zoom", "command": ["zoom_in", 3]}
+#   {"op": "move_to", "camera": 1, "pan": 0, "tilt": 0, "zoom": 4000, "speed": 12}
+#   {"op": "shot", "camera": 1, "name": "pulpit"}
+#   {"op": "stop", "camera": 1}
+#   {"op": "lock", "camera": 1}, {"op": "unlock", "camera": 1}
+#   {"op": "status", "camera": 1}, {"op": "cameras"}
+# The cameras are numbered from 1, in the order of the camera list ("all" drives every camera).
+# Pan is "left" or "right" (speed 1-24), tilt "up" or "down" (speed 1-20). The "update" slots are
+# "zoom" (zoom_in or zoom_out at speed 1-7, zoom_stop) and "focus" (focus_near or focus_far at
+# speed 1-7, focus_stop); a null command releases the slot without sending anything.
+# The commands of every client go through the same CameraState (and so the same coalescing
+# keys and dispatcher queues) as the gamepad's: a client repeating what is already being done
+# sends nothing, and a newer command replaces a pending one of the same slot.
+# ---
+# Arbitration, per camera: a locked camera only takes the commands of the client holding
+# the lock (a client of higher priority may take the lock over), and an unlocked camera
+# ignores the clients of lower priority for CONTENTION_WINDOW after a client of higher
+# priority has driven it. When a client goes away, its locks are released, and the
+# cameras it was the last to drive are stopped. The gamepad operator is not arbitrated:
+# it drives the cameras directly and always has the last word.
+#
+# Usage: python -m ptz_gamepad.server --port "COM7@1-2 udp://192.168.0.100" [--listen 5678]
+
+from ptz_gamepad import log
+from ptz_gamepad.packets import PAN_DIRECTIONS
+from ptz_gamepad.packets import TILT_DIRECTIONS
+from ptz_gamepad.speed import FOCUS_SPEED_MAX
+from ptz_gamepad.speed import PAN_SPEED_MAX
+from ptz_gamepad.speed import TILT_SPEED_MAX
+from ptz_gamepad.speed import ZOOM_SPEED_MAX
+from socketserver import StreamRequestHandler
+from socketserver import ThreadingTCPServer
+from threading import Lock
+from threading import Thread
+import argparse
+import json
+import time
+
+# Default TCP port of the server
+CONTROL_PORT = 5678
+# How long a client of higher priority keeps the lower ones off a camera it drives (in second)
+CONTENTION_WINDOW = 1.0
+# Longest request line (in bytes)
+MAX_LINE = 65536
+# The slots an "update" request may set, and their commands: name -> max speed, or None if it takes no speed
+UPDATE_SLOTS = {
+    'zoom': {'zoom_in': ZOOM_SPEED_MAX, 'zoom_out': ZOOM_SPEED_MAX, 'zoom_stop': None},
+    'focus': {'focus_near': FOCUS_SPEED_MAX, 'focus_far': FOCUS_SPEED_MAX, 'focus_stop': None},
+}
+
+class ClientError(Exception):
+    ''' A request that cannot be served; its message is sent back to the client. '''
+
+class Client(object):
+    ''' One connection: its name and priority (see the "hello" request). '''
+
+    def __init__(self, address):
+        self.name = f'{address[0]}:{address[1]}'
+        self.priority = 0
+
+    def __str__(self):
+        return self.name
+
+class Arbiter(object):
+    ''' Which client may drive one camera. Only used under the server's lock. '''
+
+    def __init__(self):
+        self.holder = None
+        self.last = None
+        self.last_time = 0.0
+
+    def allow(self, client, now):
+        ''' Whether "client" may drive the camera now; if so, it becomes the last client to have driven it. '''
+        if self.holder is not None and self.holder is not client:
+            return False
+        last = self.last
+        if last is not None and last is not client and last.priority > client.priority and now - self.last_time < CONTENTION_WINDOW:
+            return False
+        self.last = client
+        self.last_time = now
+        return True
+
+    def lock(self, client):
+        if self.holder is None or self.holder is client or client.priority > self.holder.priority:
+            self.holder = client
+            return True
+        return False
+
+    def unlock(self, client):
+        if self.holder is client:
+            self.holder = None
+
+def _is_int(value):
+    # JSON true and false are ints to Python.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _speed(value, max_speed, what='speed'):
+    ''' A speed of a request, checked to be a number from 1 to max_speed. '''
+    if not _is_int(value) or not 1 <= value <= max_speed:
+        raise ClientError(f'"{what}" should be a number from 1 to {max_speed}, not {value!r}')
+    return value
+
+def _vector(value, axis, directions, max_speed):
+    ''' The pan or tilt of a request (["left", 5] or null) as a (direction, speed) tuple, or None. '''
+    if value is None:
+        return None
+    if not (isinstance(value, list) and len(value) == 2 and value[0] in directions):
+        raise ClientError(f'Invalid {axis} {value!r}: expected [{" or ".join(map(repr, directions))}, speed] or null')
+    return (value[0], _speed(value[1], max_speed, f'{axis} speed'))
+
+def _command(slot, value):
+    ''' The command of an "update" request (["name", speed], ["name"] or null) as a tuple, or None. '''
+    commands = UPDATE_SLOTS[slot]
+    if value is None:
+        return None
+    if not (isinstance(value, list) and value and value[0] in commands):
+        raise ClientError(f'Invalid {slot} command {value!r}: expected one of {", ".join(commands)}, or null')
+    name = value[0]
+    if commands[name] is None:
+        if len(value) != 1:
+            raise ClientError(f'{name} takes no speed')
+        return (name,)
+    if len(value) != 2:
+        raise ClientError(f'{name} takes a speed, e.g. ["{name}", 3]')
+    return (name, _speed(value[1], commands[name]))
+
+class ControlServer(ThreadingTCPServer):
+    '''
+    Serves the cameras of a CameraRig to the clients of a local TCP port, from background threads.
+    Call start() to serve, and close() to stop.
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, rig, port=CONTROL_PORT, host='127.0.0.1'):
+        ThreadingTCPServer.__init__(self, (host, port), _Handler)
+        self.rig = rig
+        self.arbiters = [Arbiter() for target in rig.targets]
+        self.lock = Lock()
+        self.ops = {
+            'hello': self._hello,
+            'cameras': self._cameras,
+            'status': self._status,
+            'pan_tilt': self._pan_tilt,
+            'update': self._update,
+            'move_to': self._move_to,
+            'shot': self._shot,
+            'stop': self._stop,
+            'lock': self._lock,
+            'unlock': self._unlock,
+        }
+
+    def start(self):
+        Thread(target=self.serve_forever, name='ControlServer', daemon=True).start()
+        log.info('Serving the cameras on %s:%s', *self.server_address[:2])
+        return self
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+    def _cameras_of(self, request):
+        ''' The indexes of the cameras a request is about. '''
+        camera = request.get('camera')
+        if camera == 'all':
+            return list(range(len(self.rig.targets)))
+        if not _is_int(camera) or not 1 <= camera <= len(self.rig.targets):
+            raise ClientError(f'"camera" should be a number from 1 to {len(self.rig.targets)}, or "all"')
+        return [camera - 1]
+
+    def _drive(self, client, request, apply):
+        ''' Call apply(state) for the CameraState of every camera of the request the client may drive. '''
+        indexes = self._cameras_of(request)
+        now = time.monotonic()
+        with self.lock:
+            allowed = [i for i in indexes if self.arbiters[i].allow(client, now)]
+        if not allowed:
+            raise ClientError('The camera is driven by another client')
+        sent = False
+        for i in allowed:
+            sent = apply(self.rig.states[i]) or sent
+        if log.tracing:
+            log.trace('%s: %s', str(client), request.get('op'), cameras=[i + 1 for i in allowed])
+        return {'sent': bool(sent), 'refused': [i + 1 for i in indexes if i not in allowed]}
+
+    def serve_request(self, client, request):
+        ''' Serve one request. Returns the reply object. '''
+        if not isinstance(request, dict):
+            raise ClientError('A request should be a JSON object')
+        op = self.ops.get(request.get('op'))
+        if op is None:
+            raise ClientError(f'Unknown op {request.get("op")!r}, expected one of: {", ".join(self.ops)}')
+        reply = op(client, request) or {}
+        reply['ok'] = True
+        return reply
+
+    def disconnect(self, client):
+        ''' Release the locks of a client that has gone away, and stop the cameras it was driving. '''
+        with self.lock:
+            stopped = []
+            for i, arbiter in enumerate(self.arbiters):
+                arbiter.unlock(client)
+                if arbiter.last is client:
+                    arbiter.last = None
+                    stopped.append(i)
+        for i in stopped:
+            self.rig.states[i].stop_motion()
+
+    def _hello(self, client, request):
+        name = request.get('name')
+        priority = request.get('priority', 0)
+        if not _is_int(priority):
+            raise ClientError('"priority" should be an integer')
+        if name is not None:
+            client.name = str(name)
+        client.priority = priority
+        return {'cameras': len(self.rig.targets)}
+
+    def _cameras(self, client, request):
+        return {'cameras': [str(target) for target in self.rig.targets]}
+
+    def _status(self, client, request):
+        status = {}
+        for i in self._cameras_of(request):
+            cache = self.rig.statuses[i]
+            status[i + 1] = {field: value for field, (value, stamp) in list(cache.fields.items())}
+            status[i + 1]['age'] = {field: round(cache.age(field), 3) for field in list(cache.fields)}
+        return {'status': status}
+
+    def _pan_tilt(self, client, request):
+        pan = _vector(request.get('pan'), 'pan', tuple(PAN_DIRECTIONS), PAN_SPEED_MAX)
+        tilt = _vector(request.get('tilt'), 'tilt', tuple(TILT_DIRECTIONS), TILT_SPEED_MAX)
+        return self._drive(client, request, lambda state: state.pan_tilt(pan, tilt))
+
+    def _update(self, client, request):
+        slot = request.get('slot')
+        if slot not in UPDATE_SLOTS:
+            raise ClientError(f'"slot" should be one of: {", ".join(UPDATE_SLOTS)}')
+        command = _command(slot, request.get('command'))
+        return self._drive(client, request, lambda state: state.update(slot, command))
+
+    def _move_to(self, client, request):
+        pan, tilt, zoom, focus = (request.get(key) for key in ('pan', 'tilt', 'zoom', 'focus'))
+        if not (_is_int(pan) and _is_int(tilt) and all(value is None or _is_int(value) for value in (zoom, focus))):
+            raise ClientError('move_to needs a numeric "pan" and "tilt", and optionally "zoom", "focus" and "speed"')
+        speed = request.get('speed')
+        if speed is not None:
+            _speed(speed, PAN_SPEED_MAX)
+        return self._drive(client, request, lambda state: state.move_to(pan, tilt, zoom, focus, speed) or True)
+
+    def _shot(self, client, request):
+        name = request.get('name')
+        if not isinstance(name, str) or name not in self.rig.presets:
+            raise ClientError(f'No shot named {name!r}')
+        speed = request.get('speed')
+        if speed is not None:
+            _speed(speed, PAN_SPEED_MAX)
+        return self._drive(client, request, lambda state: self.rig.presets.recall(name, state, speed) is not None)
+
+    def _stop(self, client, request):
+        return self._drive(client, request, lambda state: state.stop_motion() or True)
+
+    def _lock(self, client, request):
+        indexes = self._cameras_of(request)
+        with self.lock:
+            refused = [i + 1 for i in indexes if not self.arbiters[i].lock(client)]
+        if refused:
+            raise ClientError(f'Camera(s) {", ".join(map(str, refused))} locked by another client')
+        return {}
+
+    def _unlock(self, client, request):
+        indexes = self._cameras_of(request)
+        with self.lock:
+            for i in indexes:
+                self.arbiters[i].unlock(client)
+        return {}
+
+class _Handler(StreamRequestHandler):
+
+    def handle(self):
+        server = self.server
+        client = Client(self.client_address)
+        log.info('Client %s connected', str(client))
+        try:
+            while True:
+                line = self.rfile.readline(MAX_LINE)
+                if not line:
+                    return
+                if not line.strip():
+                    continue
+                try:
+                    reply = server.serve_request(client, json.loads(line))
+                except ValueError as e:
+                    reply = {'ok': False, 'error': f'Invalid JSON: {e}'}
+                except ClientError as e:
+                    reply = {'ok': False, 'error': str(e)}
+                except Exception as e:
+                    # A bug must not cost the client its connection (nor its locks).
+                    log.error('Could not serve %s the request %s: %r', str(client), line[:200].decode('utf-8', 'replace').strip(), e)
+                    reply = {'ok': False, 'error': f'Internal error: {e!r}'}
+                self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+        except OSError:
+            pass
+        finally:
+            server.disconnect(client)
+            log.info('Client %s disconnected', str(client))
+
+def main():
+    from ptz_gamepad.cameras import CameraRig
+
+    parser = argparse.ArgumentParser(description='Serve the cameras to network clients, without a gamepad.')
+    parser.add_argument('--port', required=True, help='Camera list, e.g. "COM7", "COM7@1-3 COM8" or "udp://192.168.0.100"')
+    parser.add_argument('--listen', type=int, default=CONTROL_PORT, help=f'TCP port to serve on (default: {CONTROL_PORT})')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to serve on (default: 127.0.0.1, this machine only)')
+    args = parser.parse_args()
+
+    rig = CameraRig(args.port).start()
+    server = ControlServer(rig, args.listen, args.host).start()
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        rig.close()
+
+if __name__ == '__main__':
+    main()
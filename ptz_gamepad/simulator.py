@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+#
+# Pseudo-terminal VISCA camera simulator
+# Licensed under GPL-3.0
+# ---
+# Opens a pseudo-terminal and answers VISCA commands and inquiries on it like a real
+# camera would: ACK and Completion replies with realistic delays, two command sockets
+# ("command buffer full" when both are busy), the byte rate of the serial link,
+# and pan/tilt/zoom/focus positions that move over time.
+# Point any controller script at the printed port (e.g. /dev/pts/3) to run it without a camera.
+# (POSIX only, since it relies on the pty module.)
+# With --udp, the camera is served as a VISCA over IP camera on a local UDP port instead
+# (on any OS), optionally losing and reordering some of its replies.
+#
+# Usage: python -m ptz_gamepad.simulator [--baud 9600] [--power-on-delay 2]
+#        python -m ptz_gamepad.simulator --udp [--loss 0.05] [--reorder 0.1]
+
+from collections import OrderedDict
+from ptz_gamepad.viscaip import CONTROL_RESET
+from ptz_gamepad.viscaip import REPLY_HISTORY
+from ptz_gamepad.viscaip import TYPE_COMMAND
+from ptz_gamepad.viscaip import TYPE_CONTROL
+from ptz_gamepad.viscaip import TYPE_CONTROL_REPLY
+from ptz_gamepad.viscaip import TYPE_INQUIRY
+from ptz_gamepad.viscaip import TYPE_REPLY
+from ptz_gamepad.viscaip import pack
+from ptz_gamepad.viscaip import unpack
+from threading import Lock
+from threading import Thread
+import argparse
+import heapq
+import os
+import random
+import select
+import socket
+import time
+
+# Position ranges of a typical Sony VISCA head
+PAN_MIN, PAN_MAX = -2448, 2448
+TILT_MIN, TILT_MAX = -432, 1296
+ZOOM_MIN, ZOOM_MAX = 0, 0x4000
+FOCUS_MIN, FOCUS_MAX = 0x1000, 0xC000
+
+# Position units per second, per speed step
+PAN_RATE = 100
+TILT_RATE = 100
+ZOOM_RATE = 600
+FOCUS_RATE = 1500
+
+# Processing delays of the camera (in second)
+ACK_DELAY = 0.002
+COMPLETION_DELAY = 0.010
+
+# How much later a reordered UDP reply is sent (in second)
+REORDER_DELAY = 0.02
+
+# Answer to the version inquiry: vendor (Sony), model, ROM version
+VENDOR_ID = 0x0020
+MODEL_ID = 0x0519
+ROM_VERSION = 0x0100
+
+def _nibbles(value, count=4):
+    ''' Encode a 16-bit value as "count" VISCA nibble bytes (0p 0q 0r 0s). '''
+    value &= 0xFFFF
+    return bytes((value >> (4 * i)) & 0x0F for i in reversed(range(count)))
+
+def _from_nibbles(data):
+    ''' Decode VISCA nibble bytes into a signed 16-bit value. '''
+    value = 0
+    for b in data:
+        value = (value << 4) | (b & 0x0F)
+    return value - 0x10000 if value & 0x8000 else value
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+class _Axis(object):
+    ''' One moving axis: either driven at a constant velocity, or travelling to a target. '''
+
+    def __init__(self, low, high, position=0):
+        self.low = low
+        self.high = high
+        self.position = position
+        self.velocity = 0.0
+        self.target = None
+
+    def update(self, dt):
+        if self.target is not None:
+            step = abs(self.velocity) * dt
+            if abs(self.target - self.position) <= step:
+                self.position = self.target
+                self.target = None
+                self.velocity = 0.0
+            else:
+                self.position += step if self.target > self.position else -step
+        elif self.velocity:
+            self.position = _clamp(self.position + self.velocity * dt, self.low, self.high)
+
+    def move_to(self, target, rate):
+        ''' Start travelling to "target" at "rate" units/s. Returns the travel time. '''
+        self.target = _clamp(target, self.low, self.high)
+        self.velocity = rate
+        return abs(self.target - self.position) / rate if rate else 0.0
+
+class SimulatedCamera(object):
+    ''' State and VISCA command handling of a single simulated camera. '''
+
+    def __init__(self, address=1, power=1, power_on_delay=2.0):
+        self.address = address
+        self.power = power
+        self.power_on_delay = power_on_delay
+        self.booting_until = 0.0
+
+        self.pan = _Axis(PAN_MIN, PAN_MAX)
+        self.tilt = _Axis(TILT_MIN, TILT_MAX)
+        self.zoom = _Axis(ZOOM_MIN, ZOOM_MAX)
+        self.focus = _Axis(FOCUS_MIN, FOCUS_MAX, FOCUS_MIN)
+        self.presets = {}
+        self.exposure_mode = 0x00
+        self.updated = time.monotonic()
+
+        # Socket number -> time at which its command completes
+        self.sockets = {}
+
+    def update(self, now):
+        dt = now - self.updated
+        self.updated = now
+        for axis in (self.pan, self.tilt, self.zoom, self.focus):
+            axis.update(dt)
+        for socket, done in list(self.sockets.items()):
+            if done <= now:
+                del self.sockets[socket]
+
+    def handle(self, packet, now):
+        '''
+        Handle one VISCA packet addressed to this camera, received at "now".
+        Returns a list of (time, reply bytes).
+        '''
+        self.update(now)
+        y = (8 + self.address) << 4
+
+        # A booting camera does not answer anything.
+        if now < self.booting_until:
+            return []
+
+        if len(packet) >= 4 and packet[1] == 0x09:
+            answer = self._inquiry(packet[2:-1])
+            if answer is None:
+                return [(now + ACK_DELAY, bytes([y, 0x60, 0x02, 0xFF]))]
+            return [(now + ACK_DELAY, bytes([y, 0x50]) + answer + b'\xff')]
+
+        if len(packet) >= 4 and packet[1] == 0x01:
+            # IF_Clear is executed at once, without a socket.
+            if packet[2:4] == b'\x00\x01':
+                return [(now + ACK_DELAY, bytes([y, 0x50, 0xFF]))]
+
+            free = [s for s in (1, 2) if s not in self.sockets]
+            if not free:
+                return [(now + ACK_DELAY, bytes([y, 0x60, 0x03, 0xFF]))]
+
+            duration = self._command(packet[2:-1], now)
+            if duration is None:
+                return [(now + ACK_DELAY, bytes([y, 0x60, 0x02, 0xFF]))]
+            if duration is False:
+                return [(now + ACK_DELAY, bytes([y, 0x60, 0x41, 0xFF]))]
+
+            socket = free[0]
+            done = now + ACK_DELAY + duration
+            self.sockets[socket] = done
+            return [
+                (now + ACK_DELAY, bytes([y, 0x40 | socket, 0xFF])),
+                (done, bytes([y, 0x50 | socket, 0xFF])),
+            ]
+
+        return [(now + ACK_DELAY, bytes([y, 0x60, 0x02, 0xFF]))]
+
+    def _command(self, body, now):
+        '''
+        Execute a command body (the bytes after 8x 01).
+        Returns how long it takes to complete, None for a syntax error,
+        or False if it cannot be executed right now.
+        '''
+        # Power on/off is the only command a camera in standby takes.
+        if body[:2] == b'\x04\x00' and len(body) == 3:
+            if body[2] == 0x02 and not self.power:
+                self.power = 1
+                self.booting_until = now + self.power_on_delay
+            elif body[2] == 0x03:
+                self.power = 0
+                for axis in (self.pan, self.tilt, self.zoom, self.focus):
+                    axis.velocity = 0.0
+                    axis.target = None
+            return COMPLETION_DELAY
+
+        if not self.power:
+            return False
+
+        # Pan-tiltDrive: 06 01 VV WW XX YY
+        if body[:2] == b'\x06\x01' and len(body) == 6:
+            vv, ww, xx, yy = body[2:]
+            self.pan.target = self.tilt.target = None
+            self.pan.velocity = {1: -1, 2: 1}.get(xx, 0) * vv * PAN_RATE
+            self.tilt.velocity = {1: 1, 2: -1}.get(yy, 0) * ww * TILT_RATE
+            return 0.0
+
+        # Absolute and relative position: 06 02/03 VV WW 0Y0Y0Y0Y 0Z0Z0Z0Z
+        if body[:1] == b'\x06' and body[1:2] in (b'\x02', b'\x03') and len(body) == 12:
+            pan = _from_nibbles(body[4:8])
+            tilt = _from_nibbles(body[8:12])
+            if body[1] == 0x03:
+                pan += round(self.pan.position)
+                tilt += round(self.tilt.position)
+            return max(self.pan.move_to(pan, max(1, body[2]) * PAN_RATE),
+                       self.tilt.move_to(tilt, max(1, body[3]) * TILT_RATE))
+
+        # Home and reset
+        if body == b'\x06\x04' or body == b'\x06\x05':
+            return max(self.pan.move_to(0, 24 * PAN_RATE), self.tilt.move_to(0, 20 * TILT_RATE))
+
+        # Zoom: 04 07 00/02/03/2p/3p, direct: 04 47 0p0q0r0s
+        if body[:2] == b'\x04\x07' and len(body) == 3:
+            self.zoom.target = None
+            self.zoom.velocity = self._variable(body[2], ZOOM_RATE)
+            return 0.0
+        if body[:2] == b'\x04\x47' and len(body) == 6:
+            return self.zoom.move_to(_from_nibbles(body[2:6]) & 0xFFFF, 8 * ZOOM_RATE)
+
+        # Focus: 04 08 00/02/03/2p/3p, direct: 04 48 0p0q0r0s
+        if body[:2] == b'\x04\x08' and len(body) == 3:
+            self.focus.target = None
+            self.focus.velocity = self._variable(body[2], FOCUS_RATE)
+            return 0.0
+        if body[:2] == b'\x04\x48' and len(body) == 6:
+            return self.focus.move_to(_from_nibbles(body[2:6]) & 0xFFFF, 8 * FOCUS_RATE)
+
+        # Presets: 04 3F 00/01/02 pp
+        if body[:2] == b'\x04\x3f' and len(body) == 4:
+            mode, num = body[2], body[3]
+            if mode == 0x00:
+                self.presets.pop(num, None)
+            elif mode == 0x01:
+                self.presets[num] = (round(self.pan.position), round(self.tilt.position), round(self.zoom.position))
+            elif mode == 0x02:
+                pan, tilt, zoom = self.presets.get(num, (0, 0, 0))
+                return max(self.pan.move_to(pan, 24 * PAN_RATE),
+                           self.tilt.move_to(tilt, 20 * TILT_RATE),
+                           self.zoom.move_to(zoom, 8 * ZOOM_RATE))
+            return COMPLETION_DELAY
+
+        # Exposure mode: 04 39 pp
+        if body[:2] == b'\x04\x39' and len(body) == 3:
+            self.exposure_mode = body[2]
+            return COMPLETION_DELAY
+
+        # Any other camera setting (iris, gain, white balance, ...) is accepted as-is.
+        if body[:1] == b'\x04' and len(body) >= 2:
+            return COMPLETION_DELAY
+
+        return None
+
+    def _variable(self, code, rate):
+        ''' Velocity of a zoom/focus command byte (00 stop, 02/03 standard, 2p/3p variable). '''
+        if code == 0x02:
+            return 4 * rate
+        if code == 0x03:
+            return -4 * rate
+        if code & 0xF0 == 0x20:
+            return ((code & 0x0F) + 1) * rate
+        if code & 0xF0 == 0x30:
+            return -((code & 0x0F) + 1) * rate
+        return 0.0
+
+    def _inquiry(self, body):
+        ''' Answer data of an inquiry body (the bytes after 8x 09), or None if unknown. '''
+        if body == b'\x04\x00':
+            return bytes([0x02 if self.power else 0x03])
+        if body == b'\x00\x02':
+            return (VENDOR_ID.to_bytes(2, 'big') + MODEL_ID.to_bytes(2, 'big')
+                    + ROM_VERSION.to_bytes(2, 'big') + bytes([0x02]))
+        if body == b'\x06\x12':
+            return _nibbles(round(self.pan.position)) + _nibbles(round(self.tilt.position))
+        if body == b'\x04\x47':
+            return _nibbles(round(self.zoom.position))
+        if body == b'\x04\x48':
+            return _nibbles(round(self.focus.position))
+        if body == b'\x04\x39':
+            return bytes([self.exposure_mode])
+        return None
+
+class ViscaSimulator(Thread):
+    '''
+    Serves one or more SimulatedCamera objects on a pseudo-terminal.
+    The serial link's byte rate (8N1 at "baudrate") applies to both directions.
+    After start(), open the port named by the "port" attribute like any serial port.
+    '''
+
+    def __init__(self, cameras=None, baudrate=9600):
+        Thread.__init__(self, name='ViscaSimulator', daemon=True)
+        import pty
+        import tty
+
+        self.cameras = cameras or [SimulatedCamera()]
+        self.byte_time = 10.0 / baudrate
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.lock = Lock()
+
+        # Counters, for benchmarks and tests.
+        # "received" lists (arrival time of the first byte, packet) of every packet.
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.packets_received = 0
+        self.errors_sent = 0
+        self.received = []
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        buffer = bytearray()
+        replies = []
+        rx_free = 0.0  # When the incoming line is done transmitting what has been read
+        tx_free = 0.0  # When the outgoing line is free again
+        order = 0
+
+        while self.running:
+            now = time.monotonic()
+            timeout = 0.05 if not replies else max(0.0, min(0.05, replies[0][0] - now))
+            readable, _, _ = select.select([self.master], [], [], timeout)
+            now = time.monotonic()
+
+            if readable:
+                data = os.read(self.master, 1024)
+                for b in data:
+                    # Every byte takes its time on the wire.
+                    if not buffer:
+                        first_byte = max(rx_free, now)
+                    rx_free = max(rx_free, now) + self.byte_time
+                    buffer.append(b)
+                    if b != 0xFF:
+                        continue
+
+                    packet = bytes(buffer)
+                    buffer.clear()
+                    with self.lock:
+                        self.bytes_received += len(packet)
+                        self.packets_received += 1
+                        self.received.append((first_byte, packet))
+                    for reply_time, reply in self._dispatch(packet, rx_free):
+                        order += 1
+                        heapq.heappush(replies, (reply_time, order, reply))
+
+            # Send the replies that are due, one after another on the line.
+            now = time.monotonic()
+            while replies and replies[0][0] <= now:
+                _, _, reply = heapq.heappop(replies)
+                tx_free = max(tx_free, now) + len(reply) * self.byte_time
+                delay = tx_free - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                os.write(self.master, reply)
+                with self.lock:
+                    self.bytes_sent += len(reply)
+                    if reply[1] & 0xF0 == 0x60:
+                        self.errors_sent += 1
+
+    def _dispatch(self, packet, now):
+        ''' Hand a packet over to the addressed camera(s). '''
+        if len(packet) < 3 or packet[0] & 0xF0 != 0x80:
+            return []
+
+        # Address Set (88 30 0p FF): number the cameras along the chain.
+        if packet[0] == 0x88 and packet[1] == 0x30:
+            for i, camera in enumerate(self.cameras):
+                camera.address = packet[2] + i
+            return [(now + ACK_DELAY, bytes([0x88, 0x30, packet[2] + len(self.cameras), 0xFF]))]
+
+        replies = []
+        for camera in self.cameras:
+            if packet[0] == 0x88 or packet[0] & 0x0F == camera.address:
+                replies += camera.handle(packet, now)
+        return replies
+
+class UdpViscaSimulator(Thread):
+    '''
+    Serves a SimulatedCamera as a VISCA over IP camera on a local UDP port.
+    Each reply is dropped with the probability "loss", and sent REORDER_DELAY later
+    (after the replies that follow it) with the probability "reorder".
+    A message received again (a retransmission) is answered again, but executed once.
+    After start(), give the "port" attribute (udp://127.0.0.1:NNNNN) as the port of a camera.
+    '''
+
+    def __init__(self, camera=None, host='127.0.0.1', port=0, loss=0.0, reorder=0.0, seed=None):
+        Thread.__init__(self, name='UdpViscaSimulator', daemon=True)
+        self.camera = camera or SimulatedCamera()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.port = f'udp://{host}:{self.socket.getsockname()[1]}'
+        self.loss = loss
+        self.reorder = reorder
+        self.random = random.Random(seed)
+        self.running = True
+        self.lock = Lock()
+        # Sequence number -> the replies sent to its message, for the retransmissions
+        self.answered = OrderedDict()
+
+        # Counters, as in ViscaSimulator
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.packets_received = 0
+        self.errors_sent = 0
+        self.duplicates = 0
+        self.received = []
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        replies = []
+        order = 0
+        try:
+            while self.running:
+                now = time.monotonic()
+                timeout = 0.05 if not replies else max(0.0, min(0.05, replies[0][0] - now))
+                readable, _, _ = select.select([self.socket], [], [], timeout)
+                now = time.monotonic()
+
+                if readable:
+                    message, client = self.socket.recvfrom(2048)
+                    for reply_time, reply in self._handle(message, now):
+                        order += 1
+                        heapq.heappush(replies, (reply_time, order, reply, client))
+
+                now = time.monotonic()
+                while replies and replies[0][0] <= now:
+                    _, _, reply, client = heapq.heappop(replies)
+                    self.socket.sendto(reply, client)
+                    with self.lock:
+                        self.bytes_sent += len(reply)
+        finally:
+            self.socket.close()
+
+    def _handle(self, message, now):
+        ''' Answer one message. Returns a list of (time, reply message). '''
+        unpacked = unpack(message)
+        if unpacked is None:
+            return []
+        kind, sequence, payload = unpacked
+
+        if kind == TYPE_CONTROL:
+            if payload == CONTROL_RESET:
+                self.answered.clear()
+            return [(now, pack(TYPE_CONTROL_REPLY, CONTROL_RESET, sequence))]
+        if kind not in (TYPE_COMMAND, TYPE_INQUIRY) or len(payload) < 3:
+            return []
+
+        if sequence in self.answered:
+            with self.lock:
+                self.duplicates += 1
+            return [(now + ACK_DELAY, reply) for reply in self.answered[sequence]]
+
+        with self.lock:
+            self.bytes_received += len(payload)
+            self.packets_received += 1
+            self.received.append((now, payload))
+
+        answers = []
+        if payload[0] == 0x88 or payload[0] & 0x0F == self.camera.address:
+            answers = self.camera.handle(payload, now)
+        sent = self.answered[sequence] = []
+        if len(self.answered) > REPLY_HISTORY:
+            self.answered.popitem(last=False)
+
+        replies = []
+        for reply_time, reply in answers:
+            reply = pack(TYPE_REPLY, reply, sequence)
+            sent.append(reply)
+            if reply[9] & 0xF0 == 0x60:
+                with self.lock:
+                    self.errors_sent += 1
+            if self.random.random() < self.loss:
+                continue
+            if self.random.random() < self.reorder:
+                reply_time += REORDER_DELAY
+            replies.append((reply_time, reply))
+        return replies
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated VISCA camera on a pseudo-terminal, or over IP.')
+    parser.add_argument('--baud', type=int, default=9600, help='Simulated serial byte rate (default: 9600)')
+    parser.add_argument('--cameras', type=int, default=1, help='Number of cameras on the daisy chain (default: 1)')
+    parser.add_argument('--power-on-delay', type=float, default=2.0, help='Boot time after power on, in second (default: 2)')
+    parser.add_argument('--standby', action='store_true', help='Start the cameras in standby mode')
+    parser.add_argument('--udp', type=int, nargs='?', const=0, metavar='PORT', help='Serve a VISCA over IP camera on this local UDP port instead (default: any free port)')
+    parser.add_argument('--loss', type=float, default=0.0, help='With --udp, probability of dropping a reply (default: 0)')
+    parser.add_argument('--reorder', type=float, default=0.0, help='With --udp, probability of delaying a reply past the next ones (default: 0)')
+    args = parser.parse_args()
+
+    cameras = [
+        SimulatedCamera(address=i + 1, power=0 if args.standby else 1, power_on_delay=args.power_on_delay)
+        for i in range(args.cameras)
+    ]
+    if args.udp is not None:
+        if len(cameras) > 1:
+            parser.error('A VISCA over IP camera is alone on its UDP port')
+        simulator = UdpViscaSimulator(cameras[0], port=args.udp, loss=args.loss, reorder=args.reorder)
+    else:
+        simulator = ViscaSimulator(cameras, baudrate=args.baud)
+    simulator.start()
+    print(f'Simulated VISCA camera(s) listening on: {simulator.port}')
+    print('Press Ctrl+C to stop.')
+
+    try:
+        while simulator.is_alive():
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# Proportional stick speed, quantized onto the VISCA speed steps
+# Licensed under GPL-3.0
+# ---
+# The camera only knows a handful of discrete speeds, so there is no point
+# in sending a new command for every tiny wobble of the stick. The quantizer
+# maps the deflection onto those steps and holds on to the current step
+# until the stick has clearly moved into a neighbouring one.
+
+import math
+
+# Speed ranges of the VISCA Pan-tiltDrive command (VV: 0x01-0x18, WW: 0x01-0x14)
+PAN_SPEED_MAX = 24
+TILT_SPEED_MAX = 20
+
+# Speed range of the variable zoom and focus commands, as accepted by pyvisca
+ZOOM_SPEED_MAX = 7
+FOCUS_SPEED_MAX = 7
+
+class SpeedQuantizer(object):
+    '''
+    Maps the absolute stick deflection (0 to 1) onto the speed steps 1 to "steps".
+    Step n covers the deflection ((n - 1) / steps, n / steps]. Once on a step, the
+    quantizer stays there until the deflection leaves that interval by more than
+    "hysteresis" (a fraction of one step) on either side.
+    '''
+
+    def __init__(self, steps, hysteresis=0.3):
+        self.steps = steps
+        self.hysteresis = hysteresis
+        self.step = 0
+
+    def __call__(self, val, max_speed=None):
+        '''
+        Returns the speed step for the axis value "val" (within -1 and 1), or 0 at rest.
+        If max_speed is given, the full deflection is mapped onto 1 to max_speed instead.
+        '''
+        steps = self.steps if max_speed is None else max(1, min(self.steps, int(max_speed)))
+        scaled = min(abs(val), 1.0) * steps
+
+        if scaled == 0:
+            self.step = 0
+            return 0
+
+        step = min(steps, max(1, math.ceil(scaled)))
+
+        # Hysteresis: keep the current step while the stick is only wobbling around its edges.
+        current = self.step
+        if 0 < current <= steps and current - 1 - self.hysteresis < scaled <= current + self.hysteresis:
+            step = current
+
+        self.step = step
+        return step
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# State-diff command engine
+# Licensed under GPL-3.0
+# ---
+# The controller scripts describe what the camera should be doing right now
+# (e.g. "pan left at speed 7", "zoom stopped", "preset 3 button held").
+# CameraState remembers what was last sent for every control slot and only queues
+# a VISCA command when the desired state is different, so a held stick or button
+# costs a single command instead of one every loop pass.
+
+from ptz_gamepad.packets import focus_direct
+from ptz_gamepad.packets import pan_tilt_absolute
+from ptz_gamepad.packets import pan_tilt_drive
+from ptz_gamepad.packets import zoom_direct
+from ptz_gamepad.speed import PAN_SPEED_MAX
+from ptz_gamepad.speed import TILT_SPEED_MAX
+from threading import RLock
+
+class CameraState(object):
+    ''' Keeps the last-sent command of every control slot of one camera. '''
+
+    def __init__(self, cam):
+        # The ViscaDispatcher of the camera. The slot names double as its coalescing keys.
+        self.cam = cam
+        self.sent = {}
+
+        # While the camera cannot take commands (e.g. it is booting), the latest
+        # desired state of every slot waits here, and is applied on release().
+        # The lock keeps a release() from another thread in order with the control loop's updates.
+        self.held = False
+        self.queued = {}
+        self.lock = RLock()
+
+    def update(self, slot, command):
+        '''
+        Make "command" the desired state of "slot".
+        The command is a tuple of (name, *args) of a visca.PTZ method,
+        or None when nothing has to be sent (e.g. a released button).
+        Returns True if a command has been queued.
+        '''
+        with self.lock:
+            if self.held and not (command is not None and command[0] == 'power'):
+                self.queued[slot] = (self.update, (slot, command))
+                return False
+
+            if self.sent.get(slot, ()) == command:
+                return False
+
+            if command is None:
+                self.sent[slot] = None
+                return False
+
+            self.cam.send(slot, *command)
+            self.sent[slot] = command
+            return True
+
+    def press(self, slot, pressed, command):
+        ''' Send the command once when the button becomes pressed, and re-arm it when released. '''
+        return self.update(slot, command if pressed else None)
+
+    def pan_tilt(self, pan, tilt):
+        '''
+        Set the desired pan-tilt vector.
+        Both "pan" and "tilt" are (name, speed) tuples, such as ('left', 5), or None when that axis is at rest.
+        The whole vector, diagonals and the stop included, goes out as a single Pan-tiltDrive packet.
+        Returns True if the packet has been queued.
+        '''
+        with self.lock:
+            if self.held:
+                self.queued['pan_tilt'] = (self.pan_tilt, (pan, tilt))
+                return False
+
+            vector = (pan, tilt)
+            if self.sent.get('pan_tilt', ()) == vector:
+                return False
+
+            # Only record the vector once its packet is built and queued: an invalid vector must not
+            # leave the state believing in a movement the camera never got.
+            packet = pan_tilt_drive(pan, tilt)
+            self.cam.send('pan_tilt', 'comm', packet)
+            self.sent['pan_tilt'] = vector
+            return True
+
+    def move_to(self, pan, tilt, zoom=None, focus=None, pan_speed=None, tilt_speed=None):
+        '''
+        Send the camera to absolute pan, tilt, zoom and focus positions (zoom and focus if not None),
+        at the given pan-tilt speeds (the fastest ones by default). Always sent, even if the last one was the same.
+        The commands share the coalescing keys of the continuous movements, so a stick moved
+        before they are sent replaces them; the continuous state itself is left as is.
+        '''
+        with self.lock:
+            if self.held:
+                self.queued['move_to'] = (self.move_to, (pan, tilt, zoom, focus, pan_speed, tilt_speed))
+                return
+
+            packet = pan_tilt_absolute(pan, tilt, pan_speed or PAN_SPEED_MAX, tilt_speed or TILT_SPEED_MAX)
+            self.cam.send('pan_tilt', 'comm', packet)
+            if zoom is not None:
+                self.cam.send('zoom', 'comm', zoom_direct(zoom))
+            if focus is not None:
+                self.cam.send('focus', 'comm', focus_direct(focus))
+
+    def hold(self):
+        ''' Stop sending commands (the power commands excepted), only remembering the latest desired state of each slot. '''
+        with self.lock:
+            self.held = True
+
+    def release(self):
+        ''' Send the desired state each slot has reached while held, and go back to normal. '''
+        with self.lock:
+            self.held = False
+            queued, self.queued = self.queued, {}
+            for apply, args in queued.values():
+                apply(*args)
+
+    def resend(self):
+        '''
+        Send the current pan-tilt, zoom and focus state again, stopped or not
+        (e.g. after the serial port has been reopened and the camera may have missed a stop).
+        '''
+        with self.lock:
+            vector = self.sent.pop('pan_tilt', None)
+            if vector is not None:
+                self.pan_tilt(*vector)
+            for slot in ('zoom', 'focus'):
+                command = self.sent.pop(slot, None)
+                if command is not None:
+                    self.update(slot, command)
+
+    def stop_motion(self):
+        '''
+        Stop the continuous movements (pan-tilt, zoom and focus) this state has started,
+        e.g. before the controller switches over to another camera.
+        '''
+        if self.sent.get('pan_tilt', (None, None)) != (None, None):
+            self.pan_tilt(None, None)
+        for slot in ('zoom', 'focus'):
+            if self.sent.get(slot, (f'{slot}_stop',)) != (f'{slot}_stop',):
+                self.update(slot, (f'{slot}_stop',))
+
+def drive(val, negative, positive, speed, rest=0.0):
+    '''
+    Pick the continuous movement command of a single stick axis.
+    Returns (negative, speed) or (positive, speed) depending on which side of the rest value
+    the stick is, or None if the stick is at rest or the speed rounds down to zero.
+    '''
+    speed = round(speed)
+    if val == rest or speed < 1:
+        return None
+    return (negative if val < rest else positive, speed)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# Background camera status cache
+# Licensed under GPL-3.0
+# ---
+# Asking a camera for its power state or its position costs a round-trip on the serial
+# line, during which the port (and so every camera of the chain) waits for the answer.
+# Instead of inquiring from the control loop, a StatusPoller per serial port keeps asking
+# its cameras for their power state, pan-tilt position, zoom and focus position and
+# exposure mode, with the dispatcher's low-priority inquiries (ViscaDispatcher.poll()),
+# which only go out in the idle gaps between the commands. The answers land in a
+# StatusCache per camera, along with the time they were received, so that the control
+# logic reads them at once and decides for itself how old a value may be.
+
+from concurrent.futures import CancelledError
+from ptz_gamepad.packets import EXPOSURE_MODE_INQ
+from ptz_gamepad.packets import FOCUS_POS_INQ
+from ptz_gamepad.packets import PAN_TILT_POS_INQ
+from ptz_gamepad.packets import POWER_INQ
+from ptz_gamepad.packets import ZOOM_POS_INQ
+from ptz_gamepad.packets import exposure_mode
+from ptz_gamepad.packets import lens_position
+from ptz_gamepad.packets import pan_tilt_position
+from ptz_gamepad.packets import power_state
+from threading import Event
+from threading import Thread
+import time
+
+# The cached fields: name, inquiry packet and decoder of the answer
+FIELDS = (
+    ('power', POWER_INQ, power_state),
+    ('pan_tilt', PAN_TILT_POS_INQ, pan_tilt_position),
+    ('zoom', ZOOM_POS_INQ, lens_position),
+    ('focus', FOCUS_POS_INQ, lens_position),
+    ('exposure', EXPOSURE_MODE_INQ, exposure_mode),
+)
+
+# Time between two rounds of inquiries of the cameras of a port (in second)
+POLL_INTERVAL = 0.5
+# How long to wait for one answer. It is kept short because the port waits with it.
+POLL_REPLY_TIMEOUT = 0.15
+# A camera that does not answer (e.g. while it boots) is left alone for this long
+SILENT_BACKOFF = 2.0
+
+class StatusCache(object):
+    '''
+    The latest known status of one camera.
+    Every field holds a (value, time) tuple, the time being the time.monotonic() the value was received at.
+    A tuple is only ever replaced as a whole, so the control loop may read it while the poller writes.
+    '''
+
+    def __init__(self):
+        self.fields = {}
+
+    def set(self, field, value, stamp=None):
+        self.fields[field] = (value, time.monotonic() if stamp is None else stamp)
+
+    def get(self, field, max_age=None, default=None):
+        '''
+        The value of "field", or "default" if it is unknown,
+        or older than "max_age" second (if given).
+        '''
+        reading = self.fields.get(field)
+        if reading is None or (max_age is not None and time.monotonic() - reading[1] > max_age):
+            return default
+        return reading[0]
+
+    def age(self, field):
+        ''' How long ago "field" was received (in second), or None if it is unknown. '''
+        reading = self.fields.get(field)
+        return None if reading is None else time.monotonic() - reading[1]
+
+    def clear(self):
+        self.fields.clear()
+
+class StatusPoller(Thread):
+    '''
+    Keeps the StatusCache of every camera of one serial port up to date.
+    "caches" maps the camera addresses of the port's ViscaDispatcher to their StatusCache.
+    '''
+
+    def __init__(self, dispatcher, caches, interval=POLL_INTERVAL, reply_timeout=POLL_REPLY_TIMEOUT):
+        Thread.__init__(self, name='StatusPoller', daemon=True)
+        self.dispatcher = dispatcher
+        self.caches = caches
+        self.interval = interval
+        self.reply_timeout = reply_timeout
+        self.silent = {}  # address -> time.monotonic() until which the camera is left alone
+        self._stopping = Event()
+
+    def _poll(self, address, cache):
+        ''' Inquire every field of one camera. Returns False if the camera does not answer. '''
+        for field, packet, decode in FIELDS:
+            if self._stopping.is_set():
+                return True
+            future = self.dispatcher.poll(packet, address, self.reply_timeout)
+            try:
+                answer = future.result()
+            except TimeoutError:
+                return False
+            except RuntimeError:
+                # A VISCA error: the camera does not support this inquiry.
+                continue
+            except (CancelledError, OSError):
+                # The port has failed, or the dispatcher is closing.
+                return True
+
+            value = decode(answer)
+            if value is not None:
+                cache.set(field, value)
+        return True
+
+    def run(self):
+        while not self._stopping.is_set():
+            for address, cache in self.caches.items():
+                if self.silent.get(address, 0) > time.monotonic():
+                    continue
+                if not self._poll(address, cache):
+                    self.silent[address] = time.monotonic() + SILENT_BACKOFF
+            self._stopping.wait(self.interval)
+
+    def stop(self):
+        ''' Stop polling, after the inquiry in flight (if any). Call it before closing the dispatcher. '''
+        self._stopping.set()
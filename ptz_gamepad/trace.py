@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+#
+# Gamepad input trace recorder and replay
+# Licensed under GPL-3.0
+# ---
+# A trace is a compact binary log of every joystick event the input engine has applied
+# (axis, button and hat changes, hotplugging and quitting), each one timestamped.
+# Replaying it posts the very same events back into pygame's queue, so that any
+# controller script can be driven by a real operator session without a gamepad,
+# e.g. against the camera simulator to count the VISCA commands it produces.
+#
+# Recording: set PTZ_GAMEPAD_RECORD=session.trace before starting a gamepad script
+# (one trace per process: restarting the control loop carries on recording into it).
+# Replaying: python -m ptz_gamepad.trace replay session.trace --profile taffgo --speed 4
+#
+# File layout (little-endian):
+#   header  "PTZTRACE" + version (B)
+#   record  time since the previous record in microseconds (I), kind (B), instance id (B), index (B), value (h)
+#   a DEVICE_ADDED record is followed by the joystick snapshot:
+#           axis, button and hat counts (BBB), name length (B), name (UTF-8),
+#           axes (h each), buttons (B each), hats (bb each)
+
+import os
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from ptz_gamepad.inputs import JOYSTICK_EVENTS
+from ptz_gamepad.inputs import listening
+from threading import Lock
+from threading import Thread
+import argparse
+import atexit
+import contextlib
+import json
+import pygame
+import struct
+import sys
+import time
+
+MAGIC = b'PTZTRACE'
+VERSION = 1
+
+# Record kinds
+AXIS = 1
+BUTTON = 2
+HAT = 3
+DEVICE_ADDED = 4
+DEVICE_REMOVED = 5
+QUIT = 6
+
+_RECORD = struct.Struct('<IBBBh')
+_DEVICE = struct.Struct('<BBBB')
+
+# Axis values are stored as signed 16-bit fractions of the full deflection.
+_AXIS_SCALE = 32767
+
+# Time between two flushes of a trace being recorded (in second), so that a crash loses little of it
+FLUSH_INTERVAL = 1.0
+
+# How long a replayed script may take to open its ports and listen for the gamepad (in second)
+STARTUP_TIMEOUT = 10.0
+
+# The recorders of the process, by path (see shared_recorder())
+_recorders = {}
+_recorders_lock = Lock()
+
+def _pack_hat(value):
+    return (value[0] + 1) * 3 + (value[1] + 1)
+
+def _unpack_hat(value):
+    return (value // 3 - 1, value % 3 - 1)
+
+def _pack_axis(value):
+    return max(-_AXIS_SCALE, min(_AXIS_SCALE, int(round(value * _AXIS_SCALE))))
+
+class TraceJoystick(object):
+    ''' Stands in for the recorded joystick during a replay, with the controls it had when it got connected. '''
+
+    def __init__(self, instance_id, name, axes, buttons, hats):
+        self.instance_id = instance_id
+        self.name = name
+        self.axes = axes
+        self.buttons = buttons
+        self.hats = hats
+
+    def get_instance_id(self):
+        return self.instance_id
+
+    def get_name(self):
+        return self.name
+
+    def get_numaxes(self):
+        return len(self.axes)
+
+    def get_numbuttons(self):
+        return len(self.buttons)
+
+    def get_numhats(self):
+        return len(self.hats)
+
+    def get_axis(self, i):
+        return self.axes[i]
+
+    def get_button(self, i):
+        return self.buttons[i]
+
+    def get_hat(self, i):
+        return self.hats[i]
+
+class TraceRecorder(object):
+    ''' Writes the events applied by an InputEngine into a trace file. '''
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC + bytes([VERSION]))
+        self.last = time.monotonic()
+        self.flushed = self.last
+        self.records = 0
+
+    def _write(self, kind, instance_id, index=0, value=0):
+        if self.file.closed:
+            # The process is exiting.
+            return
+        now = time.monotonic()
+        delta = min(0xFFFFFFFF, int((now - self.last) * 1000000))
+        # Keep the rounding error from adding up over a long session.
+        self.last += delta / 1000000
+        self.file.write(_RECORD.pack(delta, kind, instance_id & 0xFF, index & 0xFF, value))
+        self.records += 1
+        if now - self.flushed >= FLUSH_INTERVAL:
+            self.flush()
+
+    def record(self, event, pad=None):
+        '''
+        Log a single pygame event, once it has been applied.
+        "pad" is the PadState of a newly connected joystick, whose controls are snapshotted.
+        '''
+        if event.type == pygame.JOYAXISMOTION:
+            self._write(AXIS, event.instance_id, event.axis, _pack_axis(event.value))
+        elif event.type == pygame.JOYBUTTONDOWN or event.type == pygame.JOYBUTTONUP:
+            self._write(BUTTON, event.instance_id, event.button, 1 if event.type == pygame.JOYBUTTONDOWN else 0)
+        elif event.type == pygame.JOYHATMOTION:
+            self._write(HAT, event.instance_id, event.hat, _pack_hat(event.value))
+        elif event.type == pygame.JOYDEVICEADDED and pad is not None:
+            name = pad.get_name().encode('utf-8')[:255]
+            self._write(DEVICE_ADDED, pad.instance_id)
+            self.file.write(_DEVICE.pack(len(pad.axes), len(pad.buttons), len(pad.hats), len(name)) + name)
+            self.file.write(struct.pack(f'<{len(pad.axes)}h', *[_pack_axis(v) for v in pad.axes]))
+            self.file.write(struct.pack(f'<{len(pad.buttons)}B', *[1 if v else 0 for v in pad.buttons]))
+            for hat in pad.hats:
+                self.file.write(struct.pack('<bb', *hat))
+        elif event.type == pygame.JOYDEVICEREMOVED:
+            self._write(DEVICE_REMOVED, event.instance_id)
+        elif event.type == pygame.QUIT:
+            self._write(QUIT, 0)
+            self.flush()
+
+    def flush(self):
+        if not self.file.closed:
+            self.file.flush()
+        self.flushed = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+def shared_recorder(path):
+    '''
+    The TraceRecorder of "path" for the whole process: the input engines built one after the
+    other (e.g. when a script restarts its control loop) keep adding to the same trace
+    instead of starting it over. It is closed when the process exits.
+    '''
+    with _recorders_lock:
+        recorder = _recorders.get(path)
+        if recorder is None:
+            recorder = _recorders[path] = TraceRecorder(path)
+            atexit.register(recorder.close)
+        return recorder
+
+def read_trace(path):
+    '''
+    Decode a trace file.
+    Returns a list of (time in second since the start, pygame event type, event attributes) tuples.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:len(MAGIC)] != MAGIC or len(data) <= len(MAGIC) or data[len(MAGIC)] != VERSION:
+        raise ValueError(f'{path} is not a gamepad trace file (version {VERSION})')
+
+    events = []
+    pos = len(MAGIC) + 1
+    now = 0.0
+    # A trace cut short (e.g. the program got killed) simply ends at its last whole record.
+    while pos + _RECORD.size <= len(data):
+        delta, kind, instance_id, index, value = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        now += delta / 1000000
+
+        if kind == AXIS:
+            events.append((now, pygame.JOYAXISMOTION, {'instance_id': instance_id, 'axis': index, 'value': value / _AXIS_SCALE}))
+        elif kind == BUTTON:
+            event_type = pygame.JOYBUTTONDOWN if value else pygame.JOYBUTTONUP
+            events.append((now, event_type, {'instance_id': instance_id, 'button': index}))
+        elif kind == HAT:
+            events.append((now, pygame.JOYHATMOTION, {'instance_id': instance_id, 'hat': index, 'value': _unpack_hat(value)}))
+        elif kind == DEVICE_ADDED:
+            if pos + _DEVICE.size > len(data):
+                break
+            num_axes, num_buttons, num_hats, name_length = _DEVICE.unpack_from(data, pos)
+            pos += _DEVICE.size
+            size = name_length + 2 * num_axes + num_buttons + 2 * num_hats
+            if pos + size > len(data):
+                break
+            name = data[pos:pos + name_length].decode('utf-8', 'replace')
+            pos += name_length
+            axes = [v / _AXIS_SCALE for v in struct.unpack_from(f'<{num_axes}h', data, pos)]
+            pos += 2 * num_axes
+            buttons = list(data[pos:pos + num_buttons])
+            pos += num_buttons
+            hats = [struct.unpack_from('<bb', data, pos + 2 * i) for i in range(num_hats)]
+            pos += 2 * num_hats
+            joystick = TraceJoystick(instance_id, name, axes, buttons, hats)
+            events.append((now, pygame.JOYDEVICEADDED, {'device_index': -1, 'joystick': joystick}))
+        elif kind == DEVICE_REMOVED:
+            events.append((now, pygame.JOYDEVICEREMOVED, {'instance_id': instance_id}))
+        elif kind == QUIT:
+            events.append((now, pygame.QUIT, {}))
+        else:
+            raise ValueError(f'Unknown record kind {kind} in {path}')
+
+    return events
+
+class TraceReplayer(Thread):
+    '''
+    Posts the events of a trace into pygame's event queue, "speed" times faster than they were recorded.
+    With speed=0 the events are posted as fast as the controller consumes them: every batch of events
+    recorded at the same time is only posted once the previous one has left the queue.
+    '''
+
+    def __init__(self, events, speed=1.0):
+        Thread.__init__(self, name='TraceReplayer', daemon=True)
+        self.events = events
+        self.speed = speed
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        start = time.monotonic()
+        previous = None
+        for offset, event_type, attrs in self.events:
+            if not self.running:
+                break
+
+            if self.speed > 0:
+                delay = start + offset / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            elif offset != previous:
+                while self.running and pygame.event.peek(JOYSTICK_EVENTS):
+                    time.sleep(0.0005)
+            previous = offset
+
+            pygame.event.post(pygame.event.Event(event_type, attrs))
+
+def replay(path, profile, speed=1.0, port=None, baudrate=9600):
+    '''
+    Replay a trace against the main() of a gamepad script ("taffgo", "xbox360", ...).
+    Without a port, a simulated camera is started, and the VISCA traffic it got is returned as a dict.
+    '''
+    import importlib
+
+    events = read_trace(path)
+    if not events or events[-1][1] != pygame.QUIT:
+        # Let the script end once the trace is over.
+        events.append(((events[-1][0] if events else 0.0) + 0.5, pygame.QUIT, {}))
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.joystick.init()
+
+    simulator = None
+    if port is None:
+        from ptz_gamepad.simulator import ViscaSimulator
+        simulator = ViscaSimulator(baudrate=baudrate)
+        simulator.start()
+        port = simulator.port
+
+    module = importlib.import_module(f'gamepad_{profile}')
+    worker = Thread(target=module.main, args=(port,), daemon=True)
+    listening.clear()
+    worker.start()
+
+    # Wait for the script to subscribe to the joystick events, which flushes the queue.
+    if not listening.wait(STARTUP_TIMEOUT):
+        raise RuntimeError(f'The {profile} script did not listen for the gamepad within {STARTUP_TIMEOUT:.0f} s')
+    start = time.monotonic()
+    replayer = TraceReplayer(events, speed)
+    replayer.start()
+    replayer.join()
+    worker.join(10.0)
+    duration = time.monotonic() - start
+
+    result = {'events': len(events), 'recorded_seconds': events[-1][0], 'replay_seconds': duration}
+    if simulator is not None:
+        # Let the last replies go out.
+        time.sleep(0.5)
+        simulator.stop()
+        with simulator.lock:
+            result.update({
+                'packets': simulator.packets_received,
+                'bytes': simulator.bytes_received,
+                'errors': simulator.errors_sent,
+            })
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or replay a gamepad input trace.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    info = commands.add_parser('info', help='Print the event counts of a trace')
+    info.add_argument('trace')
+
+    play = commands.add_parser('replay', help='Replay a trace against a gamepad script')
+    play.add_argument('trace')
+    play.add_argument('--profile', required=True, choices=('taffgo', 'xbox360', 'ps4', 'microntek'))
+    play.add_argument('--speed', type=float, default=1.0, help='Replay speed factor, 0 for as fast as possible (default: 1)')
+    play.add_argument('--port', help='Serial port of a real camera (default: start a simulated one)')
+    play.add_argument('--baud', type=int, default=9600, help='Simulated serial line speed (default: 9600)')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        events = read_trace(args.trace)
+        counts = {}
+        for _, event_type, _ in events:
+            name = pygame.event.event_name(event_type)
+            counts[name] = counts.get(name, 0) + 1
+        print(json.dumps({'events': len(events), 'seconds': events[-1][0] if events else 0.0, 'counts': counts}, indent=2))
+    else:
+        # Keep the console output of the script out of the JSON result.
+        with contextlib.redirect_stdout(sys.stderr):
+            result = replay(args.trace, args.profile, args.speed, args.port, args.baud)
+        print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+#
+# VISCA over IP transport
+# Licensed under GPL-3.0
+# ---
+# A 9600 baud serial link carries about 1000 bytes per second. The cameras that speak
+# VISCA over IP take the same packets over UDP (port 52381) instead, each in a message
+# with an 8-byte header: payload type (2 bytes), payload length (2 bytes) and a sequence
+# number (4 bytes). The camera answers with the sequence number of the message it replies to.
+# ---
+# ViscaIPPort has the interface of the serial port that visca.PTZ and the ReplyReader use
+# (write, read, in_waiting, cancel_read, close, ...), so the dispatchers drive a network
+# camera exactly like a serial one: just give "udp://192.168.0.100" (or "udp://host:port")
+# as the port of a camera. Over UDP a message may be lost, duplicated or overtaken:
+#   - a message that gets no reply in time is sent again with the same sequence number,
+#     up to RETRANSMIT_TRIES times;
+#   - the duplicate replies (to a message sent twice) are dropped;
+#   - a Completion that overtakes its ACK is preceded by the ACK it implies, and the late
+#     ACK is dropped, so the dispatcher sees the replies of every command in order.
+# -> SOURCE: Sony, "VISCA over IP" command list, section "Communication specifications"
+
+from collections import OrderedDict
+from ptz_gamepad import log
+from ptz_gamepad import metrics
+from threading import Condition
+from threading import Thread
+import socket
+import time
+
+# Default UDP port of the cameras
+VISCA_IP_PORT = 52381
+
+# Payload types of the header
+TYPE_COMMAND = 0x0100
+TYPE_INQUIRY = 0x0110
+TYPE_REPLY = 0x0111
+TYPE_CONTROL = 0x0200
+TYPE_CONTROL_REPLY = 0x0201
+
+# Control payloads: reset the sequence number, and the errors of the camera
+CONTROL_RESET = b'\x01'
+CONTROL_SEQUENCE_ERROR = b'\x0f\x01'
+CONTROL_MESSAGE_ERROR = b'\x0f\x02'
+
+# How long to wait for the first reply to a message before sending it again (in second)
+RETRANSMIT_TIMEOUT = 0.1
+RETRANSMIT_TRIES = 3
+# Sequence numbers remembered to recognize the duplicate and late replies
+REPLY_HISTORY = 256
+
+SCHEME = 'udp://'
+
+RETRANSMITS = metrics.counter('ptz_visca_ip_retransmits_total', 'VISCA over IP messages sent again after getting no reply', ('port',))
+LOST = metrics.counter('ptz_visca_ip_lost_total', 'VISCA over IP messages given up after every retransmission', ('port',))
+REORDERED = metrics.counter('ptz_visca_ip_reordered_total', 'VISCA over IP Completions received before their ACK', ('port',))
+DUPLICATES = metrics.counter('ptz_visca_ip_duplicates_total', 'Duplicate VISCA over IP replies dropped', ('port',))
+
+def is_ip_port(name):
+    return name.startswith(SCHEME)
+
+def parse_address(name):
+    ''' The (host, port) of a "udp://host[:port]" camera. Raises ValueError if it is not one. '''
+    if not is_ip_port(name):
+        raise ValueError(f'{name} is not a VISCA over IP camera (udp://host[:port])')
+    host, _, port = name[len(SCHEME):].rstrip('/').rpartition(':')
+    if not host:
+        return (port, VISCA_IP_PORT)
+    try:
+        return (host.strip('[]'), int(port))
+    except ValueError:
+        raise ValueError(f'Invalid UDP port in {name}')
+
+def pack(kind, payload, sequence):
+    ''' A VISCA over IP message: the header, then the payload. '''
+    return kind.to_bytes(2, 'big') + len(payload).to_bytes(2, 'big') + (sequence & 0xFFFFFFFF).to_bytes(4, 'big') + payload
+
+def unpack(message):
+    ''' The (type, sequence number, payload) of a message, or None if it is malformed. '''
+    if len(message) < 8:
+        return None
+    length = int.from_bytes(message[2:4], 'big')
+    if len(message) < 8 + length:
+        return None
+    return (int.from_bytes(message[0:2], 'big'), int.from_bytes(message[4:8], 'big'), bytes(message[8:8 + length]))
+
+def _remember(history, sequence):
+    history[sequence] = True
+    if len(history) > REPLY_HISTORY:
+        history.popitem(last=False)
+
+class ViscaIPPort(object):
+    '''
+    A VISCA over IP camera behind the interface of a serial port (as far as visca.PTZ,
+    AddressedPTZ and the ReplyReader use it). Every VISCA packet written goes out in a
+    message of its own, and the reply packets come back in order on read().
+    A thread of its own receives the replies and sends the unanswered messages again.
+    '''
+
+    def __init__(self, name, timeout=RETRANSMIT_TIMEOUT, tries=RETRANSMIT_TRIES):
+        self.name = name
+        self.address = parse_address(name)
+        self.timeout = timeout
+        self.tries = tries
+        self.is_open = False
+
+        self._cond = Condition()
+        self._socket = None
+        self._thread = None
+        self._sequence = 0
+        self._buffer = bytearray()
+        self._cancelled = False
+        self._error = None
+        # Sequence number -> [message, time of the next retransmission, retransmissions left]
+        self._unanswered = {}
+        self._acked = OrderedDict()
+        self._finished = OrderedDict()
+        self.open()
+
+    def __str__(self):
+        return self.name
+
+    def open(self):
+        if self.is_open:
+            return
+        sock = socket.socket(socket.AF_INET6 if ':' in self.address[0] else socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.connect(self.address)
+            sock.settimeout(self.timeout / 2)
+        except OSError:
+            sock.close()
+            raise
+        with self._cond:
+            self._socket = sock
+            self._sequence = 0
+            self._buffer.clear()
+            self._unanswered.clear()
+            self._acked.clear()
+            self._finished.clear()
+            self._error = None
+            self.is_open = True
+        self._thread = Thread(target=self._receive, args=(sock,), name='ViscaIPPort', daemon=True)
+        self._thread.start()
+        # Start the camera's sequence numbers over; its answer is not needed.
+        sock.send(pack(TYPE_CONTROL, CONTROL_RESET, 0))
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        with self._cond:
+            if not self.is_open:
+                return
+            self.is_open = False
+            sock, self._socket = self._socket, None
+            self._cond.notify_all()
+        sock.close()
+
+    def write(self, data):
+        ''' Send every VISCA packet of "data" (bytes ending with FF) in a message. '''
+        with self._cond:
+            if not self.is_open:
+                raise OSError(f'{self.name} is closed')
+            if self._error is not None:
+                raise self._error
+            sock = self._socket
+            messages = []
+            start = 0
+            while start < len(data):
+                end = data.find(b'\xff', start) + 1 or len(data)
+                packet = bytes(data[start:end])
+                start = end
+                self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+                kind = TYPE_INQUIRY if len(packet) > 1 and packet[1] == 0x09 else TYPE_COMMAND
+                message = pack(kind, packet, self._sequence)
+                self._unanswered[self._sequence] = [message, time.monotonic() + self.timeout, self.tries]
+                messages.append(message)
+        for message in messages:
+            sock.send(message)
+        return len(data)
+
+    def _receive(self, sock):
+        while True:
+            try:
+                message = sock.recv(2048)
+            except socket.timeout:
+                message = None
+            except OSError as e:
+                with self._cond:
+                    if sock is not self._socket:
+                        # Closed (or replaced by a reopened socket).
+                        return
+                    # e.g. ICMP port unreachable: report it on the next read or write.
+                    self._error = e
+                    self._cond.notify_all()
+                time.sleep(self.timeout)
+                continue
+
+            with self._cond:
+                if sock is not self._socket:
+                    return
+                if message is not None:
+                    self._on_message(message)
+                resend = self._due(time.monotonic())
+            for message in resend:
+                try:
+                    sock.send(message)
+                except OSError:
+                    pass
+
+    def _due(self, now):
+        ''' The messages to send again now, giving up on those that have had their retransmissions. '''
+        resend = []
+        for sequence, pending in list(self._unanswered.items()):
+            if pending[1] > now:
+                continue
+            if pending[2] <= 0:
+                del self._unanswered[sequence]
+                LOST.inc(self.name)
+                if log.tracing:
+                    log.trace('No reply to message %d after %d retransmissions', sequence, self.tries, port=self.name)
+                continue
+            pending[1] = now + self.timeout
+            pending[2] -= 1
+            RETRANSMITS.inc(self.name)
+            resend.append(pending[0])
+        return resend
+
+    def _on_message(self, message):
+        unpacked = unpack(message)
+        if unpacked is None:
+            return
+        kind, sequence, payload = unpacked
+        if kind == TYPE_CONTROL_REPLY:
+            if payload in (CONTROL_SEQUENCE_ERROR, CONTROL_MESSAGE_ERROR):
+                log.warning('The camera reports a %s error', 'sequence number' if payload == CONTROL_SEQUENCE_ERROR else 'message', port=self.name)
+            return
+        if kind != TYPE_REPLY or len(payload) < 3:
+            return
+
+        # Any reply means the message has arrived.
+        self._unanswered.pop(sequence, None)
+        if sequence in self._finished:
+            DUPLICATES.inc(self.name)
+            return
+        kind = payload[1] & 0xF0
+        if kind == 0x40:
+            if sequence in self._acked:
+                DUPLICATES.inc(self.name)
+                return
+            _remember(self._acked, sequence)
+        else:
+            # A Completion (or error) for a socket that has not been ACKed yet has overtaken the ACK.
+            socket_number = payload[1] & 0x0F
+            if socket_number and sequence not in self._acked and (kind == 0x60 or len(payload) == 3):
+                REORDERED.inc(self.name)
+                self._buffer += bytes([payload[0], 0x40 | socket_number, 0xFF])
+            self._acked.pop(sequence, None)
+            _remember(self._finished, sequence)
+        self._buffer += payload
+        self._cond.notify_all()
+
+    @property
+    def in_waiting(self):
+        return len(self._buffer)
+
+    def read(self, size=1):
+        '''
+        Read up to "size" bytes of replies, waiting for at least one.
+        Returns b'' if cancel_read() is called while waiting, or has been called since the last read had to wait.
+        '''
+        with self._cond:
+            while not self._buffer:
+                if not self.is_open:
+                    raise OSError(f'{self.name} is closed')
+                if self._error is not None:
+                    raise self._error
+                if self._cancelled:
+                    # The cancel is consumed here, so that one issued just before the read is not lost.
+                    self._cancelled = False
+                    return b''
+                self._cond.wait()
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            return data
+
+    def read_all(self):
+        with self._cond:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            return data
+
+    def cancel_read(self):
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._buffer.clear()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+# Test fixtures
+# Licensed under GPL-3.0
+# ---
+# The tests that talk to a camera run against the simulator (see ptz_gamepad/simulator.py):
+# a pseudo-terminal camera for the serial ones (POSIX only), a local UDP one for VISCA over IP.
+
+import pytest
+import time
+
+def wait_until(condition, timeout=2.0):
+    ''' Poll "condition" until it is true, for at most "timeout" seconds. Returns its last value. '''
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+@pytest.fixture
+def simulator():
+    ''' A simulated camera (address 1) on a pseudo-terminal. '''
+    pytest.importorskip('pty')
+    from ptz_gamepad.simulator import ViscaSimulator
+
+    sim = ViscaSimulator()
+    sim.start()
+    yield sim
+    sim.stop()
+    sim.join(1.0)
+
+@pytest.fixture
+def dispatcher(simulator):
+    ''' A running ViscaDispatcher driving the simulated camera. '''
+    from ptz_gamepad.cameras import AddressedPTZ
+    from ptz_gamepad.dispatcher import ViscaDispatcher
+
+    dispatcher = ViscaDispatcher(AddressedPTZ(simulator.port)).start()
+    yield dispatcher
+    dispatcher.close()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Tests of the stick conditioning (ptz_gamepad/conditioning.py)
+# Licensed under GPL-3.0
+
+from ptz_gamepad.conditioning import Curve
+from ptz_gamepad.conditioning import StickConditioner
+from ptz_gamepad.conditioning import parse_conditioning
+from ptz_gamepad.conditioning import parse_filter
+import pytest
+
+def test_radial_deadzone_rests_and_rescales():
+    stick = StickConditioner(deadzone=0.1)
+    assert not stick.update(0.05, 0.05)
+    assert stick.values == (0.0, 0.0)
+    assert stick.update(1.0, 0.0)
+    assert stick.values == (1.0, 0.0)
+    stick.update(0.55, 0.0)
+    assert stick.values == (0.5, 0.0)
+
+def test_drift_of_the_other_axis_does_not_count():
+    stick = StickConditioner(deadzone=0.1)
+    stick.update(0.8, 0.05)
+    assert stick.values[1] == 0.0
+
+def test_rest_value_of_the_layout_is_the_center():
+    stick = StickConditioner(center=0.004)
+    stick.update(0.004, 0.004)
+    assert stick.values == (0.0, 0.0)
+
+def test_jitter_below_the_resolution_does_not_move():
+    stick = StickConditioner()
+    assert stick.update(0.5, 0.0)
+    assert not stick.update(0.50001, 0.0)
+
+def test_axial_deadzone_of_a_single_axis():
+    stick = StickConditioner(axes=1, deadzone=0.2)
+    stick.update(-0.15)
+    assert stick.values == (0.0,)
+    stick.update(-0.6)
+    assert stick.values == (-0.5,)
+
+def test_curves():
+    assert Curve(2.0)(-0.5) == -0.25
+    curve = Curve([[0.5, 0.2]])
+    assert curve(0.25) == pytest.approx(0.1)
+    assert curve(0.75) == pytest.approx(0.6)
+    with pytest.raises(ValueError):
+        Curve(0)
+    with pytest.raises(ValueError):
+        Curve([[2.0, 1.0]])
+
+@pytest.mark.parametrize('spec', [{'type': 'lowpass', 'cutoff': 2.0}, {'type': 'one_euro', 'min_cutoff': 1.0, 'beta': 0.5}])
+def test_filter_settles_on_a_stick_held_still(spec):
+    stick = StickConditioner(filter=parse_filter(spec))
+    now = 0.0
+    for val in (0.3, 0.6, 1.0):
+        now += 0.01
+        stick.update(val, 0.0, now=now)
+    # The filter lags behind the stick ...
+    assert stick.settling
+    assert stick.values[0] < 1.0
+
+    # ... and catches up with it on the settling ticks, without any new input.
+    for _ in range(200):
+        if not stick.settling:
+            break
+        now += 0.02
+        stick.update(1.0, 0.0, now=now)
+    assert not stick.settling
+    assert stick.values == (1.0, 0.0)
+
+def test_filtered_stick_rests_at_once():
+    stick = StickConditioner(filter=parse_filter({'type': 'lowpass', 'cutoff': 1.0}))
+    stick.update(0.5, 0.0, now=0.0)
+    stick.update(1.0, 0.0, now=0.01)
+    stick.update(0.0, 0.0, now=0.02)
+    assert stick.values == (0.0, 0.0)
+    assert not stick.settling
+
+def test_unfiltered_stick_never_settles():
+    stick = StickConditioner()
+    stick.update(0.7, 0.2)
+    assert not stick.settling
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        parse_filter({'type': 'kalman'})
+    with pytest.raises(ValueError):
+        parse_filter({'type': 'lowpass', 'cutoff': 0})
+    with pytest.raises(ValueError):
+        parse_conditioning({'deadzone': 1.5})
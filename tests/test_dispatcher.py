@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Tests of the command dispatcher (ptz_gamepad/dispatcher.py), against the simulated camera
+# Licensed under GPL-3.0
+
+from ptz_gamepad.packets import POWER_INQ
+from ptz_gamepad.packets import pan_tilt_absolute
+from ptz_gamepad.packets import pan_tilt_drive
+from ptz_gamepad.packets import power_state
+from ptz_gamepad.packets import zoom_direct
+from tests.conftest import wait_until
+import binascii
+import time
+
+def _received(simulator, prefix):
+    ''' The packets the camera got that start with "prefix" (hexadecimal). '''
+    prefix = binascii.unhexlify(prefix)
+    with simulator.lock:
+        return [packet for _, packet in simulator.received if packet.startswith(prefix)]
+
+def test_commands_of_a_slot_coalesce_into_the_newest(dispatcher, simulator):
+    packets = [pan_tilt_drive(('left', speed), None) for speed in range(1, 25)]
+    for packet in packets:
+        dispatcher.send('pan_tilt', 'comm', packet)
+
+    last = binascii.unhexlify(packets[-1])
+    assert wait_until(lambda: last in _received(simulator, '81010601'))
+    drives = _received(simulator, '81010601')
+    # The stick sweep did not build a backlog: most commands were replaced before going out.
+    assert len(drives) < len(packets) // 2
+    assert drives[-1] == last
+
+def test_commands_without_a_slot_are_all_sent_in_order(dispatcher, simulator):
+    packets = [pan_tilt_drive(('right', speed), None) for speed in (1, 2, 3)]
+    for packet in packets:
+        dispatcher.send(None, 'comm', packet)
+
+    assert wait_until(lambda: len(_received(simulator, '81010601')) == 3)
+    assert _received(simulator, '81010601') == [binascii.unhexlify(packet) for packet in packets]
+
+def test_third_command_waits_for_a_free_socket(dispatcher, simulator):
+    # Each move holds a socket of the camera for about a second: 500 pan units at 5 x 100 units/s,
+    # and 0x2000 zoom units at 8 x 600 units/s.
+    moves = [pan_tilt_absolute(500, 0, 5, 5), zoom_direct(0x2000), pan_tilt_absolute(-500, 0, 5, 5)]
+    for packet in moves:
+        dispatcher.send(None, 'comm', packet)
+
+    assert wait_until(lambda: len(_received(simulator, '8101')) == 2)
+    time.sleep(0.3)
+    # Both sockets are busy: the third move is held back instead of being refused.
+    assert len(_received(simulator, '8101')) == 2
+    assert wait_until(lambda: len(_received(simulator, '8101')) == 3, timeout=3.0)
+    assert simulator.errors_sent == 0
+
+def test_inquiry_returns_the_answer(dispatcher):
+    answer = dispatcher.inquire(POWER_INQ, timeout=2.0)
+    assert answer == b'\x90\x50\x02\xff'
+    assert power_state(answer) == 1
+
+def test_inquiry_goes_out_after_the_queued_commands(dispatcher, simulator):
+    dispatcher.send('pan_tilt', 'comm', pan_tilt_drive(('left', 3), None))
+    dispatcher.inquire(POWER_INQ, timeout=2.0)
+    drive = _received(simulator, '81010601')
+    with simulator.lock:
+        packets = [packet for _, packet in simulator.received]
+    assert packets.index(drive[0]) < packets.index(binascii.unhexlify(POWER_INQ))
+
+def test_poll_waits_for_the_idle_port(dispatcher, simulator):
+    future = dispatcher.poll(POWER_INQ)
+    assert power_state(future.result(2.0)) == 1
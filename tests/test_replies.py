@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+#
+# Tests of the VISCA reply parsing (ptz_gamepad/replies.py)
+# Licensed under GPL-3.0
+
+from ptz_gamepad.replies import ACK
+from ptz_gamepad.replies import ANSWER
+from ptz_gamepad.replies import COMPLETION
+from ptz_gamepad.replies import ERROR
+from ptz_gamepad.replies import ERROR_BUFFER_FULL
+from ptz_gamepad.replies import ERROR_NOT_EXECUTABLE
+from ptz_gamepad.replies import parse_reply
+
+def test_ack_and_completion_carry_the_socket():
+    assert parse_reply(b'\x90\x41\xff') == (ACK, 1, None)
+    assert parse_reply(b'\x90\x52\xff') == (COMPLETION, 2, None)
+
+def test_error_carries_its_code():
+    assert parse_reply(b'\x90\x60\x03\xff') == (ERROR, 0, ERROR_BUFFER_FULL)
+    assert parse_reply(b'\x90\x61\x41\xff') == (ERROR, 1, ERROR_NOT_EXECUTABLE)
+
+def test_inquiry_answer_carries_its_data():
+    assert parse_reply(b'\x90\x50\x02\xff') == (ANSWER, 0, b'\x02')
+    assert parse_reply(b'\x90\x50\x00\x01\x02\x03\xff') == (ANSWER, 0, b'\x00\x01\x02\x03')
+
+def test_replies_of_other_cameras_keep_their_socket():
+    # Camera 2 answers with A0.
+    assert parse_reply(b'\xa0\x42\xff') == (ACK, 2, None)
+
+def test_not_a_reply():
+    assert parse_reply(b'\xff') is None
+    assert parse_reply(b'\x90\xff') is None
+    # A command (8x 01 ...) is not a reply, nor is a packet without the high bit.
+    assert parse_reply(b'\x81\x01\x06\x04\xff') is None
+    assert parse_reply(b'\x10\x41\xff') is None
+    assert parse_reply(b'\x90\x30\x02\xff') is None
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+#
+# Tests of the speed quantizer (ptz_gamepad/speed.py)
+# Licensed under GPL-3.0
+
+from ptz_gamepad.speed import PAN_SPEED_MAX
+from ptz_gamepad.speed import SpeedQuantizer
+
+def test_rest_and_full_deflection():
+    quantizer = SpeedQuantizer(PAN_SPEED_MAX)
+    assert quantizer(0.0) == 0
+    assert quantizer(1.0) == PAN_SPEED_MAX
+    assert quantizer(-1.0) == PAN_SPEED_MAX
+    assert quantizer(0.001) == 1
+
+def test_steps_cover_equal_intervals():
+    assert [SpeedQuantizer(10)(val) for val in (0.05, 0.1, 0.11, 0.55, 0.95)] == [1, 1, 2, 6, 10]
+
+def test_max_speed_rescales_the_deflection():
+    quantizer = SpeedQuantizer(PAN_SPEED_MAX)
+    assert quantizer(1.0, 7) == 7
+    assert quantizer(0.5, 7) == 4
+    assert quantizer(0.01, 7) == 1
+    # Beyond the range of the camera, the max speed is capped.
+    assert quantizer(1.0, 99) == PAN_SPEED_MAX
+
+def test_hysteresis_holds_the_step_while_wobbling():
+    quantizer = SpeedQuantizer(10)
+    assert quantizer(0.35) == 4
+    # Within 0.3 step below the step's interval (3, 4]: still step 4.
+    assert quantizer(0.31) == 4
+    assert quantizer(0.28) == 4
+    # Clearly into step 3.
+    assert quantizer(0.26) == 3
+    # ... and back up only past 0.3 step above it.
+    assert quantizer(0.32) == 3
+    assert quantizer(0.34) == 4
+
+def test_rest_forgets_the_step():
+    quantizer = SpeedQuantizer(10)
+    assert quantizer(0.35) == 4
+    assert quantizer(0.0) == 0
+    assert quantizer(0.28) == 3
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Tests of VISCA over IP (ptz_gamepad/viscaip.py): retransmission, reordered and duplicate replies
+# Licensed under GPL-3.0
+
+from ptz_gamepad.packets import POWER_INQ
+from ptz_gamepad.packets import power_state
+from ptz_gamepad.viscaip import CONTROL_RESET
+from ptz_gamepad.viscaip import TYPE_COMMAND
+from ptz_gamepad.viscaip import TYPE_CONTROL
+from ptz_gamepad.viscaip import TYPE_REPLY
+from ptz_gamepad.viscaip import ViscaIPPort
+from ptz_gamepad.viscaip import pack
+from ptz_gamepad.viscaip import unpack
+from tests.conftest import wait_until
+import pytest
+import socket
+import time
+
+MOVE = b'\x81\x01\x06\x04\xff'
+
+@pytest.fixture
+def camera():
+    ''' A UDP socket standing for the camera: it answers only what the test sends. '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(1.0)
+    yield sock
+    sock.close()
+
+@pytest.fixture
+def port(camera):
+    port = ViscaIPPort(f'udp://127.0.0.1:{camera.getsockname()[1]}', timeout=0.05, tries=2)
+    yield port
+    port.close()
+
+def _messages(camera, duration):
+    ''' The (type, sequence number, payload, sender) of the messages the camera gets for "duration" seconds. '''
+    messages = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        camera.settimeout(max(deadline - time.monotonic(), 0.001))
+        try:
+            message, sender = camera.recvfrom(2048)
+        except socket.timeout:
+            break
+        messages.append(unpack(message) + (sender,))
+    return messages
+
+def test_unanswered_message_is_sent_again_then_given_up(camera, port):
+    port.write(MOVE)
+    messages = _messages(camera, 0.5)
+    assert messages[0][:3] == (TYPE_CONTROL, 0, CONTROL_RESET)
+    # The message, then its 2 retransmissions, and nothing after that.
+    assert [message[:3] for message in messages[1:]] == [(TYPE_COMMAND, 1, MOVE)] * 3
+
+def test_reply_stops_the_retransmission(camera, port):
+    port.write(MOVE)
+    _, _, _, sender = _messages(camera, 0.02)[-1]
+    camera.sendto(pack(TYPE_REPLY, b'\x90\x41\xff', 1), sender)
+    # At most the retransmission already on its way.
+    assert len(_messages(camera, 0.3)) <= 1
+
+def test_completion_before_its_ack(camera, port):
+    port.write(MOVE)
+    _, _, _, sender = _messages(camera, 0.02)[-1]
+    camera.sendto(pack(TYPE_REPLY, b'\x90\x51\xff', 1), sender)
+    camera.sendto(pack(TYPE_REPLY, b'\x90\x41\xff', 1), sender)
+    # The ACK is put back in front of the Completion, and the late one is dropped.
+    assert wait_until(lambda: port.in_waiting >= 6)
+    time.sleep(0.1)
+    assert port.read_all() == b'\x90\x41\xff\x90\x51\xff'
+
+def test_duplicate_replies_are_dropped(camera, port):
+    port.write(MOVE)
+    _, _, _, sender = _messages(camera, 0.02)[-1]
+    for reply in (b'\x90\x41\xff', b'\x90\x41\xff', b'\x90\x51\xff', b'\x90\x51\xff'):
+        camera.sendto(pack(TYPE_REPLY, reply, 1), sender)
+    assert wait_until(lambda: port.in_waiting >= 6)
+    time.sleep(0.1)
+    assert port.read_all() == b'\x90\x41\xff\x90\x51\xff'
+
+def test_inquiries_through_a_lossy_network():
+    from ptz_gamepad.cameras import AddressedPTZ
+    from ptz_gamepad.dispatcher import ViscaDispatcher
+    from ptz_gamepad.simulator import UdpViscaSimulator
+
+    sim = UdpViscaSimulator(loss=0.1, reorder=0.2, seed=1)
+    sim.start()
+    dispatcher = ViscaDispatcher(AddressedPTZ(sim.port)).start()
+    try:
+        for _ in range(20):
+            assert power_state(dispatcher.inquire(POWER_INQ, timeout=2.0)) == 1
+    finally:
+        dispatcher.close()
+        sim.stop()
+        sim.join(1.0)